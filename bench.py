@@ -0,0 +1,310 @@
+# End-to-end benchmark of the pipeline on a synthetic corpus. Generates abstracts, word
+# embeddings, hidden states and paper metadata at a given scale, runs every stage in its
+# own process so that its peak memory is measured in isolation, and compares the median
+# wall time and peak memory of repeated runs of each stage to a JSON baseline. Runs
+# offline on a CPU.
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+from data_utils import convert_embeddings, create_states, commit_states, peak_rss
+
+# number of papers for each named scale
+SCALES = {"small": 10000, "medium": 100000, "large": 1000000}
+# stages in the order they run in the pipeline
+STAGES = ["embeddings_text", "embeddings_store", "vectorize", "vectorize_packed", "minibatches",
+		  "lda_corpus", "state_extraction", "knn_exact", "knn_index", "knn_query", "titles", "get_titles"]
+
+def generate(workdir, num_papers, vocab_size=20000, embed_size=200, hidden_size=300,
+			 mean_length=150, oov_rate=0.05, seed=0, chunk_size=100000):
+	"""
+	Writes a synthetic dataset of @num_papers papers to @workdir: GloVe embeddings (as text
+	and as a binary store), a packed corpus whose token frequencies follow a Zipf law, a
+	binary hidden state file, and a metadata store with a title for every paper.
+	"""
+	from metadata import MetadataStore
+	start = time.time()
+	rng = np.random.RandomState(seed)
+	if not os.path.exists(workdir): os.makedirs(workdir)
+	words = ["w%i" % i for i in range(vocab_size)]
+	# embeddings, written once as text and converted into the binary store
+	with open(os.path.join(workdir, "embeddings.txt"), "w") as f:
+		for start_row in range(0, vocab_size, chunk_size):
+			vectors = rng.standard_normal((min(chunk_size, vocab_size-start_row), embed_size))
+			for word, vector in zip(words[start_row:], vectors):
+				f.write(word + " " + " ".join("%.6f" % v for v in vector) + "\n")
+	convert_embeddings(os.path.join(workdir, "embeddings.txt"), dtype=np.float32)
+	# a second copy without a binary store, to time the text parser
+	if os.path.exists(os.path.join(workdir, "embeddings_text.txt")): os.remove(os.path.join(workdir, "embeddings_text.txt"))
+	os.link(os.path.join(workdir, "embeddings.txt"), os.path.join(workdir, "embeddings_text.txt"))
+	# packed corpus: the corpus vocabulary is the embedding vocabulary, some words that
+	# have no embedding, and the empty token that ends every tokenized abstract
+	num_oov = max(int(vocab_size*oov_rate), 1)
+	corpus_vocab = words + ["oov%i" % i for i in range(num_oov)] + [""]
+	ids = ["%07i" % i for i in range(num_papers)]
+	prefix = os.path.join(workdir, "corpus")
+	lengths = np.clip(rng.normal(mean_length, mean_length/3, num_papers), 10, 4*mean_length).astype(np.int64)
+	with open(prefix + ".tokens", "wb") as f:
+		for start_row in range(0, num_papers, chunk_size):
+			chunk_lengths = lengths[start_row:(start_row+chunk_size)]
+			tokens = (rng.zipf(1.3, chunk_lengths.sum()) - 1) % (len(corpus_vocab) - 1)
+			# end each abstract with the empty token
+			ends = np.cumsum(chunk_lengths)
+			tokens[ends-1] = len(corpus_vocab) - 1
+			tokens.astype(np.int32).tofile(f)
+	np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64).tofile(prefix + ".offsets")
+	with open(prefix + ".ids", "w") as f:
+		f.write("".join(paper_id + "\n" for paper_id in ids))
+	with open(prefix + ".vocab", "w") as f:
+		f.write("".join(token + "\n" for token in corpus_vocab))
+	# hidden states
+	states = create_states(os.path.join(workdir, "hidden_states"), ids, hidden_size, np.float32)
+	for start_row in range(0, num_papers, chunk_size):
+		states[start_row:(start_row+chunk_size)] = rng.standard_normal((min(chunk_size, num_papers-start_row), hidden_size))
+	commit_states(os.path.join(workdir, "hidden_states"), states)
+	# metadata store
+	if os.path.exists(os.path.join(workdir, "db.sqlite")): os.remove(os.path.join(workdir, "db.sqlite"))
+	db = MetadataStore(os.path.join(workdir, "db.sqlite"))
+	for start_row in range(0, num_papers, chunk_size):
+		db.upsert_many({"_rawid": paper_id, "_version": 1, "title": "Synthetic paper %s" % paper_id, "summary": ""}
+					   for paper_id in ids[start_row:(start_row+chunk_size)])
+	db.close()
+	with open(os.path.join(workdir, "params.json"), "w") as f:
+		json.dump({"num_papers": num_papers, "vocab_size": vocab_size, "embed_size": embed_size,
+				   "hidden_size": hidden_size, "mean_length": mean_length, "seed": seed}, f)
+	print("Generated %i synthetic papers in %s. Time taken: %.2f seconds." % (num_papers, workdir, time.time()-start))
+
+def load_vectorized(workdir, max_length):
+	"""
+	Helper function that vectorizes the synthetic corpus for the stages that start from it.
+	"""
+	from corpus import PackedCorpus, vectorize_packed
+	from data_utils import load_embeddings_array, add_null_token, build_vocab_index
+	vocab, embeddings = load_embeddings_array(os.path.join(workdir, "embeddings.txt"), None)
+	vocab, embeddings = add_null_token(vocab, embeddings)
+	vectorized, lengths = vectorize_packed(PackedCorpus(os.path.join(workdir, "corpus")), build_vocab_index(vocab), max_length)
+	return(vectorized, lengths, embeddings)
+
+def run_stage(stage, workdir, args):
+	"""
+	Runs one stage on the synthetic dataset in @workdir and returns the number of items
+	it processed and the seconds it took. Setup that is not part of the stage is not timed.
+	"""
+	params = json.load(open(os.path.join(workdir, "params.json")))
+	num_papers = params["num_papers"]
+	if stage in ("embeddings_text", "embeddings_store"):
+		from data_utils import load_embeddings_array
+		fpath = os.path.join(workdir, "embeddings_text.txt" if stage == "embeddings_text" else "embeddings.txt")
+		start = time.time()
+		vocab, embeddings = load_embeddings_array(fpath, params["vocab_size"])
+		# touch every page of the memory-mapped store, as the graph does
+		float(np.asarray(embeddings).sum())
+		return(len(vocab), time.time()-start)
+	if stage == "vectorize":
+		from corpus import PackedCorpus
+		from data_utils import load_embeddings_array, add_null_token, build_vocab_index, pad_and_vectorize
+		vocab, embeddings = load_embeddings_array(os.path.join(workdir, "embeddings.txt"), None)
+		vocab, _ = add_null_token(vocab, embeddings)
+		texts = list(PackedCorpus(os.path.join(workdir, "corpus")).texts())
+		start = time.time()
+		pad_and_vectorize(texts, build_vocab_index(vocab), args.max_length)
+		return(len(texts), time.time()-start)
+	if stage == "vectorize_packed":
+		from corpus import PackedCorpus, vectorize_packed
+		from data_utils import load_embeddings_array, add_null_token, build_vocab_index
+		vocab, embeddings = load_embeddings_array(os.path.join(workdir, "embeddings.txt"), None)
+		vocab, _ = add_null_token(vocab, embeddings)
+		start = time.time()
+		vectorize_packed(PackedCorpus(os.path.join(workdir, "corpus")), build_vocab_index(vocab), args.max_length)
+		return(num_papers, time.time()-start)
+	if stage == "minibatches":
+		from data_utils import get_bucketed_minibatches
+		vectorized, lengths, _ = load_vectorized(workdir, args.max_length)
+		labels = np.zeros(num_papers, dtype=np.int32)
+		start = time.time()
+		for batch in get_bucketed_minibatches(vectorized, lengths, labels, args.batch_size):
+			pass
+		return(num_papers, time.time()-start)
+	if stage == "lda_corpus":
+		import tempfile
+		from corpus import PackedCorpus
+		from lda import create_corpus_packed
+		with tempfile.TemporaryDirectory(dir=workdir) as tmp:
+			start = time.time()
+			create_corpus_packed(PackedCorpus(os.path.join(workdir, "corpus")), os.path.join(tmp, "corpus.mm"),
+								 os.path.join(tmp, "corpus.dict"))
+			return(num_papers, time.time()-start)
+	if stage == "state_extraction":
+		import tensorflow as tf
+		from rnn import RNN, Config
+		vectorized, lengths, embeddings = load_vectorized(workdir, args.max_length)
+		sample = min(args.state_sample, num_papers)
+		config = Config()
+		config.embed_size = embeddings.shape[1]
+		config.hidden_size = params["hidden_size"]
+		# untrained weights run the same forward pass as trained ones
+		rnn = RNN(config, embeddings, training=False)
+		with tf.Session() as session:
+			rnn.initialize(session)
+			start = time.time()
+			for start_row in range(0, sample, config.inference_batch_size):
+				end_row = min(start_row + config.inference_batch_size, sample)
+				width = int(min(max(lengths[start_row:end_row].max(), 1), args.max_length))
+				rnn.get_states_on_batch(session, vectorized[start_row:end_row, :width],
+										np.minimum(lengths[start_row:end_row], width))
+			return(sample, time.time()-start)
+	if stage in ("knn_exact", "knn_index"):
+		from knn import load_states, batch_nearest_neighbors
+		from knn_index import IVFIndex
+		states, _ = load_states(os.path.join(workdir, "hidden_states"), num_rows=None)
+		queries = np.random.RandomState(0).choice(num_papers, min(args.num_queries, num_papers), replace=False)
+		index = IVFIndex.build(states) if stage == "knn_index" else None
+		start = time.time()
+		batch_nearest_neighbors(states, queries, K=10, index=index)
+		return(len(queries), time.time()-start)
+	if stage == "knn_query":
+		# one query at a time through knn.nearest_neighbors(), as knn.py --query-code runs it
+		from knn import load_states, nearest_neighbors
+		states, _ = load_states(os.path.join(workdir, "hidden_states"), num_rows=None)
+		queries = np.random.RandomState(0).choice(num_papers, min(args.num_queries, num_papers), replace=False)
+		start = time.time()
+		for query in queries:
+			nearest_neighbors(states, query, K=10)
+		return(len(queries), time.time()-start)
+	if stage == "titles":
+		from metadata import MetadataStore
+		from corpus import read_lines
+		ids = read_lines(os.path.join(workdir, "corpus.ids"))
+		neighbors = np.random.RandomState(0).randint(0, num_papers, size=(min(args.num_queries, num_papers), 11))
+		db = MetadataStore(os.path.join(workdir, "db.sqlite"))
+		start = time.time()
+		for row in neighbors:
+			db.titles([ids[i] for i in row])
+		return(len(neighbors), time.time()-start)
+	if stage == "get_titles":
+		# knn.get_titles() opens the store and prints the titles on every call
+		from knn import get_titles
+		from corpus import read_lines
+		ids = read_lines(os.path.join(workdir, "corpus.ids"))
+		neighbors = np.random.RandomState(0).randint(0, num_papers, size=(min(args.num_queries, num_papers), 11))
+		with open(os.devnull, "w") as devnull:
+			stdout, sys.stdout = sys.stdout, devnull
+			start = time.time()
+			for row in neighbors:
+				get_titles(os.path.join(workdir, "db.sqlite"), ids, row[0], row[None, :])
+			seconds = time.time()-start
+			sys.stdout = stdout
+		return(len(neighbors), seconds)
+	raise ValueError("Unknown stage %s" % stage)
+
+def run_stage_process(stage, args):
+	"""
+	Runs @stage in a fresh Python process and returns its result, or the reason it was
+	skipped, as a dictionary.
+	"""
+	command = [sys.executable, os.path.abspath(__file__), "--run-stage", stage, "--workdir", args.workdir,
+			   "--max-length", str(args.max_length), "--batch-size", str(args.batch_size),
+			   "--state-sample", str(args.state_sample), "--num-queries", str(args.num_queries)]
+	result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+	lines = [line for line in result.stdout.split("\n") if line.startswith("{")]
+	if result.returncode != 0 or not lines:
+		return {"skipped": (result.stderr.strip().split("\n") or ["no output"])[-1]}
+	return json.loads(lines[-1])
+
+def run_stage_repeated(stage, args):
+	"""
+	Runs @stage @args.repeat times, each in a fresh process, and returns the median of the
+	wall time and peak memory, so that one noisy run does not count as a regression.
+	"""
+	runs = []
+	for _ in range(max(args.repeat, 1)):
+		result = run_stage_process(stage, args)
+		if "skipped" in result: return result
+		runs.append(result)
+	seconds = float(np.median([run["seconds"] for run in runs]))
+	return {"seconds": seconds, "items": runs[0]["items"], "throughput": runs[0]["items"] / max(seconds, 1e-9),
+			"peak_rss_mb": float(np.median([run["peak_rss_mb"] for run in runs])), "runs": len(runs)}
+
+def compare(results, baseline, threshold, min_seconds=0.05, min_rss_mb=5.0):
+	"""
+	Returns a list of the stages whose wall time or peak memory grew by more than
+	@threshold (a fraction) over the baseline, and by more than @min_seconds or
+	@min_rss_mb, so that stages which take only milliseconds do not flag noise.
+	"""
+	regressions = []
+	floors = {"seconds": min_seconds, "peak_rss_mb": min_rss_mb}
+	for stage, result in results.items():
+		base = baseline.get(stage)
+		if base is None or "skipped" in result or "skipped" in base: continue
+		for key in ("seconds", "peak_rss_mb"):
+			if result[key] > base[key] * (1 + threshold) and result[key] - base[key] > floors[key]:
+				regressions.append("%s %s: %.3f -> %.3f (+%.0f%%)" % (stage, key, base[key], result[key],
+																	 100*(result[key]/max(base[key], 1e-9) - 1)))
+	return regressions
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser()
+	parser.add_argument("--scale", type=str, default="small", choices=sorted(SCALES), help="Number of synthetic papers: small (10k), medium (100k) or large (1M).")
+	parser.add_argument("--num-papers", type=int, default=None, help="Number of synthetic papers, overrides --scale.")
+	parser.add_argument("--vocab-size", type=int, default=20000, help="Number of synthetic word embeddings.")
+	parser.add_argument("--workdir", type=str, default=None, help="Directory of the synthetic dataset (default: arxiv-recommender-bench/<num papers> in the temporary directory).")
+	parser.add_argument("--regenerate", action="store_true", default=False, help="Regenerate the synthetic dataset even if it exists.")
+	parser.add_argument("--stages", type=str, default=",".join(STAGES), help="Comma-separated stages to run.")
+	parser.add_argument("--max-length", type=int, default=300, help="Maximum abstract length.")
+	parser.add_argument("--batch-size", type=int, default=120, help="Training batch size.")
+	parser.add_argument("--state-sample", type=int, default=10000, help="Number of abstracts to run through the RNN.")
+	parser.add_argument("--num-queries", type=int, default=1000, help="Number of nearest neighbor and title queries.")
+	parser.add_argument("--output", type=str, default=None, help="File to write the results to (default: bench_results.json in the workdir).")
+	parser.add_argument("--baseline", type=str, default="bench_baseline.json", help="Baseline to compare the results to.")
+	parser.add_argument("--save-baseline", action="store_true", default=False, help="Save the results as the new baseline.")
+	parser.add_argument("--threshold", type=float, default=0.2, help="Relative increase over the baseline that counts as a regression.")
+	parser.add_argument("--min-seconds", type=float, default=0.05, help="Smallest increase in seconds that counts as a regression.")
+	parser.add_argument("--min-rss-mb", type=float, default=5.0, help="Smallest increase in peak memory (MB) that counts as a regression.")
+	parser.add_argument("--repeat", type=int, default=3, help="Number of runs of each stage; the median is reported.")
+	parser.add_argument("--run-stage", type=str, default=None, help=argparse.SUPPRESS)
+	args = parser.parse_args()
+
+	# child process: run a single stage and report it as one line of JSON
+	if args.run_stage is not None:
+		items, seconds = run_stage(args.run_stage, args.workdir, args)
+		print(json.dumps({"seconds": seconds, "items": items, "throughput": items / max(seconds, 1e-9),
+						  "peak_rss_mb": peak_rss()[0]}))
+		sys.exit()
+
+	num_papers = args.num_papers or SCALES[args.scale]
+	# keep the generated data out of the working tree, but reuse it across runs
+	args.workdir = args.workdir or os.path.join(tempfile.gettempdir(), "arxiv-recommender-bench", str(num_papers))
+	args.output = args.output or os.path.join(args.workdir, "bench_results.json")
+	if args.regenerate or not os.path.exists(os.path.join(args.workdir, "params.json")):
+		generate(args.workdir, num_papers, args.vocab_size)
+	results = {}
+	for stage in args.stages.split(","):
+		results[stage] = run_stage_repeated(stage, args)
+		if "skipped" in results[stage]:
+			print("%-18s skipped (%s)" % (stage, results[stage]["skipped"]))
+		else:
+			print("%-18s %9.3f s %12.1f items/s %9.1f MB" % (stage, results[stage]["seconds"],
+				  results[stage]["throughput"], results[stage]["peak_rss_mb"]))
+	report = {"num_papers": num_papers, "stages": results}
+	with open(args.output, "w") as f:
+		json.dump(report, f, indent=2)
+	print("Wrote results to %s." % args.output)
+	if args.save_baseline:
+		with open(args.baseline, "w") as f:
+			json.dump(report, f, indent=2)
+		print("Saved baseline to %s." % args.baseline)
+	elif os.path.exists(args.baseline):
+		baseline = json.load(open(args.baseline))
+		if baseline["num_papers"] != num_papers:
+			print("Baseline %s is for %i papers, not comparing." % (args.baseline, baseline["num_papers"]))
+		else:
+			regressions = compare(results, baseline["stages"], args.threshold, args.min_seconds, args.min_rss_mb)
+			for regression in regressions:
+				print("REGRESSION " + regression)
+			if regressions: sys.exit(1)
+			print("No regressions beyond %.0f%% of %s." % (100*args.threshold, args.baseline))
@@ -0,0 +1,180 @@
+# Checkpointing for rnn.train(). Saves the model on a time- or step-based policy instead of
+# after every minibatch, optionally writing to disk on a background thread, keeps the last
+# few checkpoints plus the best one by validation accuracy, and records the epoch, step and
+# NumPy RNG state next to them so that an interrupted run can resume where it stopped.
+# Run as a script, converts the floating point variables of a checkpoint to another dtype.
+
+import argparse
+import json
+import os
+import threading
+import time
+import numpy as np
+import tensorflow as tf
+
+STATE_FILE = "state.json"
+
+def get_rng_state():
+	"""
+	Returns the state of the global NumPy RNG in a form that can be written as JSON.
+	"""
+	name, keys, pos, has_gauss, cached_gaussian = np.random.get_state()
+	return [name, keys.tolist(), int(pos), int(has_gauss), float(cached_gaussian)]
+
+def set_rng_state(rng_state):
+	"""
+	Restores the global NumPy RNG from the output of get_rng_state().
+	"""
+	name, keys, pos, has_gauss, cached_gaussian = rng_state
+	np.random.set_state((name, np.array(keys, dtype=np.uint32), pos, has_gauss, cached_gaussian))
+
+class CheckpointManager(object):
+	"""
+	Saves the variables of the current graph to @checkpoint_dir every @every_secs seconds
+	and/or every @every_steps training steps, keeping the last @keep_last checkpoints and
+	the best checkpoint by validation accuracy. Checkpoints are written by plain Savers, so
+	any of them can be restored with tf.train.Saver().restore().
+
+	With @background set, a save first copies all variables into shadow variables inside
+	the session, which is a fast in-memory copy, and a background thread then writes the
+	shadow variables to disk while training continues. The state file is only updated once
+	the checkpoint it points to is complete.
+	"""
+	def __init__(self, session, checkpoint_dir, every_secs=600, every_steps=None, keep_last=3, background=True):
+		self.session = session
+		self.checkpoint_dir = checkpoint_dir
+		self.every_secs = every_secs
+		self.every_steps = every_steps
+		self.background = background
+		if not os.path.exists(checkpoint_dir):
+			os.makedirs(checkpoint_dir)
+		variables = tf.global_variables()
+		if background:
+			# shadow copies live outside every collection, so they are never trained or saved by other Savers
+			shadows = [tf.Variable(tf.zeros(v.shape, dtype=v.dtype.base_dtype), trainable=False, collections=[])
+					   for v in variables]
+			self.snapshot_op = tf.group(*[s.assign(v) for s, v in zip(shadows, variables)])
+			session.run(tf.variables_initializer(shadows))
+			var_list = {v.op.name: s for v, s in zip(variables, shadows)}
+		else:
+			var_list = {v.op.name: v for v in variables}
+		self.saver = tf.train.Saver(var_list, max_to_keep=keep_last)
+		self.best_saver = tf.train.Saver(var_list, max_to_keep=1)
+		self.restorer = tf.train.Saver(variables)
+		self.best_value = None
+		self.best_checkpoint = None
+		self.last_save = time.time()
+		self.thread = None
+		self.error = None
+
+	def restore(self):
+		"""
+		Restores the latest checkpoint, if there is one, and returns the progress recorded
+		with it. Returns None if there is nothing to resume from.
+		"""
+		state_file = os.path.join(self.checkpoint_dir, STATE_FILE)
+		if not os.path.exists(state_file):
+			return None
+		with open(state_file) as f:
+			state = json.load(f)
+		self.restorer.restore(self.session, state["checkpoint"])
+		self.best_value = state.get("best_value")
+		self.best_checkpoint = state.get("best_checkpoint")
+		print("Resumed from %s (epoch %i, step %i)." % (state["checkpoint"], state["progress"]["epoch"]+1, state["progress"]["step"]))
+		return state["progress"]
+
+	def due(self, step):
+		"""
+		Checks whether the save policy calls for a checkpoint at @step.
+		"""
+		if self.every_steps and step % self.every_steps == 0:
+			return True
+		return self.every_secs is not None and time.time() - self.last_save >= self.every_secs
+
+	def maybe_save(self, progress):
+		"""
+		Saves a checkpoint if one is due. @progress is a dictionary with at least the
+		current 'step', and is returned by restore() when resuming.
+		"""
+		if self.due(progress["step"]):
+			self.save(progress)
+
+	def report(self, progress, value):
+		"""
+		Reports a validation accuracy, and saves a best checkpoint if it is the highest so far.
+		"""
+		if self.best_value is None or value > self.best_value:
+			self.best_value = value
+			self.save(progress, best=True)
+
+	def save(self, progress, best=False):
+		"""
+		Saves a checkpoint along with @progress, also as the best checkpoint if @best is set.
+		"""
+		self.wait()
+		self.last_save = time.time()
+		if self.background:
+			self.session.run(self.snapshot_op)
+			self.thread = threading.Thread(target=self._write, args=(dict(progress), best, self.best_value))
+			self.thread.start()
+		else:
+			self._write(progress, best, self.best_value)
+
+	def wait(self):
+		"""
+		Waits for a background save to finish, raising any error it ran into.
+		"""
+		if self.thread is not None:
+			self.thread.join()
+			self.thread = None
+		if self.error is not None:
+			error, self.error = self.error, None
+			raise error
+
+	def _write(self, progress, best, best_value):
+		"""
+		Writes the checkpoint files, then atomically replaces the state file.
+		"""
+		try:
+			checkpoint = self.saver.save(self.session, os.path.join(self.checkpoint_dir, "model"),
+										 global_step=progress["step"], write_meta_graph=False)
+			if best:
+				self.best_checkpoint = self.best_saver.save(self.session, os.path.join(self.checkpoint_dir, "best"),
+															write_meta_graph=False, latest_filename="checkpoint_best")
+			state = {"checkpoint": checkpoint, "progress": progress,
+					 "best_value": best_value, "best_checkpoint": self.best_checkpoint}
+			state_file = os.path.join(self.checkpoint_dir, STATE_FILE)
+			with open(state_file + ".tmp", "w") as f:
+				json.dump(state, f)
+			os.replace(state_file + ".tmp", state_file)
+		except Exception as e:
+			self.error = e
+
+def convert_checkpoint(src, dst, dtype="float32"):
+	"""
+	Rewrites the checkpoint at @src to @dst with every floating point variable cast to
+	@dtype, so that weights trained in float64 can be restored into a float32 graph.
+	Integer variables are copied unchanged.
+	"""
+	reader = tf.train.load_checkpoint(src)
+	dtypes = reader.get_variable_to_dtype_map()
+	with tf.Graph().as_default():
+		variables = []
+		for name in sorted(dtypes):
+			value = reader.get_tensor(name)
+			if dtypes[name].is_floating: value = value.astype(dtype)
+			variables.append(tf.Variable(value, name=name))
+		saver = tf.train.Saver(variables)
+		with tf.Session() as session:
+			session.run(tf.global_variables_initializer())
+			saver.save(session, dst, write_meta_graph=False)
+	print("Converted %i variables of %s to %s in %s." % (len(variables), src, dtype, dst))
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser()
+	parser.add_argument("--checkpoint", type=str, default="./weights/train", help="Checkpoint to convert.")
+	parser.add_argument("--output", type=str, default="./weights/train", help="Path to write the converted checkpoint to.")
+	parser.add_argument("--dtype", type=str, default="float32", help="Float type to cast the variables to.")
+	args = parser.parse_args()
+
+	convert_checkpoint(args.checkpoint, args.output, args.dtype)
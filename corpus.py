@@ -0,0 +1,223 @@
+# Packed, memory-mapped corpus of tokenized abstracts. Replaces one text file per abstract
+# with a few contiguous files that readers map with a handful of sequential reads:
+#   <prefix>.tokens   int32 token IDs of all abstracts, back to back
+#   <prefix>.offsets  int64 start of each abstract in the token buffer, plus the total
+#   <prefix>.ids      paper ID of each abstract, one per line
+#   <prefix>.vocab    token of each token ID, one per line
+# Abstracts are stored exactly as abstract.split(" ") of the tokenized text, so that
+# joining the tokens of an abstract with spaces gives back the tokenized file.
+
+import argparse
+import glob
+import os
+import time
+import numpy as np
+import metrics
+
+SUFFIXES = [".tokens", ".offsets", ".ids", ".vocab"]
+# lists papers whose abstract changed after they were packed, see write_stale_ids()
+STALE_SUFFIX = ".stale"
+
+def corpus_exists(prefix):
+	"""
+	Checks whether all files of the packed corpus at @prefix exist.
+	"""
+	return all(os.path.exists(prefix + suffix) for suffix in SUFFIXES)
+
+def read_stale_ids(prefix):
+	"""
+	Returns the paper IDs whose abstract in the packed corpus at @prefix is older than
+	their tokenized file, as recorded by incremental.py. Empty if the corpus is current.
+	"""
+	if not os.path.exists(prefix + STALE_SUFFIX):
+		return []
+	return read_lines(prefix + STALE_SUFFIX)
+
+def write_stale_ids(prefix, ids):
+	"""
+	Records @ids as out of date in the packed corpus at @prefix, until build_corpus()
+	rebuilds it. Removes the record if @ids is empty.
+	"""
+	if len(ids) == 0:
+		if os.path.exists(prefix + STALE_SUFFIX): os.remove(prefix + STALE_SUFFIX)
+		return
+	with open(prefix + STALE_SUFFIX, "w") as f:
+		f.write("".join(paper_id + "\n" for paper_id in ids))
+
+def read_lines(fpath):
+	"""
+	Reads a file with one entry per line, written by append_documents().
+	"""
+	with open(fpath, "r") as f:
+		return f.read().split("\n")[:-1]
+
+class PackedCorpus(object):
+	"""
+	Read-only view of a packed corpus. The token buffer is memory-mapped, so opening a
+	corpus only reads the offsets, paper IDs and vocabulary.
+	"""
+	def __init__(self, prefix):
+		self.prefix = prefix
+		self.offsets = np.fromfile(prefix + ".offsets", dtype=np.int64)
+		# an interrupted append_documents() can leave IDs without offsets, see trim_corpus()
+		self.ids = read_lines(prefix + ".ids")[:len(self.offsets)-1]
+		self.vocab = read_lines(prefix + ".vocab")
+		if self.offsets[-1] > 0:
+			self.tokens = np.memmap(prefix + ".tokens", dtype=np.int32, mode="r", shape=(int(self.offsets[-1]),))
+		else:
+			self.tokens = np.empty(0, dtype=np.int32)
+
+	def __len__(self):
+		return len(self.ids)
+
+	def __iter__(self):
+		for i in range(len(self)):
+			yield self.document(i)
+
+	def lengths(self):
+		"""
+		Returns the number of tokens in each abstract.
+		"""
+		return np.diff(self.offsets)
+
+	def document(self, i):
+		"""
+		Returns the token IDs of abstract @i as a view into the token buffer.
+		"""
+		return self.tokens[self.offsets[i]:self.offsets[i+1]]
+
+	def text(self, i):
+		"""
+		Returns abstract @i in the format of the tokenized text files.
+		"""
+		return " ".join(self.vocab[token] for token in self.document(i))
+
+	def texts(self):
+		"""
+		Iterates over all abstracts in the format of the tokenized text files.
+		"""
+		for i in range(len(self)):
+			yield self.text(i)
+
+def trim_corpus(prefix):
+	"""
+	Cuts the packed corpus at @prefix back to the abstracts covered by its offsets. Since
+	append_documents() writes the offsets last, an interrupted append can leave tokens,
+	IDs or a partial vocabulary line past them, which the next append must not build on.
+	"""
+	size = os.path.getsize(prefix + ".offsets")
+	if size % 8:
+		os.truncate(prefix + ".offsets", size - size % 8)
+	offsets = np.fromfile(prefix + ".offsets", dtype=np.int64)
+	if os.path.getsize(prefix + ".tokens") > 4*offsets[-1]:
+		os.truncate(prefix + ".tokens", 4*int(offsets[-1]))
+	with open(prefix + ".ids", "r") as f:
+		text = f.read()
+	ids = text.split("\n")[:-1]
+	if len(ids) > len(offsets)-1 or (text and not text.endswith("\n")):
+		with open(prefix + ".ids.tmp", "w") as f:
+			f.write("".join(paper_id + "\n" for paper_id in ids[:len(offsets)-1]))
+		os.replace(prefix + ".ids.tmp", prefix + ".ids")
+	with open(prefix + ".vocab", "rb") as f:
+		text = f.read()
+	if text and not text.endswith(b"\n"):
+		os.truncate(prefix + ".vocab", text.rfind(b"\n") + 1)
+
+def append_documents(prefix, ids, abstracts):
+	"""
+	Appends tokenized @abstracts, with paper IDs @ids, to the packed corpus at @prefix,
+	creating it if needed. Only the new tokens, offsets, IDs and vocabulary entries are
+	written. Papers whose ID is already in the corpus are skipped; rebuild the corpus
+	with build_corpus() to pick up new versions of existing papers (incremental.py lists
+	them with write_stale_ids()).
+	"""
+	if not corpus_exists(prefix):
+		directory = os.path.dirname(prefix)
+		if directory and not os.path.exists(directory): os.makedirs(directory)
+		np.zeros(1, dtype=np.int64).tofile(prefix + ".offsets")
+		for suffix in [".tokens", ".ids", ".vocab"]:
+			open(prefix + suffix, "w").close()
+	trim_corpus(prefix)
+	vocab = read_lines(prefix + ".vocab")
+	vocab_index = {token: i for i, token in enumerate(vocab)}
+	known_ids = set(read_lines(prefix + ".ids"))
+	num_tokens = int(np.fromfile(prefix + ".offsets", dtype=np.int64)[-1])
+	new_ids, new_tokens, new_offsets, new_vocab = [], [], [], []
+	for paper_id, abstract in zip(ids, abstracts):
+		if paper_id in known_ids: continue
+		known_ids.add(paper_id)
+		for token in abstract.split(" "):
+			if token not in vocab_index:
+				vocab_index[token] = len(vocab_index)
+				new_vocab.append(token)
+			new_tokens.append(vocab_index[token])
+		new_offsets.append(len(new_tokens))
+		new_ids.append(paper_id)
+	# the token buffer is written before the offsets that point into it
+	with open(prefix + ".tokens", "ab") as f:
+		np.array(new_tokens, dtype=np.int32).tofile(f)
+	with open(prefix + ".vocab", "a") as f:
+		f.write("".join(token + "\n" for token in new_vocab))
+	with open(prefix + ".ids", "a") as f:
+		f.write("".join(paper_id + "\n" for paper_id in new_ids))
+	with open(prefix + ".offsets", "ab") as f:
+		(num_tokens + np.array(new_offsets, dtype=np.int64)).tofile(f)
+	return len(new_ids)
+
+def build_corpus(abs_dir_tok, prefix, chunk_size=10000):
+	"""
+	Packs every tokenized abstract in @abs_dir_tok into a new corpus at @prefix, in sorted
+	order of file name so that the order of the abstracts is stable across runs.
+	"""
+	start = time.time()
+	print("Building packed corpus...")
+	for suffix in SUFFIXES + [STALE_SUFFIX]:
+		if os.path.exists(prefix + suffix): os.remove(prefix + suffix)
+	fpaths = sorted(glob.glob(abs_dir_tok + "/*"))
+	num_abstracts = 0
+	for chunk_start in range(0, len(fpaths), chunk_size):
+		ids, abstracts = [], []
+		for fpath in fpaths[chunk_start:(chunk_start+chunk_size)]:
+			with open(fpath, "r") as f:
+				abstracts.append(f.read())
+			ids.append(os.path.basename(fpath))
+		num_abstracts += append_documents(prefix, ids, abstracts)
+	if num_abstracts == 0: append_documents(prefix, [], [])
+	print("Packed %i abstracts into %s. Time taken: %.2f seconds." % (num_abstracts, prefix, time.time()-start))
+
+def load_paper_ids(prefix, abs_dir_tok):
+	"""
+	Returns the paper IDs of the abstracts in corpus order, from the packed corpus if it
+	exists and from the file names of the tokenized abstracts otherwise.
+	"""
+	if corpus_exists(prefix):
+		return read_lines(prefix + ".ids")
+	return sorted(os.path.basename(fpath) for fpath in glob.glob(abs_dir_tok + "/*"))
+
+def vectorize_packed(corpus, vocab_index, max_length, null_token="<NULL>", chunk_size=10000):
+	"""
+	Pads/truncates and vectorizes the packed corpus against the embedding vocabulary, like
+	data_utils.pad_and_vectorize(). Corpus token IDs are translated to embedding positions
+	through one lookup array, and each chunk of abstracts is gathered with a single fancy
+	index. Returns the (num_abstracts, @max_length) int32 matrix and the unpadded lengths.
+	"""
+	start = time.time()
+	null_index = vocab_index[null_token]
+	remap = np.array([vocab_index.get(token, null_index) for token in corpus.vocab], dtype=np.int32)
+	lengths = corpus.lengths().astype(np.int32)
+	vectorized_abstracts = np.full((len(corpus), max_length), null_index, dtype=np.int32)
+	for chunk_start in range(0, len(corpus), chunk_size):
+		clipped = np.minimum(lengths[chunk_start:(chunk_start+chunk_size)], max_length)
+		rows = np.repeat(np.arange(clipped.shape[0]), clipped)
+		cols = np.arange(rows.shape[0]) - np.repeat(np.cumsum(clipped) - clipped, clipped)
+		vectorized_abstracts[chunk_start + rows, cols] = remap[corpus.tokens[corpus.offsets[chunk_start + rows] + cols]]
+	metrics.throughput("vectorize_tokens", int(lengths.sum()), time.time()-start)
+	return(vectorized_abstracts, lengths)
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser()
+	parser.add_argument("--abs-dir-tok", type=str, default="data/abstracts_tokenized", help="Directory that stores tokenized abstracts.")
+	parser.add_argument("--corpus", type=str, default="data/corpus", help="Path prefix of the packed corpus files.")
+	args = parser.parse_args()
+
+	build_corpus(args.abs_dir_tok, args.corpus)
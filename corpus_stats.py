@@ -0,0 +1,144 @@
+# Corpus statistics computed in one streaming pass over the packed corpus: token
+# frequencies, document length histogram and out-of-vocabulary rate. Chunks of abstracts
+# are counted in parallel straight from the memory-mapped token buffer, and the results
+# are cached next to the corpus, keyed by its version, so reruns only load the cache.
+
+import argparse
+import hashlib
+import os
+import string
+import time
+from multiprocessing import Pool
+import numpy as np
+from nltk.corpus import stopwords
+from corpus import PackedCorpus, SUFFIXES
+from data_utils import load_embeddings_array
+
+def get_stop_list():
+	"""
+	Returns the list of stop words, punctuation, and PTB bracket tokens that are left out
+	of topic models and frequent token lists.
+	"""
+	custom_stopWords = ["-rrb-", "-lrb-", "-rcb-", "-lcb-", ""]
+	return stopwords.words("english") + list(string.punctuation) + custom_stopWords
+
+def corpus_version(prefix, *params):
+	"""
+	Returns a key that changes whenever the packed corpus at @prefix changes, since its
+	files are only ever appended to or rebuilt, or when any of @params changes.
+	"""
+	key = hashlib.sha1()
+	for suffix in SUFFIXES:
+		info = os.stat(prefix + suffix)
+		key.update(("%s %i %i;" % (suffix, info.st_size, info.st_mtime_ns)).encode("utf-8"))
+	key.update(repr(params).encode("utf-8"))
+	return key.hexdigest()
+
+# the packed corpus of a worker process, opened once by open_worker_corpus()
+_worker_corpus = None
+
+def open_worker_corpus(prefix):
+	"""
+	Pool initializer that maps the packed corpus at @prefix once per worker process, so
+	that jobs only carry the range of abstracts to count.
+	"""
+	global _worker_corpus
+	_worker_corpus = PackedCorpus(prefix)
+
+def count_chunk(job):
+	"""
+	Counts the tokens and the document lengths of abstracts @start to @end of the corpus
+	opened by open_worker_corpus().
+	"""
+	start, end = job
+	corpus = _worker_corpus
+	tokens = corpus.tokens[corpus.offsets[start]:corpus.offsets[end]]
+	counts = np.bincount(tokens, minlength=len(corpus.vocab))
+	length_histogram = np.bincount(np.diff(corpus.offsets[start:(end+1)]))
+	return(counts, length_histogram)
+
+def compute_stats(prefix, embeddings_vocab=None, processes=None, chunk_size=100000):
+	"""
+	Computes the statistics of the packed corpus at @prefix in one pass, in chunks of
+	@chunk_size abstracts spread over @processes worker processes. Returns a dictionary
+	with the count of every corpus token, the histogram of document lengths (in tokens),
+	and, if the @embeddings_vocab is given, the share of tokens (and of distinct tokens)
+	that have no word embedding.
+	"""
+	start = time.time()
+	corpus = PackedCorpus(prefix)
+	counts = np.zeros(len(corpus.vocab), dtype=np.int64)
+	length_histogram = np.zeros(1, dtype=np.int64)
+	jobs = [(i, min(i+chunk_size, len(corpus))) for i in range(0, len(corpus), chunk_size)]
+	with Pool(processes, initializer=open_worker_corpus, initargs=(prefix,)) as pool:
+		for chunk_counts, chunk_histogram in pool.imap_unordered(count_chunk, jobs):
+			counts += chunk_counts
+			if chunk_histogram.size > length_histogram.size:
+				length_histogram = np.pad(length_histogram, (0, chunk_histogram.size - length_histogram.size))
+			length_histogram[:chunk_histogram.size] += chunk_histogram
+	stats = {"counts": counts, "length_histogram": length_histogram,
+			 "num_documents": len(corpus), "num_tokens": int(counts.sum())}
+	if embeddings_vocab is not None:
+		embedded = set(embeddings_vocab)
+		# the empty token that ends every tokenized abstract is not a word
+		words = np.array([token != "" for token in corpus.vocab], dtype=bool)
+		oov = np.array([token not in embedded for token in corpus.vocab], dtype=bool) & words
+		stats["oov_rate"] = float(counts[oov].sum()) / max(counts[words].sum(), 1)
+		stats["oov_type_rate"] = float(oov.sum()) / max(words.sum(), 1)
+	print("Computed statistics of %i abstracts. Time taken: %.2f seconds." % (len(corpus), time.time()-start))
+	return stats
+
+def load_stats(prefix, embeddings_file=None, max_embed=None, processes=None, use_cache=True):
+	"""
+	Returns the statistics of the packed corpus at @prefix from the cache if it matches
+	the current version of the corpus, and otherwise computes and caches them. The OOV
+	rates are measured against the first @max_embed embeddings of @embeddings_file.
+	"""
+	cache_file = prefix + ".stats.npz"
+	version = corpus_version(prefix, embeddings_file, max_embed)
+	if use_cache and os.path.exists(cache_file):
+		cache = np.load(cache_file)
+		if str(cache["version"]) == version:
+			return {key: (cache[key] if cache[key].ndim else cache[key].item()) for key in cache.files if key != "version"}
+	embeddings_vocab = None
+	if embeddings_file is not None:
+		embeddings_vocab, _ = load_embeddings_array(embeddings_file, max_embed)
+	stats = compute_stats(prefix, embeddings_vocab, processes)
+	# write to a temporary file first, so that an interrupted run leaves no broken cache
+	with open(cache_file + ".tmp", "wb") as f:
+		np.savez(f, version=version, **stats)
+	os.replace(cache_file + ".tmp", cache_file)
+	return stats
+
+def top_k(stats, vocab, K=50):
+	"""
+	Returns the @K most frequent tokens that are not stop words, punctuation, or numbers,
+	as an array of (rank, token, count) rows.
+	"""
+	stopList = set(get_stop_list())
+	keep = np.array([token.lower() not in stopList and not token.isdigit() for token in vocab], dtype=bool)
+	candidates = np.flatnonzero(keep)
+	order = candidates[np.argsort(-stats["counts"][candidates], kind="mergesort")][:K]
+	return np.array([(rank, vocab[i], stats["counts"][i]) for rank, i in enumerate(order)],
+					dtype=[("rank", int), ("token", object), ("count", int)])
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser()
+	parser.add_argument("--corpus", type=str, default="data/corpus", help="Path prefix of the packed corpus files.")
+	parser.add_argument("--embeddings", type=str, default=None, help="Pre-trained word embeddings to measure the OOV rate against.")
+	parser.add_argument("--max-embed", type=int, default=209126, help="Maximum number of embeddings to load.")
+	parser.add_argument("--top-k", type=int, default=50, help="Number of most frequent tokens to print.")
+	parser.add_argument("--processes", type=int, default=None, help="Number of worker processes.")
+	parser.add_argument("--no-cache", action="store_true", default=False, help="Recompute the statistics even if they are cached.")
+	args = parser.parse_args()
+
+	stats = load_stats(args.corpus, args.embeddings, args.max_embed, args.processes, not args.no_cache)
+	lengths = np.repeat(np.arange(stats["length_histogram"].size), stats["length_histogram"])
+	print("%i abstracts, %i tokens, %i distinct tokens." % (stats["num_documents"], stats["num_tokens"], np.count_nonzero(stats["counts"])))
+	if lengths.size:
+		print("Abstract length: mean %.1f, median %i, 95th percentile %i, max %i." % (lengths.mean(), np.median(lengths),
+			  np.percentile(lengths, 95), lengths.max()))
+	if "oov_rate" in stats:
+		print("OOV rate: %.2f%% of tokens, %.2f%% of distinct tokens." % (100*stats["oov_rate"], 100*stats["oov_type_rate"]))
+	for rank, token, count in top_k(stats, PackedCorpus(args.corpus).vocab, args.top_k):
+		print("%3i %-25s %i" % (rank+1, token, count))
@@ -6,15 +6,149 @@ import os
 import sys
 import argparse
 import glob
+import itertools
+import struct
+import resource
+import threading
+import queue
 from collections import OrderedDict
 from pprint import pprint
+import metrics
+
+def peak_rss():
+	"""
+	Returns the peak resident set size in MB of this process and of the largest of its
+	terminated child processes (e.g. worker processes).
+	"""
+	# ru_maxrss is in kilobytes on Linux
+	return(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+		   resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024.0)
 
 def load_vocab(fpath):
 	"""
 	Reads the VOCAB_FILE produced by the PTBTokenizer and returns all 
 	(token, count) pairs in a numpy array.
 	"""
-	return np.genfromtxt(fpath, dtype=("U25, int"), comments=None, delimiter=" ")
+	# tokens are kept as Python strings, since a fixed-width string dtype would cut long
+	# tokens (URLs, chemical formulas) short and merge their counts with other tokens
+	pairs = []
+	with open(fpath, encoding="utf-8") as f:
+		for line in f:
+			token, count = line.rstrip("\n").rsplit(" ", 1)
+			pairs.append((token, int(count)))
+	return np.array(pairs, dtype=[("f0", object), ("f1", int)])
+
+def embeddings_store_paths(fpath):
+	"""
+	Returns the paths of the vocabulary table and the float matrix that make up the
+	binary embedding store for the GloVe SAVE_FILE at @fpath.
+	"""
+	base = os.path.splitext(fpath)[0]
+	return(base + ".vocab", base + ".npy")
+
+def convert_embeddings(fpath, vocab_file=None, binary_file=None, dtype=np.float64):
+	"""
+	One-time conversion of the GloVe output into a binary store: a vocabulary table with
+	one token per line, plus a contiguous float matrix saved as a .npy file. If the
+	@binary_file written by embeddings.sh (BINARY=2) and the @vocab_file are given,
+	the vectors are read from there directly instead of parsing the text SAVE_FILE.
+	"""
+	start = time.time()
+	print("Converting GloVe word embeddings into a binary store...")
+	vocab_path, matrix_path = embeddings_store_paths(fpath)
+	if binary_file is not None and os.path.exists(binary_file):
+		# the first column of the VOCAB_FILE gives the row order of the binary file
+		with open(vocab_file) as f:
+			vocab = [line.split(" ")[0] for line in f.read().split("\n") if line]
+		# the binary file holds 2*V rows of doubles (word and context vectors, each
+		# followed by a bias term); the text SAVE_FILE stores their sum, without bias
+		raw = np.memmap(binary_file, dtype=np.float64, mode="r")
+		depth = raw.size // (2*len(vocab)) - 1
+		assert raw.size == 2*len(vocab)*(depth+1), "%s does not match %s" % (binary_file, vocab_file)
+		raw = raw.reshape(2, len(vocab), depth+1)
+		# the text SAVE_FILE ends with an <unk> row, the average of the (up to) 100 rarest
+		# words, so add the same row to keep both formats at the same rows and indices
+		# (GloVe leaves it out if the vocabulary already has an <unk> token)
+		num_rare = min(100, len(vocab))
+		add_unk = "<unk>" not in vocab
+		embeddings = np.lib.format.open_memmap(matrix_path, mode="w+", dtype=dtype, shape=(len(vocab)+add_unk, depth))
+		embeddings[:len(vocab)] = raw[0, :, :depth] + raw[1, :, :depth]
+		if add_unk:
+			embeddings[-1] = raw[0, -num_rare:, :depth].mean(axis=0) + raw[1, -num_rare:, :depth].mean(axis=0)
+			vocab.append("<unk>")
+	else:
+		# count rows and read the vector depth from the first line
+		with open(fpath) as f:
+			depth = len(f.readline().rstrip("\n").split(" ")) - 1
+			num_rows = 1 + sum(1 for _ in f)
+		vocab = []
+		embeddings = np.lib.format.open_memmap(matrix_path, mode="w+", dtype=dtype, shape=(num_rows, depth))
+		with open(fpath) as f:
+			for i, line in enumerate(f):
+				splitLine = line.rstrip("\n").split(" ")
+				vocab.append(splitLine[0])
+				embeddings[i] = np.array(splitLine[1:], dtype=dtype)
+	embeddings.flush()
+	with open(vocab_path, "w") as f:
+		f.write("\n".join(vocab) + "\n")
+	print("Finished converting %i embeddings into %s. Time taken: %.2f seconds." % (len(vocab), matrix_path, time.time()-start))
+
+def load_embeddings_store(fpath, num_embed=None):
+	"""
+	Memory-maps the binary embedding store created by convert_embeddings() and returns
+	the first @num_embed tokens and vectors (all of them when @num_embed is None).
+	"""
+	vocab_path, matrix_path = embeddings_store_paths(fpath)
+	with open(vocab_path) as f:
+		vocab = f.read().split("\n")[:-1]
+	embeddings = np.load(matrix_path, mmap_mode="r")
+	assert len(vocab) == embeddings.shape[0], "%s and %s are out of sync." % (vocab_path, matrix_path)
+	return(np.array(vocab[:num_embed]), embeddings[:num_embed])
+
+def save_embeddings_store(fpath, vocab, embeddings):
+	"""
+	Writes @vocab and @embeddings as a binary embedding store for @fpath, in the layout
+	of convert_embeddings(), so that load_embeddings_store() can memory-map it.
+	"""
+	vocab_path, matrix_path = embeddings_store_paths(fpath)
+	directory = os.path.dirname(vocab_path)
+	if directory and not os.path.exists(directory): os.makedirs(directory)
+	np.save(matrix_path, np.ascontiguousarray(embeddings))
+	with open(vocab_path, "w") as f:
+		f.write("".join(token + "\n" for token in vocab))
+
+def prune_embeddings(tokens, embeddings_file, max_embed, dtype=None):
+	"""
+	Loads the first @max_embed pre-trained embeddings and keeps only the rows of the
+	tokens in @tokens (e.g. the vocabulary of the corpus), in their original order.
+	Returns the compact vocabulary and embeddings, cast to @dtype if given.
+	"""
+	vocab, embeddings = load_embeddings_array(embeddings_file, max_embed)
+	tokens = set(tokens)
+	keep = np.array([token in tokens for token in vocab], dtype=bool)
+	print("Kept %i of %i embeddings that occur in the corpus." % (keep.sum(), len(vocab)))
+	return(vocab[keep], np.asarray(embeddings[keep], dtype=dtype))
+
+def extend_embeddings(vocab, embeddings, tokens, full_vocab, full_embeddings, full_index):
+	"""
+	Appends to @vocab and @embeddings the pre-trained rows of the tokens in @tokens that
+	the table lacks but @full_vocab has, e.g. new terms in abstracts encoded after the
+	table was pruned to the training corpus. @full_index is build_vocab_index(@full_vocab),
+	so that only the needed rows are read when @full_embeddings is memory-mapped.
+	Returns the extended vocabulary and embeddings.
+	"""
+	known = set(vocab)
+	rows = np.array(sorted({full_index[token] for token in tokens if token not in known and token in full_index}), dtype=np.int64)
+	if rows.size == 0:
+		return(vocab, embeddings)
+	return(np.append(vocab, full_vocab[rows]),
+		   np.concatenate([embeddings, np.asarray(full_embeddings[rows], dtype=embeddings.dtype)]))
+
+def has_embeddings_store(fpath):
+	"""
+	Checks whether the binary embedding store for @fpath has been created.
+	"""
+	return all(os.path.exists(path) for path in embeddings_store_paths(fpath))
 
 def load_embeddings(fpath):
 	"""
@@ -24,30 +158,42 @@ def load_embeddings(fpath):
 	start = time.time()
 	print("Loading pre-trained GloVe word embeddings...")
 	embeddings = OrderedDict()
-	for line in open(fpath):
-		splitLine = line.split(" ")
-		token = splitLine[0]
-		vector = np.array([float(value) for value in splitLine[1:]])
-		embeddings[token] = vector
+	if has_embeddings_store(fpath):
+		# rows of the memory-mapped matrix are views, so nothing is copied here
+		vocab, vectors = load_embeddings_store(fpath)
+		embeddings.update(zip(vocab, vectors))
+	else:
+		for line in open(fpath):
+			splitLine = line.split(" ")
+			token = splitLine[0]
+			vector = np.array([float(value) for value in splitLine[1:]])
+			embeddings[token] = vector
 	print("Finished loading embeddings. Time taken: %.2f seconds."%(time.time()-start))
 	return(embeddings)
 
-def load_embeddings_array(fpath, num_embed):
+def load_embeddings_array(fpath, num_embed, dtype=None):
 	"""
 	Reads the SAVE_FILE produced by the GloVe model and returns the
-	vocabulary and vectors in separate arrays. 
+	vocabulary and vectors in separate arrays. Uses the memory-mapped binary
+	store instead when it exists. The vectors are cast to @dtype if it is given.
 	"""
 	start = time.time()
 	print("Loading pre-trained GloVe word embeddings...")
+	if has_embeddings_store(fpath):
+		vocab, embeddings = load_embeddings_store(fpath, num_embed)
+		if dtype is not None: embeddings = embeddings.astype(dtype, copy=False)
+		print("Finished loading embeddings. Time taken: %.2f seconds."%(time.time()-start))
+		return(vocab, embeddings)
 	vocab = []
 	embeddings = []
-	f = open(fpath)
-	for i in range(num_embed):
-		splitLine = f.readline().split(" ")
-		vocab.append(splitLine[0])
-		embeddings.append([float(value) for value in splitLine[1:]])
+	with open(fpath) as f:
+		# read up to @num_embed lines, or the whole file when @num_embed is None
+		for line in itertools.islice(f, num_embed):
+			splitLine = line.rstrip("\n").split(" ")
+			vocab.append(splitLine[0])
+			embeddings.append([float(value) for value in splitLine[1:]])
 	print("Finished loading embeddings. Time taken: %.2f seconds."%(time.time()-start))
-	return(np.array(vocab), np.array(embeddings))
+	return(np.array(vocab), np.array(embeddings, dtype=dtype))
 
 def load_labels(topics_file, assignments_file):
 	"""
@@ -69,23 +215,140 @@ def load_labels(topics_file, assignments_file):
 def load_abstracts(abs_dir_tok):
 	"""
 	Reads in the tokenized abstracts, stored in individual text files, and returns
-	the file names and tokenized abstracts in two separate lists.
+	the file names and tokenized abstracts in two separate lists, sorted by file name.
 	"""
 	fnames = []
 	abstracts = []
-	for file in glob.glob(abs_dir_tok + "/*"):
+	for file in sorted(glob.glob(abs_dir_tok + "/*")):
 		with open(file, "r") as f:
 			abstracts.append(f.read())
 			fnames.append(os.path.basename(f.name))
 	print("Finished loading tokenized abstracts.")
 	return(fnames, abstracts)
 
-def pad_abstracts(abstracts, vocab, embeddings, max_length):
+# binary hidden state files start with a fixed-size header: magic string, format version,
+# vector dimension, number of rows, numpy dtype string, and the offset and length of the
+# newline-separated paper IDs stored after the row-major state matrix
+STATES_MAGIC = b"ARXSTATE"
+STATES_HEADER = struct.Struct("<8sIIQ8sQQ")
+STATES_HEADER_SIZE = 64
+
+def write_states(fpath, states, ids):
+	"""
+	Writes the hidden state vectors and the paper IDs of their rows into the binary
+	state file at @fpath, which read_states() can memory-map.
+	"""
+	states = np.ascontiguousarray(states)
+	assert states.ndim == 2 and states.shape[0] == len(ids), "Need exactly one paper ID per hidden state."
+	ids_blob = "\n".join(ids).encode("utf-8")
+	ids_offset = STATES_HEADER_SIZE + states.nbytes
+	header = STATES_HEADER.pack(STATES_MAGIC, 1, states.shape[1], states.shape[0], states.dtype.str.encode("ascii"), 
+								ids_offset, len(ids_blob))
+	# readers may have the old file memory-mapped, so never truncate it in place
+	with open(fpath + ".tmp", "wb") as f:
+		f.write(header.ljust(STATES_HEADER_SIZE, b"\0"))
+		f.write(states.tobytes())
+		f.write(ids_blob)
+	os.replace(fpath + ".tmp", fpath)
+
+def create_states(fpath, ids, dim, dtype):
+	"""
+	Creates a binary state file for @fpath with room for one @dim-dimensional hidden state
+	per paper ID in @ids, and returns its state matrix memory-mapped for writing. Rows
+	can then be filled in any order without holding all states in memory. The file is
+	built next to @fpath and only replaces it in commit_states(), so that the server or
+	knn.py can keep the old file memory-mapped in the meantime.
+	"""
+	dtype = np.dtype(dtype)
+	ids_blob = "\n".join(ids).encode("utf-8")
+	ids_offset = STATES_HEADER_SIZE + len(ids)*dim*dtype.itemsize
+	header = STATES_HEADER.pack(STATES_MAGIC, 1, dim, len(ids), dtype.str.encode("ascii"), ids_offset, len(ids_blob))
+	with open(fpath + ".tmp", "wb") as f:
+		f.write(header.ljust(STATES_HEADER_SIZE, b"\0"))
+		f.seek(ids_offset)
+		f.write(ids_blob)
+	if len(ids) == 0:
+		return np.empty((0, dim), dtype=dtype)
+	return np.memmap(fpath + ".tmp", dtype=dtype, mode="r+", offset=STATES_HEADER_SIZE, shape=(len(ids), dim))
+
+def commit_states(fpath, states):
+	"""
+	Flushes the state matrix returned by create_states() for @fpath and atomically moves
+	its file into place.
+	"""
+	if isinstance(states, np.memmap): states.flush()
+	os.replace(fpath + ".tmp", fpath)
+
+def read_states_header(fpath):
+	"""
+	Returns the header of the binary state file at @fpath as a dictionary, or None if
+	@fpath is not a binary state file (e.g. a legacy text file written by np.savetxt).
+	"""
+	with open(fpath, "rb") as f:
+		raw = f.read(STATES_HEADER_SIZE)
+	if len(raw) < STATES_HEADER_SIZE or not raw.startswith(STATES_MAGIC):
+		return None
+	_, version, dim, rows, dtype, ids_offset, ids_length = STATES_HEADER.unpack(raw[:STATES_HEADER.size])
+	return {"version": version, "dim": dim, "rows": rows, "dtype": np.dtype(dtype.rstrip(b"\0").decode("ascii")),
+			"ids_offset": ids_offset, "ids_length": ids_length}
+
+def read_states(fpath, mode="r"):
+	"""
+	Memory-maps the binary state file at @fpath and returns the list of paper IDs along
+	with the (rows, dim) matrix of hidden states, without reading the matrix into memory.
+	"""
+	header = read_states_header(fpath)
+	assert header is not None, "%s is not a binary hidden state file." % fpath
+	with open(fpath, "rb") as f:
+		f.seek(header["ids_offset"])
+		ids_blob = f.read(header["ids_length"]).decode("utf-8")
+	ids = ids_blob.split("\n") if header["rows"] > 0 else []
+	if header["rows"] == 0:
+		return(ids, np.empty((0, header["dim"]), dtype=header["dtype"]))
+	states = np.memmap(fpath, dtype=header["dtype"], mode=mode, offset=STATES_HEADER_SIZE, 
+					   shape=(header["rows"], header["dim"]))
+	return(ids, states)
+
+def append_states(fpath, states, ids, chunk_rows=65536):
+	"""
+	Adds hidden states to the binary state file at @fpath, creating it if needed. Rows
+	whose paper ID is already in the file are replaced, the others are appended. The
+	updated file is built next to @fpath with create_states(), copying the old matrix
+	@chunk_rows rows at a time, and swapped in by commit_states(), so that a crash never
+	leaves a half-written file and readers can keep the old one memory-mapped. Returns
+	the row of each of @ids in the updated file.
+	"""
+	states = np.ascontiguousarray(states)
+	if not os.path.exists(fpath):
+		write_states(fpath, states, ids)
+		return np.arange(len(ids))
+	header = read_states_header(fpath)
+	assert header["dim"] == states.shape[1], "Hidden states do not match the dimension of %s." % fpath
+	old_ids, old_states = read_states(fpath)
+	all_ids = list(old_ids)
+	positions = {paper_id: i for i, paper_id in enumerate(all_ids)}
+	rows = np.empty(len(ids), dtype=np.int64)
+	for i, paper_id in enumerate(ids):
+		if paper_id not in positions:
+			positions[paper_id] = len(all_ids)
+			all_ids.append(paper_id)
+		rows[i] = positions[paper_id]
+	# the file keeps the dtype it was created with
+	new_states = create_states(fpath, all_ids, header["dim"], header["dtype"])
+	for start in range(0, len(old_ids), chunk_rows):
+		end = min(start + chunk_rows, len(old_ids))
+		new_states[start:end] = old_states[start:end]
+	if len(ids) > 0:
+		new_states[rows] = states
+	commit_states(fpath, new_states)
+	return rows
+
+def pad_abstracts(abstracts, vocab, embeddings, max_length, dtype=None):
 	"""
 	Pads abstracts of length less than @max_length with a <NULL> token and
 	truncates abstracts of length more than @max_length. Also adds a <NULL>
 	token to the vocabulary list, and also vector of zeros to the word embeddings 
-	to represent the <NULL> token.
+	to represent the <NULL> token. The word embeddings are cast to @dtype if given.
 	"""
 	# ensure that <NULL> token doesnt yet exist in vocabulary
 	assert "<NULL>" not in vocab, "<NULL> token already exists in vocabulary. Use different null token" 
@@ -108,10 +371,65 @@ def pad_abstracts(abstracts, vocab, embeddings, max_length):
 		# if correct length, don't modify
 		else: 
 			new_abstracts.append(abstract)
-	# get depth of word embeddings
-	depth = embeddings.shape[1]
 	# return padded abstracts, and expanded vocabulary and word embeddings
-	return(new_abstracts, np.array(orig_length), np.append(vocab, "<NULL>"), np.append(embeddings, [[0.]*depth], axis=0))
+	new_vocab, new_embeddings = add_null_token(vocab, embeddings, dtype)
+	return(new_abstracts, np.array(orig_length), new_vocab, new_embeddings)
+
+def add_null_token(vocab, embeddings, dtype=None):
+	"""
+	Adds a <NULL> token to the end of the vocabulary list, and a vector of zeros to the
+	word embeddings to represent the <NULL> token. The embeddings are cast to @dtype
+	(by default, they keep their own) in the same copy that appends the zero row.
+	"""
+	assert "<NULL>" not in vocab, "<NULL> token already exists in vocabulary. Use different null token" 
+	new_embeddings = np.empty((embeddings.shape[0]+1, embeddings.shape[1]), dtype=dtype or embeddings.dtype)
+	new_embeddings[:-1] = embeddings
+	new_embeddings[-1] = 0
+	return(np.append(vocab, "<NULL>"), new_embeddings)
+
+def build_vocab_index(vocab):
+	"""
+	Converts the vocabulary list into a dictionary with the token as the key and its
+	position as the value. Build it once and pass it to pad_and_vectorize().
+	"""
+	return {token: i for i, token in enumerate(vocab)}
+
+def pad_and_vectorize(abstracts, vocab_index, max_length, null_token="<NULL>"):
+	"""
+	Pads/truncates and vectorizes the tokenized abstracts in a single pass. Each abstract
+	is split once and its token positions are written straight into a preallocated
+	(num_abstracts, @max_length) int32 matrix that starts out filled with the position of
+	the <NULL> token, which also stands in for out-of-vocabulary tokens. Returns the matrix
+	along with the unpadded length of each abstract. Equivalent to calling pad_abstracts()
+	followed by vectorize_abstracts().
+	"""
+	start = time.time()
+	null_index = vocab_index[null_token]
+	vectorized_abstracts = np.full((len(abstracts), max_length), null_index, dtype=np.int32)
+	orig_lengths = np.empty(len(abstracts), dtype=np.int32)
+	lookup = vocab_index.get
+	for i, abstract in enumerate(abstracts):
+		tokens = abstract.split(" ")
+		orig_lengths[i] = len(tokens)
+		row = [lookup(token, null_index) for token in tokens[:max_length]]
+		vectorized_abstracts[i, :len(row)] = row
+	metrics.throughput("vectorize_tokens", int(orig_lengths.sum()), time.time()-start)
+	return(vectorized_abstracts, orig_lengths)
+
+def iter_pad_and_vectorize(abstracts, vocab_index, max_length, chunk_size=10000):
+	"""
+	Streaming form of pad_and_vectorize(): consumes any iterable of tokenized abstracts and
+	yields (vectorized_abstracts, orig_lengths) for every @chunk_size abstracts, so only one
+	chunk of text needs to be held in memory at a time.
+	"""
+	chunk = []
+	for abstract in abstracts:
+		chunk.append(abstract)
+		if len(chunk) == chunk_size:
+			yield pad_and_vectorize(chunk, vocab_index, max_length)
+			chunk = []
+	if len(chunk) > 0:
+		yield pad_and_vectorize(chunk, vocab_index, max_length)
 
 def test_pad_abstracts(abs_file, embed_file, max_length):
 	"""
@@ -158,6 +476,75 @@ def get_minibatches(abstracts, lengths, labels, batch_size, shuffle=True):
 		batch_indices = indices[start_index:(start_index+batch_size)]
 		yield abstracts[batch_indices], lengths[batch_indices], labels[batch_indices]
 
+def get_bucketed_minibatches(abstracts, lengths, labels, batch_size, shuffle=True, return_indices=False):
+	"""
+	Returns a generator that iterates over minibatches of abstracts of similar length.
+	Abstracts are sorted by length (with ties broken randomly if @shuffle is True), cut into
+	batches of @batch_size, and the order of the batches is shuffled. Each batch is cut down
+	to the length of its longest abstract, so that short abstracts are not run through
+	hundreds of <NULL> tokens, and its lengths are clipped to the width of the batch.
+	If @return_indices is True, also yields the positions of the abstracts in the batch,
+	which is needed to put outputs back in their original order.
+	"""
+	assert len(abstracts) == len(labels)
+	num_abstracts = len(abstracts)
+	indices = np.arange(num_abstracts)
+	if shuffle: np.random.shuffle(indices)
+	# stable sort, so that the shuffled order breaks ties between equal lengths
+	indices = indices[np.argsort(lengths[indices], kind="mergesort")]
+	batch_starts = np.arange(0, num_abstracts, batch_size)
+	if shuffle: np.random.shuffle(batch_starts)
+	for start_index in batch_starts:
+		batch_indices = indices[start_index:(start_index+batch_size)]
+		batch_lengths = lengths[batch_indices]
+		width = int(min(max(batch_lengths.max(), 1), abstracts.shape[1]))
+		batch = (abstracts[batch_indices, :width], np.minimum(batch_lengths, width), labels[batch_indices])
+		if return_indices:
+			yield batch + (batch_indices,)
+		else:
+			yield batch
+
+def prefetch(batches, buffer_size=4):
+	"""
+	Runs the minibatch generator @batches on a background thread, which keeps up to
+	@buffer_size upcoming batches sliced and padded in a bounded queue while the current
+	batch is being run through the graph. Yields the same batches in the same order, and
+	re-raises any error of the generator. The thread stops if the consumer does.
+	"""
+	batch_queue = queue.Queue(maxsize=buffer_size)
+	stop = threading.Event()
+	end = object()
+
+	def put(item):
+		# retry with a timeout, so that the thread notices when the consumer is gone
+		while not stop.is_set():
+			try:
+				batch_queue.put(item, timeout=0.1)
+				return True
+			except queue.Full:
+				pass
+		return False
+
+	def produce():
+		try:
+			for batch in batches:
+				if not put((batch, None)): return
+			put((end, None))
+		except Exception as e:
+			put((end, e))
+
+	thread = threading.Thread(target=produce, daemon=True)
+	thread.start()
+	try:
+		while True:
+			batch, error = batch_queue.get()
+			if error is not None: raise error
+			if batch is end: break
+			yield batch
+	finally:
+		stop.set()
+		thread.join()
+
 def test_get_minibatches(abs_file, topics_file, labs_file, batch_size, shuffle=True):
 	"""
 	Tests the get_minibatches() function.
@@ -180,7 +567,8 @@ class Progbar(object):
         interval: Minimum visual progress update interval (in seconds).
     """
 
-    def __init__(self, target, width=30, verbose=1):
+    def __init__(self, target, width=30, verbose=1, metric=None):
+        self.metric = metric
         self.width = width
         self.target = target
         self.sum_values = {}
@@ -214,9 +602,18 @@ class Progbar(object):
             if k not in self.sum_values:
                 self.unique_values.append(k)
             self.sum_values[k] = [v, 1]
+        steps = current - self.seen_so_far
         self.seen_so_far = current
 
         now = time.time()
+        # feed the steps and averaged values to the metrics, if enabled
+        if self.metric is not None and metrics.enabled():
+            metrics.count(self.metric + "_steps_total", steps)
+            metrics.gauge(self.metric + "_steps_per_second", current / max(now - self.start, 1e-9))
+            for k in self.unique_values:
+                if isinstance(self.sum_values[k], list):
+                    metrics.gauge(self.metric + "_" + k.lower(), self.sum_values[k][0] / max(1, self.sum_values[k][1]))
+            metrics.maybe_flush()
         if self.verbose == 1:
             prev_total_width = self.total_width
             sys.stdout.write("\b" * prev_total_width)
@@ -280,8 +677,16 @@ if __name__ == "__main__":
 	parser.add_argument("--lda-assignments", type=str, default="lda_assignments", help="lda_assignments file")
 	parser.add_argument("--abs-dir-tok", type=str, default="data/abstracts_tokenized", help="Directory that stores tokenized abstracts.")
 	parser.add_argument("--embeddings", type=str, default="glove/embeddings.txt", help="Path to pre-trained word embeddings.")
+	parser.add_argument("--convert-embeddings", action="store_true", default=False, help="Convert the GloVe embeddings into a binary store.")
+	parser.add_argument("--embeddings-dtype", type=str, default="float32", help="Float type of the binary embedding store.")
+	parser.add_argument("--glove-binary", type=str, default="glove/embeddings.bin", help="Binary GloVe output (BINARY=2 in embeddings.sh).")
+	parser.add_argument("--glove-vocab", type=str, default="glove/vocab.txt", help="GloVe VOCAB_FILE that matches the binary output.")
 	args = parser.parse_args()	
 
+	if args.convert_embeddings:
+		convert_embeddings(args.embeddings, args.glove_vocab, args.glove_binary, args.embeddings_dtype)
+		sys.exit()
+
 	# test_get_minibatches(args.abs_dir_tok, args.lda_topics, args.lda_assignments, batch_size=1000, shuffle=True)
 	# test_pad_abstracts(args.abs_dir_tok, args.embeddings, max_length=300)
 	vocab, embeddings = load_embeddings_array(args.embeddings, num_embed=200000)
@@ -1,51 +1,167 @@
 """
 NOT MINE!! Taken wholesale from https://github.com/karpathy/arxiv-sanity-preserver.
 
-Iterates over all papers in the parsed pickle and downloads the papers into a folder /pdf.
+Iterates over all papers in the metadata store and downloads the papers into a folder /pdf.
+Downloads run on a bounded pool of threads that reuse keep-alive connections, are rate
+limited per host, retried with exponential backoff, and written to a temporary file that
+is only renamed into place once complete.
 """
 
 
 import os
 import time
-import pickle
-import shutil
 import random
-from  urllib.request import urlopen
+import shutil
+import argparse
+import threading
+import http.client
+from urllib.parse import urlparse, urljoin
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from utils import Config
+from ratelimit import TokenBucket
+from metadata import MetadataStore, DB_PATH
 
 timeout_secs = 10 # after this many seconds we give up on a paper
-if not os.path.exists(Config.pdf_dir): os.makedirs(Config.pdf_dir)
-have = set(os.listdir(Config.pdf_dir)) # get list of all pdfs we already have
-
-numok = 0
-numtot = 0
-db = pickle.load(open(Config.db_path, 'rb'))
-for pid,j in db.items():
-  
-  pdfs = [x['href'] for x in j['links'] if x['type'] == 'application/pdf']
-  assert len(pdfs) == 1
-  pdf_url = pdfs[0] + '.pdf'
-  basename = pdf_url.split('/')[-1]
-  fname = os.path.join(Config.pdf_dir, basename)
-
-  # try retrieve the pdf
-  numtot += 1
-  try:
+max_redirects = 5
+
+class ConnectionPool(object):
+  """ keeps one keep-alive connection per host in every worker thread """
+
+  def __init__(self, timeout):
+    self.timeout = timeout
+    self.local = threading.local()
+
+  def get(self, scheme, netloc):
+    conns = self.local.__dict__.setdefault('conns', {})
+    if (scheme, netloc) not in conns:
+      cls = http.client.HTTPSConnection if scheme == 'https' else http.client.HTTPConnection
+      conns[(scheme, netloc)] = cls(netloc, timeout=self.timeout)
+    return conns[(scheme, netloc)]
+
+  def drop(self, scheme, netloc):
+    conn = self.local.__dict__.get('conns', {}).pop((scheme, netloc), None)
+    if conn is not None: conn.close()
+
+class HostLimiters(object):
+  """ one token bucket per host, created on first use """
+
+  def __init__(self, rate):
+    self.rate = rate
+    self.buckets = {}
+    self.lock = threading.Lock()
+
+  def get(self, netloc):
+    with self.lock:
+      if netloc not in self.buckets: self.buckets[netloc] = TokenBucket(self.rate)
+      return self.buckets[netloc]
+
+class HTTPStatusError(IOError):
+  """ a response with a status other than 200 or a redirect """
+
+  def __init__(self, status, url):
+    IOError.__init__(self, 'HTTP %d for %s' % (status, url))
+    self.status = status
+
+  def retryable(self):
+    # client errors such as 404 or 403 will not go away, except for rate limiting
+    return self.status >= 500 or self.status == 429
+
+def fetch(pool, limiters, url, fname, retries=3, backoff=1.0):
+  """
+  downloads url into fname and returns the number of bytes written. the pdf is written
+  to fname.part first and renamed when complete, so an interrupted download never
+  leaves a truncated pdf behind. server errors (5xx, 429) and network errors are retried
+  with backoff, other client errors fail right away.
+  """
+  tmp_fname = fname + '.part'
+  for attempt in range(retries + 1):
+    target = url
+    parts = None
+    try:
+      for _ in range(max_redirects + 1):
+        parts = urlparse(target)
+        limiters.get(parts.netloc).acquire()
+        conn = pool.get(parts.scheme, parts.netloc)
+        path = parts.path + ('?' + parts.query if parts.query else '')
+        conn.request('GET', path, headers={'User-Agent': 'arxiv-recommender', 'Connection': 'keep-alive'})
+        resp = conn.getresponse()
+        if resp.status in (301, 302, 303, 307, 308):
+          resp.read()
+          target = urljoin(target, resp.getheader('Location'))
+          continue
+        if resp.status != 200:
+          raise HTTPStatusError(resp.status, target)
+        with open(tmp_fname, 'wb') as fp:
+          shutil.copyfileobj(resp, fp)
+        os.replace(tmp_fname, fname)
+        return os.path.getsize(fname)
+      raise IOError('too many redirects for %s' % (url, ))
+    except Exception as e:
+      # the connection may be closed by the server or left with a half-read response,
+      # so never hand it to the next request
+      if parts is not None: pool.drop(parts.scheme, parts.netloc)
+      if os.path.isfile(tmp_fname): os.remove(tmp_fname)
+      if attempt == retries or (isinstance(e, HTTPStatusError) and not e.retryable()): raise
+      wait = backoff * 2**attempt + random.uniform(0, backoff)
+      print('error downloading %s (%s), retrying in %.1f seconds' % (url, e, wait))
+      time.sleep(wait)
+
+if __name__ == "__main__":
+
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--num-workers', type=int, default=4, help='number of concurrent downloads')
+  parser.add_argument('--rate-per-host', type=float, default=4.0, help='maximum requests per second to any one host')
+  parser.add_argument('--retries', type=int, default=3, help='number of retries per paper')
+  parser.add_argument('--db-name', type=str, default=DB_PATH, help='path to the paper metadata store')
+  parser.add_argument('--backoff', type=float, default=1.0, help='base of the exponential backoff between retries (in seconds)')
+  args = parser.parse_args()
+
+  if not os.path.exists(Config.pdf_dir): os.makedirs(Config.pdf_dir)
+  # remove partial downloads of an interrupted run; they are never counted as done
+  for f in os.listdir(Config.pdf_dir):
+    if f.endswith('.part'): os.remove(os.path.join(Config.pdf_dir, f))
+  have = set(os.listdir(Config.pdf_dir)) # get list of all pdfs we already have
+
+  numok = 0
+  numtot = 0
+  db = MetadataStore(args.db_name)
+  numpapers = len(db)
+  todo = []
+  for pid,j in db.items():
+
+    pdfs = [x['href'] for x in j['links'] if x['type'] == 'application/pdf']
+    assert len(pdfs) == 1
+    pdf_url = pdfs[0] + '.pdf'
+    basename = pdf_url.split('/')[-1]
+    fname = os.path.join(Config.pdf_dir, basename)
     if not basename in have:
-      print('fetching %s into %s' % (pdf_url, fname))
-      req = urlopen(pdf_url, None, timeout_secs)
-      with open(fname, 'wb') as fp:
-          shutil.copyfileobj(req, fp)
-      time.sleep(0.05 + random.uniform(0,0.1))
+      todo.append((pdf_url, fname))
     else:
-      print('%s exists, skipping' % (fname, ))
-    numok+=1
-  except Exception as e:
-    print('error downloading: ', pdf_url)
-    print(e)
-  
-  print('%d/%d of %d downloaded ok.' % (numok, numtot, len(db)))
-  
-print('final number of papers downloaded okay: %d/%d' % (numok, len(db)))
+      numok += 1
+      numtot += 1
+  print('%d pdfs already exist, fetching %d more' % (numok, len(todo)))
+
+  # try retrieve the pdfs
+  start = time.time()
+  numdone = 0
+  numbytes = 0
+  pool = ConnectionPool(timeout_secs)
+  limiters = HostLimiters(args.rate_per_host)
+  with ThreadPoolExecutor(max_workers=args.num_workers) as executor:
+    futures = {executor.submit(fetch, pool, limiters, pdf_url, fname, args.retries, args.backoff): pdf_url
+               for pdf_url, fname in todo}
+    for future in as_completed(futures):
+      numtot += 1
+      numdone += 1
+      try:
+        numbytes += future.result()
+        numok += 1
+      except Exception as e:
+        print('error downloading: ', futures[future])
+        print(e)
+      elapsed = max(time.time() - start, 1e-6)
+      print('%d/%d of %d downloaded ok. %.2f pdfs/s, %.2f MB/s' % (numok, numtot, numpapers,
+            numdone / elapsed, numbytes / elapsed / 1e6))
 
+  print('final number of papers downloaded okay: %d/%d' % (numok, numpapers))
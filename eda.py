@@ -1,11 +1,13 @@
 # Performs basic exploratory data analysis on the generated tokens and word embeddings.
 
-import string
 import pandas as pd
 import matplotlib.pyplot as plt
 from sklearn.manifold import TSNE
 from data_utils import *
-from nltk.corpus import stopwords
+from corpus import PackedCorpus, corpus_exists
+from corpus_stats import get_stop_list, load_stats, top_k
+
+CORPUS_PREFIX = "data/corpus"
 
 def get_top_fifty(token_and_counts, K=50, print_mat=False):
 	"""
@@ -13,18 +15,17 @@ def get_top_fifty(token_and_counts, K=50, print_mat=False):
 	the top K (50 by default) most frequent tokens that are not common stop 
 	words, punctuations, or numbers, along with their counts.
 	"""
+	stopList = set(get_stop_list())
 	top50 = []
 	index = 0
 	for token, count in iter(token_and_counts):
-		if token.lower() not in stopwords.words('english'):
-			if token not in string.punctuation:
-				if not token.isdigit():
-					top50.append((index, token, count))
-					index += 1
-		if index == K:
-			out = np.array(top50, dtype=("int, U25, int"))
-			if print_mat: print(out)
-			return out
+		if token.lower() not in stopList and not token.isdigit():
+			top50.append((index, token, count))
+			index += 1
+		if index == K: break
+	out = np.array(top50, dtype=[("rank", int), ("token", object), ("count", int)])
+	if print_mat: print(out)
+	return out
 
 def plot_counts(top_fifty, indices):
 	"""
@@ -39,6 +40,16 @@ def plot_counts(top_fifty, indices):
 	plt.gcf().tight_layout()
 	plt.show()
 
+def plot_lengths(length_histogram):
+	"""
+	Plots the histogram of abstract lengths, in tokens.
+	"""
+	plt.figure(figsize=(8, 3))
+	plt.bar(np.arange(length_histogram.size), length_histogram, width=1.0, color='blue')
+	plt.xlabel("Abstract length (tokens)", fontsize=14); plt.ylabel("Count", fontsize=12)
+	plt.gcf().tight_layout()
+	plt.show()
+
 def visualize_words(embed_dict, num_words, use_prev):
 	"""
 	Performs t-SNE dimensionality reduction on the word embeddings of the @num_words
@@ -70,11 +81,18 @@ def visualize_words(embed_dict, num_words, use_prev):
 	plt.show()
 
 if __name__ == "__main__":
-	# load vocabulary and counts
-	print("Loading vocabulary and counts...")
-	vocab = load_vocab("glove/vocab.txt")
-	# obtain fifty most frequent tokens
-	top50 = get_top_fifty(vocab, print_mat=False)
+	if corpus_exists(CORPUS_PREFIX):
+		# count tokens and abstract lengths in one pass over the packed corpus, or load the cached counts
+		stats = load_stats(CORPUS_PREFIX, "glove/embeddings.txt", max_embed=209126)
+		print("OOV rate: %.2f%% of tokens." % (100*stats["oov_rate"]))
+		top50 = top_k(stats, PackedCorpus(CORPUS_PREFIX).vocab, K=50)
+		plot_lengths(stats["length_histogram"])
+	else:
+		# load vocabulary and counts
+		print("Loading vocabulary and counts...")
+		vocab = load_vocab("glove/vocab.txt")
+		# obtain fifty most frequent tokens
+		top50 = get_top_fifty(vocab, print_mat=False)
 	# plot frequent tokens and counts
 	plot_counts(top50, np.array([11, 12, 13, 15, 26, 27, 28, 29, 33, 35]))
 	# load pre-trained GloVe word embeddings
@@ -49,6 +49,10 @@ $GLOVE_DIR/shuffle -memory $MEMORY -verbose $VERBOSE < $GLOVE_DIR/$COOCCURRENCE_
 echo "$ $GLOVE_DIR/glove -save-file $GLOVE_DIR/$SAVE_FILE -threads $NUM_THREADS -input-file $GLOVE_DIR/$COOCCURRENCE_SHUF_FILE -x-max $X_MAX -iter $MAX_ITER -vector-size $VECTOR_SIZE -binary $BINARY -vocab-file $GLOVE_DIR/$VOCAB_FILE -verbose $VERBOSE"
 $GLOVE_DIR/glove -save-file $GLOVE_DIR/$SAVE_FILE -threads $NUM_THREADS -input-file $GLOVE_DIR/$COOCCURRENCE_SHUF_FILE -x-max $X_MAX -iter $MAX_ITER -vector-size $VECTOR_SIZE -binary $BINARY -vocab-file $GLOVE_DIR/$VOCAB_FILE -verbose $VERBOSE
 
+# convert the binary GloVe output into the memory-mapped store read by data_utils.py
+echo "$ python data_utils.py --convert-embeddings --embeddings $GLOVE_DIR/$SAVE_FILE.txt --glove-binary $GLOVE_DIR/$SAVE_FILE.bin --glove-vocab $GLOVE_DIR/$VOCAB_FILE"
+python data_utils.py --convert-embeddings --embeddings $GLOVE_DIR/$SAVE_FILE.txt --glove-binary $GLOVE_DIR/$SAVE_FILE.bin --glove-vocab $GLOVE_DIR/$VOCAB_FILE
+
 # # evaluate word vectors
 # echo "$ python $GLOVE_DIR/eval/evaluate.py -vocab_file --$GLOVE_DIR/$VOCAB_FILE -vectors_file --$GLOVE_DIR/$embeddings"
 # python $GLOVE_DIR/eval/evaluate.py --vocab_file $GLOVE_DIR/$VOCAB_FILE --vectors_file $GLOVE_DIR/$SAVE_FILE
\ No newline at end of file
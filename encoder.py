@@ -0,0 +1,116 @@
+# Warm in-process encoder. Loads the vocabulary, word embeddings and trained RNN weights
+# once, and maps raw abstract texts to hidden state vectors without writing any files.
+# Requests from concurrent threads are gathered into micro-batches, so that each one
+# costs about one forward pass instead of a full run of rnn.py --test.
+
+from rnn import *
+from tokenizer import tokenize, format_tokens
+from concurrent.futures import Future
+import queue
+import threading
+
+class Encoder(object):
+	"""
+	Encodes abstracts with the trained RNN. encode() can be called from any number of
+	threads: a worker thread takes up to @max_batch_size pending texts at a time,
+	waiting at most @max_wait seconds for more to arrive, and runs them as one batch.
+	At most @max_new_tokens rows are added to the embedding table for terms unseen at
+	training time; later new terms are encoded as <NULL>, like other unknown tokens.
+	"""
+	def __init__(self, embeddings_file, max_embed, max_length, weights="./weights/train",
+				 max_batch_size=64, max_wait=0.005, max_new_tokens=50000):
+		start = time.time()
+		self.max_length = max_length
+		self.max_batch_size = max_batch_size
+		self.max_wait = max_wait
+		self.max_new_tokens = max_new_tokens
+		self.vocab, embeddings = load_model_embeddings(embeddings_file, max_embed)
+		self.vocab_index = build_vocab_index(self.vocab)
+		self.num_trained_tokens = len(self.vocab)
+		# the table saved at training time only holds the tokens of the training corpus, so
+		# the rows of new terms are read from the full pretrained embeddings when they show up
+		self.full_vocab = None
+		if has_embeddings_store(Config.embeddings_store):
+			self.full_vocab, self.full_embeddings = load_embeddings_array(embeddings_file, max_embed)
+			self.full_index = build_vocab_index(self.full_vocab)
+		# the encoder keeps its own graph and session, so it can live next to other models
+		self.graph = tf.Graph()
+		with self.graph.as_default():
+			self.rnn = RNN(Config(), embeddings, training=False)
+			self.session = tf.Session(graph=self.graph)
+			self.rnn.initialize(self.session)
+			tf.train.Saver(tf.trainable_variables()).restore(self.session, weights)
+		self.requests = queue.Queue()
+		self.worker = threading.Thread(target=self._run, daemon=True)
+		self.worker.start()
+		print("Encoder ready. Time taken: %.2f seconds." % (time.time()-start))
+
+	def encode(self, texts):
+		"""
+		Returns the hidden state vectors of the raw abstracts in @texts, one row per text.
+		"""
+		futures = []
+		for text in texts:
+			future = Future()
+			self.requests.put((format_tokens(tokenize(text)), future))
+			futures.append(future)
+		if len(futures) == 0:
+			return np.empty((0, Config.hidden_size), dtype=Config.dtype)
+		return np.stack([future.result() for future in futures])
+
+	def close(self):
+		"""
+		Stops the worker thread and releases the session.
+		"""
+		self.requests.put(None)
+		self.worker.join()
+		self.session.close()
+
+	def _run(self):
+		"""
+		Worker loop that gathers pending requests into batches and encodes them.
+		"""
+		while True:
+			request = self.requests.get()
+			if request is None: return
+			batch = [request]
+			deadline = time.time() + self.max_wait
+			while len(batch) < self.max_batch_size:
+				try:
+					request = self.requests.get(timeout=max(deadline - time.time(), 0))
+				except queue.Empty:
+					break
+				if request is None:
+					self.requests.put(None)
+					break
+				batch.append(request)
+			try:
+				self._add_new_tokens([text for text, _ in batch])
+				vectorized, lengths = pad_and_vectorize([text for text, _ in batch], self.vocab_index, self.max_length)
+				# cut the batch down to its longest abstract, as in get_bucketed_minibatches()
+				width = int(min(max(lengths.max(), 1), self.max_length))
+				states = self.rnn.get_states_on_batch(self.session, vectorized[:, :width], np.minimum(lengths, width))
+				for (_, future), state in zip(batch, states):
+					future.set_result(state)
+			except Exception as e:
+				for _, future in batch:
+					future.set_exception(e)
+
+	def _add_new_tokens(self, texts):
+		"""
+		Extends the embedding layer with the pretrained rows of tokens in @texts that the
+		table lacks, until @max_new_tokens rows have been added. The whole table is fed
+		again, which only happens for unseen terms.
+		"""
+		if self.full_vocab is None: return
+		room = self.max_new_tokens - (len(self.vocab) - self.num_trained_tokens)
+		if room <= 0: return
+		tokens = sorted({token for text in texts for token in text.split(" ")
+						 if token not in self.vocab_index and token in self.full_index})[:room]
+		if len(tokens) == 0: return
+		vocab, embeddings = extend_embeddings(self.vocab, self.rnn.pretrained_embeddings, tokens,
+											  self.full_vocab, self.full_embeddings, self.full_index)
+		if len(vocab) == len(self.vocab): return
+		self.vocab_index.update((token, i) for i, token in enumerate(vocab[len(self.vocab):], len(self.vocab)))
+		self.vocab = vocab
+		self.rnn.set_embeddings(self.session, embeddings)
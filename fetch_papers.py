@@ -2,19 +2,20 @@
 NOT MINE!! Taken wholesale from https://github.com/karpathy/arxiv-sanity-preserver.
 
 Queries arxiv API and downloads papers (the query is a parameter).
-The script is intended to enrich an existing database pickle (by default db.p),
-so this file will be loaded first, and then new results will be added to it.
+The script is intended to enrich an existing metadata store (by default db.sqlite),
+and new results are upserted into it page by page.
 """
 
 import os
-import time
-import pickle
-import random
+import json
 import argparse
+import collections
 import urllib.request
+from concurrent.futures import ThreadPoolExecutor
 import feedparser
 
-from utils import Config, safe_pickle_dump
+from ratelimit import TokenBucket
+from metadata import MetadataStore, DB_PATH
 
 def encode_feedparser_dict(d):
   """ 
@@ -45,6 +46,64 @@ def parse_arxiv_url(url):
   assert len(parts) == 2, 'error parsing url ' + url
   return parts[0], int(parts[1])
 
+def fetch_page(base_url, search_query, start, results_per_iteration, limiter, timeout=60):
+  """
+  fetches one page of API results, waiting for the rate limiter first.
+  runs in a worker thread so that network waits overlap with parsing.
+  """
+  query = 'search_query=%s&sortBy=lastUpdatedDate&start=%i&max_results=%i' % (search_query,
+                                                       start, results_per_iteration)
+  limiter.acquire()
+  with urllib.request.urlopen(base_url+query, timeout=timeout) as url:
+    return url.read()
+
+def merge_entries(db, versions, entries):
+  """
+  adds the parsed entries to db if we didn't have them before, or if they are a new version.
+  versions maps the arxiv id of every stored paper to its version, and is kept up to date.
+  returns the number of added and skipped papers.
+  """
+  num_added = 0
+  num_skipped = 0
+  new_entries = []
+  for e in entries:
+
+    j = encode_feedparser_dict(e)
+
+    # extract just the raw arxiv id and version for this paper
+    rawid, version = parse_arxiv_url(j['id'])
+    j['_rawid'] = rawid
+    j['_version'] = version
+
+    # add to our database if we didn't have it before, or if this is a new version
+    if not rawid in versions or j['_version'] > versions[rawid]:
+      versions[rawid] = j['_version']
+      new_entries.append(j)
+      print('Updated %s added %s' % (j['updated'].encode('utf-8'), j['title'].encode('utf-8')))
+      num_added += 1
+    else:
+      num_skipped += 1
+  # write the whole page in one transaction
+  db.upsert_many(new_entries)
+  return num_added, num_skipped
+
+def load_checkpoint(checkpoint_path):
+  """ returns the saved progress of an interrupted run, or None """
+  if not os.path.isfile(checkpoint_path):
+    return None
+  with open(checkpoint_path) as f:
+    return json.load(f)
+
+def save_checkpoint(db, checkpoint_path, progress):
+  """
+  saves the page to resume from. merged papers are already in the store, so
+  the checkpoint never points past papers that were not saved.
+  """
+  with open(checkpoint_path + '.tmp', 'w') as f:
+    json.dump(progress, f)
+  os.replace(checkpoint_path + '.tmp', checkpoint_path)
+  print('Checkpointed %d papers, next page starts at %d' % (len(db), progress['next_index']))
+
 if __name__ == "__main__":
 
   # parse input arguments
@@ -55,72 +114,91 @@ if __name__ == "__main__":
   parser.add_argument('--start-index', type=int, default=0, help='0 = most recent API result')
   parser.add_argument('--max-index', type=int, default=10000, help='upper bound on paper index we will fetch')
   parser.add_argument('--results-per-iteration', type=int, default=100, help='passed to arxiv API')
-  parser.add_argument('--wait-time', type=float, default=5.0, help='lets be gentle to arxiv API (in number of seconds)')
+  parser.add_argument('--wait-time', type=float, default=5.0, help='lets be gentle to arxiv API (average number of seconds between requests)')
   parser.add_argument('--break-on-no-added', type=int, default=1, help='break out early if all returned query papers are already in db? 1=yes, 0=no')
+  parser.add_argument('--num-workers', type=int, default=2, help='number of pages fetched concurrently')
+  parser.add_argument('--base-url', type=str, default='http://export.arxiv.org/api/query?', help='base api query url (point at a local feed server for testing)')
+  parser.add_argument('--checkpoint', type=str, default='fetch_checkpoint.json', help='file that records progress for --resume')
+  parser.add_argument('--checkpoint-every', type=int, default=5, help='save the database and progress every this many pages')
+  parser.add_argument('--resume', action='store_true', default=False, help='continue from the last checkpoint')
+  parser.add_argument('--db-name', type=str, default=DB_PATH, help='path to the paper metadata store')
   args = parser.parse_args()
 
-  # misc hardcoded variables
-  base_url = 'http://export.arxiv.org/api/query?' # base api query url
   print('Searching arXiv for %s' % (args.search_query, ))
 
-  # lets load the existing database to memory
-  try:
-    db = pickle.load(open(Config.db_path, 'rb'))
-    print('loaded existing database')
-  except Exception as e:
-    print('error loading existing database:')
-    print(e)
-    print('starting from an empty database')
-    db = {}
+  # open the metadata store; only the version of each paper is kept in memory
+  db = MetadataStore(args.db_name)
+  versions = db.versions()
+
+  # pick up where an interrupted run stopped
+  start_index = args.start_index
+  num_added_total = 0
+  checkpoint = load_checkpoint(args.checkpoint) if args.resume else None
+  if checkpoint is not None:
+    start_index = checkpoint['next_index']
+    num_added_total = checkpoint['num_added_total']
+    print('resuming from result %d' % (start_index, ))
 
   # -----------------------------------------------------------------------------
-  # main loop where we fetch the new results
+  # main loop where we fetch the new results. pages are requested by a pool of
+  # workers under a shared rate limit, and parsed in order as they arrive.
   print('database has %d entries at start' % (len(db), ))
-  num_added_total = 0
-  for i in range(args.start_index, args.max_index, args.results_per_iteration):
-
-    print("Results %i - %i" % (i,i+args.results_per_iteration))
-    query = 'search_query=%s&sortBy=lastUpdatedDate&start=%i&max_results=%i' % (args.search_query,
-                                                         i, args.results_per_iteration)
-    with urllib.request.urlopen(base_url+query) as url:
-      response = url.read()
-    parse = feedparser.parse(response)
-    num_added = 0
-    num_skipped = 0
-    for e in parse.entries:
-
-      j = encode_feedparser_dict(e)
-
-      # extract just the raw arxiv id and version for this paper
-      rawid, version = parse_arxiv_url(j['id'])
-      j['_rawid'] = rawid
-      j['_version'] = version
-
-      # add to our database if we didn't have it before, or if this is a new version
-      if not rawid in db or j['_version'] > db[rawid]['_version']:
-        db[rawid] = j
-        print('Updated %s added %s' % (j['updated'].encode('utf-8'), j['title'].encode('utf-8')))
-        num_added += 1
-        num_added_total += 1
-      else:
-        num_skipped += 1
-
-    # print some information
-    print('Added %d papers, already had %d.' % (num_added, num_skipped))
-
-    if len(parse.entries) == 0:
-      print('Received no results from arxiv. Rate limiting? Exiting. Restart later maybe.')
-      print(response)
-      break
-
-    if num_added == 0 and args.break_on_no_added == 1:
-      print('No new papers were added. Assuming no new papers exist. Exiting.')
-      break
-
-    print('Sleeping for %i seconds' % (args.wait_time , ))
-    time.sleep(args.wait_time + random.uniform(0, 3))
-
-  # save the database before we quit, if we found anything new
-  if num_added_total > 0:
-    print('Saving database with %d papers to %s' % (len(db), Config.db_path))
-    safe_pickle_dump(db, Config.db_path)
\ No newline at end of file
+  limiter = TokenBucket(rate=1.0/args.wait_time)
+  starts = iter(range(start_index, args.max_index, args.results_per_iteration))
+  in_flight = collections.deque()
+  pages_since_checkpoint = 0
+  next_index = start_index
+  finished = True
+  with ThreadPoolExecutor(max_workers=args.num_workers) as pool:
+
+    def submit_next():
+      i = next(starts, None)
+      if i is not None:
+        in_flight.append((i, pool.submit(fetch_page, args.base_url, args.search_query, i,
+                                         args.results_per_iteration, limiter)))
+
+    for _ in range(args.num_workers):
+      submit_next()
+    while in_flight:
+      i, future = in_flight.popleft()
+      print("Results %i - %i" % (i,i+args.results_per_iteration))
+      try:
+        response = future.result()
+      except Exception as e:
+        print('error fetching results %d: %s. Rerun with --resume to continue.' % (i, e))
+        finished = False
+        break
+      submit_next()
+
+      parse = feedparser.parse(response)
+      num_added, num_skipped = merge_entries(db, versions, parse.entries)
+      num_added_total += num_added
+
+      # print some information
+      print('Added %d papers, already had %d.' % (num_added, num_skipped))
+
+      if len(parse.entries) == 0:
+        print('Received no results from arxiv. Rate limiting? Exiting. Restart later maybe.')
+        print(response)
+        finished = False
+        break
+
+      next_index = i + args.results_per_iteration
+      pages_since_checkpoint += 1
+      if pages_since_checkpoint >= args.checkpoint_every:
+        save_checkpoint(db, args.checkpoint, {'next_index': next_index, 'num_added_total': num_added_total})
+        pages_since_checkpoint = 0
+
+      if num_added == 0 and args.break_on_no_added == 1:
+        print('No new papers were added. Assuming no new papers exist. Exiting.')
+        break
+
+    # drop pages that were requested but are no longer needed
+    for _, future in in_flight:
+      future.cancel()
+
+  print('database has %d entries, added %d' % (len(db), num_added_total))
+  if finished:
+    if os.path.isfile(args.checkpoint): os.remove(args.checkpoint)
+  else:
+    save_checkpoint(db, args.checkpoint, {'next_index': next_index, 'num_added_total': num_added_total})
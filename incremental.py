@@ -0,0 +1,193 @@
+# Incremental ingest. Tracks which stage every paper has been through in a manifest keyed
+# by arXiv ID and version, and only tokenizes, vectorizes and encodes papers that are new
+# or updated since the last run. Their hidden states are appended to the binary state file
+# and to the nearest neighbor index, so a daily update costs time proportional to the delta.
+
+from rnn import *
+from tokenizer import tokenize_files
+from corpus import PackedCorpus, append_documents, corpus_exists, read_lines, write_stale_ids
+from knn_index import IVFIndex
+from metadata import MetadataStore, DB_PATH
+import json
+
+# stages in the order each paper goes through them
+STAGES = ["abstract", "tokenized", "encoded", "indexed"]
+
+def load_manifest(manifest_file):
+	"""
+	Reads the manifest, which maps each arXiv ID to its version and to the version that
+	each stage was last run on.
+	"""
+	if not os.path.exists(manifest_file):
+		return {}
+	with open(manifest_file) as f:
+		return json.load(f)
+
+def save_manifest(manifest, manifest_file):
+	"""
+	Writes the manifest to a temporary file and renames it into place, so that an
+	interrupted run never leaves a truncated manifest behind.
+	"""
+	with open(manifest_file + ".tmp", "w") as f:
+		json.dump(manifest, f)
+	os.replace(manifest_file + ".tmp", manifest_file)
+
+def mark(manifest, rawids, versions, stage):
+	"""
+	Records that @stage has been run on the given version of each paper.
+	"""
+	for rawid in rawids:
+		entry = manifest.setdefault(rawid, {"version": versions[rawid], "stages": {}})
+		# a newer version invalidates every stage run on an older one
+		if entry["version"] != versions[rawid]:
+			entry["version"] = versions[rawid]
+			entry["stages"] = {}
+		entry["stages"][stage] = versions[rawid]
+
+def pending(manifest, versions, stage):
+	"""
+	Returns the arXiv IDs of the papers whose current version has not been through @stage.
+	"""
+	return sorted(rawid for rawid, version in versions.items()
+				  if manifest.get(rawid, {}).get("stages", {}).get(stage) != version)
+
+def init_manifest(manifest, versions, states_file):
+	"""
+	Marks every paper that already has a hidden state as fully processed, so that the
+	first incremental run after a full run of the pipeline does not redo everything.
+	"""
+	ids, _ = read_states(states_file)
+	done = [rawid for rawid in ids if rawid in versions]
+	for stage in STAGES:
+		mark(manifest, done, versions, stage)
+	print("Marked %i existing papers as processed." % len(done))
+
+def write_abstracts(db, rawids, abs_dir):
+	"""
+	Writes the abstract of each paper in @rawids to its own text file.
+	"""
+	if not os.path.exists(abs_dir):
+		os.makedirs(abs_dir)
+	for rawid, summary in db.summaries(rawids):
+		with open(os.path.join(abs_dir, rawid), "w+") as f:
+			f.write(summary)
+
+def read_tokenized(rawids, abs_dir_tok):
+	"""
+	Returns the tokenized abstracts of @rawids as a list.
+	"""
+	abstracts = []
+	for rawid in rawids:
+		with open(os.path.join(abs_dir_tok, rawid), "r") as f:
+			abstracts.append(f.read())
+	return abstracts
+
+def encode_abstracts(rawids, abs_dir_tok, embeddings_file, max_embed, max_length):
+	"""
+	Vectorizes the tokenized abstracts of @rawids and returns their final RNN hidden states.
+	"""
+	abstracts = read_tokenized(rawids, abs_dir_tok)
+	vectorized_abstracts, lengths, embeddings = process_abstracts(abstracts, embeddings_file, max_embed, max_length)
+	return get_all_states(vectorized_abstracts, lengths, embeddings)
+
+def append_to_corpus(args, rawids):
+	"""
+	Appends the tokenized abstracts of the new papers in @rawids to the packed corpus,
+	along with their LDA labels if the corpus has been labeled, so that lda_assignments
+	stays aligned row for row with the corpus. Papers that are already packed cannot be
+	replaced in place: those whose abstract changed are recorded with write_stale_ids()
+	until the corpus is rebuilt, and returned so they are not marked as tokenized.
+	"""
+	packed = PackedCorpus(args.corpus)
+	positions = {paper_id: i for i, paper_id in enumerate(packed.ids)}
+	abstracts = read_tokenized(rawids, args.abs_dir_tok)
+	new_ids = [rawid for rawid in rawids if rawid not in positions]
+	new_abstracts = [abstract for rawid, abstract in zip(rawids, abstracts) if rawid not in positions]
+	stale = [rawid for rawid, abstract in zip(rawids, abstracts)
+			 if rawid in positions and packed.text(positions[rawid]) != abstract]
+	if len(new_ids) > 0 and os.path.exists(args.lda_assignments):
+		num_labels = len(read_lines(args.lda_assignments))
+		assert num_labels == len(packed), "%s has %i labels for %i abstracts in %s; rerun lda.py." % (
+			args.lda_assignments, num_labels, len(packed), args.corpus)
+		assert os.path.exists(args.lda_model) and os.path.exists(args.dictionary), \
+			"Cannot label new abstracts without the LDA model %s and dictionary %s." % (args.lda_model, args.dictionary)
+		# imported here so that updating an unlabeled corpus does not need gensim
+		from lda import label_abstracts
+		labels = label_abstracts(args.lda_model, args.dictionary, new_abstracts)
+		append_documents(args.corpus, new_ids, new_abstracts)
+		with open(args.lda_assignments, "a") as f:
+			f.write("".join("%i\n" % label for label in labels))
+	elif len(new_ids) > 0:
+		append_documents(args.corpus, new_ids, new_abstracts)
+	write_stale_ids(args.corpus, stale)
+	if len(stale) > 0:
+		print("Warning: %i updated abstracts are out of date in %s: %s. Rebuild the corpus with corpus.py and rerun lda.py."
+			  % (len(stale), args.corpus, " ".join(stale)))
+	return set(stale)
+
+def update(db, manifest, args):
+	"""
+	Runs every stage on the papers that still need it, saving the manifest after each stage.
+	"""
+	versions = db.versions()
+	# write and tokenize the abstracts of new or updated papers
+	rawids = pending(manifest, versions, "abstract")
+	write_abstracts(db, rawids, args.abs_dir)
+	mark(manifest, rawids, versions, "abstract")
+	save_manifest(manifest, args.manifest)
+	rawids = pending(manifest, versions, "tokenized")
+	tokenize_files([(os.path.join(args.abs_dir, rawid), os.path.join(args.abs_dir_tok, rawid)) for rawid in rawids])
+	# add new papers to the packed corpus, if one has been built
+	if corpus_exists(args.corpus):
+		stale = append_to_corpus(args, rawids)
+		rawids = [rawid for rawid in rawids if rawid not in stale]
+	mark(manifest, rawids, versions, "tokenized")
+	save_manifest(manifest, args.manifest)
+	print("Tokenized %i new or updated abstracts." % len(rawids))
+	# encode them and append their hidden states to the state file
+	rawids = pending(manifest, versions, "encoded")
+	if len(rawids) > 0:
+		states = encode_abstracts(rawids, args.abs_dir_tok, args.embeddings, args.max_embed, args.max_length)
+		append_states(args.hidden_states, states, rawids)
+	mark(manifest, rawids, versions, "encoded")
+	save_manifest(manifest, args.manifest)
+	print("Encoded %i new or updated abstracts." % len(rawids))
+	# add the new hidden states to the nearest neighbor index, if one has been built
+	rawids = pending(manifest, versions, "indexed")
+	if len(rawids) > 0 and os.path.exists(args.index_file):
+		all_ids, states = read_states(args.hidden_states)
+		positions = {rawid: i for i, rawid in enumerate(all_ids)}
+		rows = np.array([positions[rawid] for rawid in rawids], dtype=np.int64)
+		index = IVFIndex.load(args.index_file)
+		index.add(states[rows], rows)
+		index.save(args.index_file)
+	mark(manifest, rawids, versions, "indexed")
+	save_manifest(manifest, args.manifest)
+	print("Indexed %i new or updated abstracts." % len(rawids))
+
+if __name__ == "__main__":
+	start = time.time()
+	parser = argparse.ArgumentParser()
+	parser.add_argument("--db-name", type=str, default=DB_PATH, help="Path to the paper metadata store.")
+	parser.add_argument("--manifest", type=str, default="manifest.json", help="Manifest of the stages each paper has been through.")
+	parser.add_argument("--init", action="store_true", default=False, help="Mark papers that already have hidden states as processed.")
+	parser.add_argument("--abs-dir", type=str, default="data/abstracts/", help="Directory to store extracted abstracts in.")
+	parser.add_argument("--abs-dir-tok", type=str, default="data/abstracts_tokenized", help="Directory that stores tokenized abstracts.")
+	parser.add_argument("--corpus", type=str, default="data/corpus", help="Path prefix of the packed corpus files.")
+	parser.add_argument("--embeddings", type=str, default="glove/embeddings.txt", help="Path to pre-trained word embeddings.")
+	parser.add_argument("--max-embed", type=int, default=209126, help="Maximum number of embeddings to load.")
+	parser.add_argument("--max-length", type=int, default=300, help="Maximum abstract length.")
+	parser.add_argument("--lda-assignments", type=str, default="lda_assignments", help="LDA labels of the packed corpus, extended for new papers.")
+	parser.add_argument("--lda-model", type=str, default="data/lda.model", help="Saved LDA model used to label new papers.")
+	parser.add_argument("--dictionary", type=str, default="data/corpus.dict", help="Serialized gensim dictionary of the LDA model.")
+	parser.add_argument("--hidden-states", type=str, default="hidden_states", help="File that stores the hidden states output by rnn.py.")
+	parser.add_argument("--index-file", type=str, default="knn_index.npz", help="Approximate nearest neighbor index built by knn.py --build-index.")
+	args = parser.parse_args()
+
+	db = MetadataStore(args.db_name)
+	manifest = load_manifest(args.manifest)
+	if args.init:
+		init_manifest(manifest, db.versions(), args.hidden_states)
+		save_manifest(manifest, args.manifest)
+	update(db, manifest, args)
+	print("Total time taken: %.2f" % (time.time()-start))
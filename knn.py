@@ -2,80 +2,175 @@
 # produced by rnn.py. 
 
 from sklearn.neighbors import NearestNeighbors
-from data_utils import load_abstracts
+from data_utils import read_states_header, read_states
+from knn_index import IVFIndex, exact_search
+from metadata import MetadataStore, DB_PATH
+from corpus import load_paper_ids
+import metrics
 import argparse
+import os
+import sys
 import numpy as np
 import time
-import pickle
 
 def load_states(states_file, num_rows):
 	"""
-	Loads and returns hidden states for all abstracts, when num_rows is set to None.
+	Loads and returns hidden states for all abstracts, when num_rows is set to None,
+	along with the paper IDs of their rows. Binary state files written by rnn.py are
+	memory-mapped; legacy text files are parsed and come without paper IDs.
 	"""
 	start = time.time()
 	print("Loading hidden states...")
-	out = np.genfromtxt(states_file, max_rows=num_rows)
+	if read_states_header(states_file) is not None:
+		ids, out = read_states(states_file)
+		ids, out = ids[:num_rows], out[:num_rows]
+	else:
+		ids = None
+		out = np.genfromtxt(states_file, max_rows=num_rows)
 	print("Finished loading hidden states. Time taken: %.2f seconds." % (time.time()-start))
-	return out
+	return(out, ids)
+
+def build_code_map(codes):
+	"""
+	Returns a dictionary from each arXiv code to its index in the list of all arXiv codes.
+	"""
+	return {code: i for i, code in enumerate(codes)}
 
-def get_index(query_code, codes):
+def get_index(query_code, code_map):
 	"""
 	Takes in the arXiv code of the query paper and returns its index in the list of all
-	arXiv codes.
+	arXiv codes, using the dictionary returned by build_code_map().
 	"""
-	return codes.index(query_code)
+	return code_map[query_code]
 
-def nearest_neighbors(state_vectors, query, exclude_query=True, K=10):
+def nearest_neighbors(state_vectors, query, exclude_query=True, K=10, index=None, nprobe=None):
 	"""
 	Finds the indices of the k-nearest neighbors for an abstract whose state 
 	vector is indexed by the argument @query. The parameter @exclude_query excludes
 	the query abstract from the list of K neighbors, causing the function to return K+1
-	neighbors instead.
+	neighbors instead. If an approximate @index built by build_index() is given, it is
+	searched with @nprobe lists instead of fitting an exact search on @state_vectors.
 	"""
 	if exclude_query: K += 1
-	knn = NearestNeighbors(n_neighbors=K, metric="euclidean")
-	knn.fit(state_vectors)
 	# if @query is an index for some in-corpus abstract
 	if exclude_query:
-		neighbors_index = knn.kneighbors(state_vectors[query:(query+1),:], return_distance=False)
-		return query, neighbors_index
+		query_vector = state_vectors[query:(query+1),:]
 	# if @query is a vector for the out-of-corpus test abstract
 	else:
-		neighbors_index = knn.kneighbors(np.reshape(query, newshape=(1, -1)), return_distance=False)
+		query_vector = np.reshape(query, newshape=(1, -1))
+	with metrics.timer("knn_query_seconds"):
+		if index is not None:
+			_, neighbors_index = index.search(query_vector, K, nprobe)
+		else:
+			knn = NearestNeighbors(n_neighbors=K, metric="euclidean")
+			knn.fit(state_vectors)
+			neighbors_index = knn.kneighbors(query_vector, return_distance=False)
+	if exclude_query:
+		return query, neighbors_index
+	else:
 		return neighbors_index
-	
+
+def batch_nearest_neighbors(state_vectors, queries, exclude_query=True, K=10, index=None, nprobe=None):
+	"""
+	Finds the k-nearest neighbors for a whole batch of queries at once. If @exclude_query
+	is True, @queries is an array of indices of in-corpus abstracts, which are excluded
+	from their own neighbors; otherwise it is a matrix of out-of-corpus state vectors.
+	Searches the approximate @index if given, and otherwise runs a blocked exact search.
+	Returns a (num_queries, K) matrix of neighbor indices, with -1 for missing neighbors.
+	"""
+	start = time.time()
+	if exclude_query:
+		queries = np.asarray(queries, dtype=np.int64)
+		query_vectors = state_vectors[queries]
+	else:
+		query_vectors = np.atleast_2d(queries)
+	if index is None:
+		_, found = exact_search(state_vectors, query_vectors, K, exclude=queries if exclude_query else None)
+		# exact_search() returns fewer than @K columns when there are not enough abstracts
+		neighbors = np.full((query_vectors.shape[0], K), -1, dtype=np.int64)
+		neighbors[:, :found.shape[1]] = found
+		metrics.throughput("knn_queries", query_vectors.shape[0], time.time()-start)
+		return neighbors
+	# ask for one extra neighbor, then drop each query from its own results
+	_, candidates = index.search(query_vectors, K + exclude_query, nprobe)
+	neighbors = np.full((query_vectors.shape[0], K), -1, dtype=np.int64)
+	for q, row in enumerate(candidates):
+		row = row[row >= 0]
+		if exclude_query: row = row[row != queries[q]]
+		neighbors[q, :min(K, row.size)] = row[:K]
+	metrics.throughput("knn_queries", query_vectors.shape[0], time.time()-start)
+	return neighbors
+
+def load_queries(query_file, code_map):
+	"""
+	Reads a file with one arXiv code per line and returns the codes found in the corpus
+	along with their indices. Unknown codes are reported and skipped.
+	"""
+	codes = []
+	with open(query_file) as f:
+		for line in f:
+			code = line.strip()
+			if not code: continue
+			if code in code_map:
+				codes.append(code)
+			else:
+				print("Skipping unknown arXiv code %s" % code)
+	return(codes, np.array([get_index(code, code_map) for code in codes], dtype=np.int64))
+
+def save_neighbors(output_file, query_names, neighbors, fnames):
+	"""
+	Writes one line per query: the query name followed by the arXiv codes of its neighbors.
+	"""
+	with open(output_file, "w") as f:
+		for name, row in zip(query_names, neighbors):
+			f.write("%s %s\n" % (name, " ".join(fnames[n] for n in row if n >= 0)))
+	print("Wrote nearest neighbors for %i queries to %s." % (len(query_names), output_file))
+
+def build_index(state_vectors, index_file, nlist=None, nprobe=8):
+	"""
+	Builds the approximate nearest neighbor index over all hidden states and saves
+	it to @index_file, so that later queries do not need to refit on every call.
+	"""
+	index = IVFIndex.build(state_vectors, nlist=nlist, nprobe=nprobe)
+	index.save(index_file)
+	print("Saved nearest neighbor index to %s." % index_file)
+	return index
+
 def get_titles(db_file, fnames, query, neighbors, exclude_query=True):
 	"""
-	Obtains titles and abstracts of nearest neighbors from the database pickle.
-	@fnames are the keys required to index the dictionary stored in the database pickle.
+	Obtains titles of the query and nearest neighbors from the metadata store.
+	@fnames are the arXiv IDs required to look the papers up in the store.
 	"""
-	db = pickle.load(open(db_file, "rb"))
-	# if @query is an index for some in-corpus abstract
+	# drop the -1 padding an IVF index returns when its probed lists hold fewer than K
+	# papers, and if @query is an index for some in-corpus abstract, drop it from its own neighbors
+	if exclude_query:
+		neighbors = [neighbor for neighbor in neighbors[0] if neighbor != query and neighbor >= 0][:len(neighbors[0])-1]
+	else:
+		neighbors = [neighbor for neighbor in neighbors[0] if neighbor >= 0]
+	# read only the titles of the papers to print
+	titles = MetadataStore(db_file).titles([fnames[i] for i in neighbors] + ([fnames[query]] if exclude_query else []))
 	if exclude_query: 
 		# obtain paper title for the abstract indexed by @query
-		query_info = db[fnames[query]]
-		query_title = query_info["title"]
-		neighbors = neighbors[0][1:]
+		query_title = titles[fnames[query]]
 		print("======================================================================================")
 		print("Getting nearest neighbors for paper titled: \n%s (%s)" % (" ".join(query_title.split()), fnames[query]))
 		print("--------------------------------------------------------------------------------------")
 	# if @query is a vector for the out-of-corpus test abstract
 	else:
-		neighbors = neighbors[0]
 		print("======================================================================================")
 		print("Getting nearest neighbors for paper with abstract: \n%s" % (" ".join(query.split())))
 		print("--------------------------------------------------------------------------------------")
 	# print out neighbors
 	for i, neighbor in enumerate(neighbors):
-		neighbor_info = db[fnames[neighbor]]
-		neighbor_title = neighbor_info["title"]
+		neighbor_title = titles[fnames[neighbor]]
 		print("Closest neighbor no. %i:\n\t %s (%s)" % (i+1, " ".join(neighbor_title.split()), fnames[neighbor]))
 
 if __name__ == "__main__":
 	parser = argparse.ArgumentParser()
-	parser.add_argument("--db-name", type=str, default="db.p", help="Path to and name of database pickle.")
+	parser.add_argument("--db-name", type=str, default=DB_PATH, help="Path to the paper metadata store.")
 	parser.add_argument("--abs-dir-tok", type=str, default="data/abstracts_tokenized", help="Directory that stores tokenized abstracts.")
-	parser.add_argument("--hidden-states", type=str, default="hidden_states", help="Text file that stores the hidden states output by rnn.py.")
+	parser.add_argument("--corpus", type=str, default="data/corpus", help="Path prefix of the packed corpus files.")
+	parser.add_argument("--hidden-states", type=str, default="hidden_states", help="File that stores the hidden states output by rnn.py.")
 	parser.add_argument("--num-neighbors", type=int, default=10, help="Number of nearest neighbors to find.")
 	parser.add_argument("--query-index", type=int, default=None, help="Index of abstract whose nearest neighbors we want to obtain.")
 	parser.add_argument("--query-code", type=str, default=None, help="Code of paper whose nearest neighbors we want to obtain.")
@@ -83,32 +178,79 @@ if __name__ == "__main__":
 	parser.add_argument("--hidden-test", type=str, default="hidden_states_test", help="Hidden states for the test abstract(s)")
 	parser.add_argument("--test-dir", type=str, default="data/test/", help="File path to test abstract")
 	parser.add_argument("--test-abstract", type=str, default=None, help="File name of test abstract")
+	parser.add_argument("--metrics-file", type=str, default=None, help="File to export metrics to (disabled if not given).")
+	parser.add_argument("--metrics-format", type=str, default="jsonl", choices=["jsonl", "prometheus"], help="Format of the metrics file.")
+	parser.add_argument("--encode", action="store_true", default=False, help="Encode the test abstract in-process instead of reading --hidden-test.")
+	parser.add_argument("--embeddings", type=str, default="glove/embeddings.txt", help="Path to pre-trained word embeddings.")
+	parser.add_argument("--max-embed", type=int, default=209126, help="Maximum number of embeddings to load.")
+	parser.add_argument("--max-length", type=int, default=300, help="Maximum abstract length.")
+	parser.add_argument("--index-file", type=str, default="knn_index.npz", help="Approximate nearest neighbor index built by --build-index.")
+	parser.add_argument("--build-index", action="store_true", default=False, help="Build the approximate nearest neighbor index and exit.")
+	parser.add_argument("--nlist", type=int, default=None, help="Number of index lists (defaults to the square root of the number of abstracts).")
+	parser.add_argument("--nprobe", type=int, default=None, help="Number of index lists scanned per query. Higher is slower but more accurate.")
+	parser.add_argument("--exact", action="store_true", default=False, help="Use exact search even if an index exists.")
+	parser.add_argument("--query-file", type=str, default=None, help="File with one arXiv code per line to find nearest neighbors for.")
+	parser.add_argument("--query-vectors", type=str, default=None, help="Hidden state file (written by rnn.py) of out-of-corpus query abstracts.")
+	parser.add_argument("--output", type=str, default="neighbors.txt", help="Output file for --query-file and --query-vectors.")
 	args = parser.parse_args()
+	metrics.configure(args.metrics_file, args.metrics_format)
 
-	# load hidden states for all abstracts
-	states = load_states(args.hidden_states, num_rows=None)
-	# get file names for abstracts
-	fnames , _ = load_abstracts(args.abs_dir_tok)
+	# load hidden states for all abstracts, with the paper ID of each row
+	states, fnames = load_states(args.hidden_states, num_rows=None)
+	if args.build_index:
+		build_index(states, args.index_file, nlist=args.nlist, nprobe=args.nprobe or 8)
+		sys.exit()
+	# load the approximate index unless exact search is requested
+	index = None
+	if not args.exact and os.path.exists(args.index_file):
+		index = IVFIndex.load(args.index_file, nprobe=args.nprobe)
+	# get file names for abstracts if the states file does not record them
+	if fnames is None:
+		fnames = load_paper_ids(args.corpus, args.abs_dir_tok)
+	code_map = build_code_map(fnames)
 
 	# if a querying by index in corpus
 	if args.query_index is not None:
-		query, neighbors = nearest_neighbors(states, args.query_index, K=args.num_neighbors)
+		query, neighbors = nearest_neighbors(states, args.query_index, K=args.num_neighbors, index=index)
 		get_titles(args.db_name, fnames, query, neighbors)
 
 	# if querying by arXiv paper code
 	elif args.query_code is not None:
-		query_index = get_index(args.query_code, fnames)
-		query, neighbors = nearest_neighbors(states, query_index, K=args.num_neighbors)
+		query_index = get_index(args.query_code, code_map)
+		query, neighbors = nearest_neighbors(states, query_index, K=args.num_neighbors, index=index)
 		get_titles(args.db_name, fnames, query, neighbors)
 	
+	# if querying a batch of arXiv paper codes
+	elif args.query_file is not None:
+		codes, query_indices = load_queries(args.query_file, code_map)
+		neighbors = batch_nearest_neighbors(states, query_indices, K=args.num_neighbors, index=index)
+		save_neighbors(args.output, codes, neighbors, fnames)
+
+	# if querying a batch of out-of-corpus state vectors
+	elif args.query_vectors is not None:
+		query_vectors, query_names = load_states(args.query_vectors, num_rows=None)
+		if query_names is None: query_names = [str(i) for i in range(query_vectors.shape[0])]
+		neighbors = batch_nearest_neighbors(states, query_vectors, exclude_query=False, K=args.num_neighbors, index=index)
+		save_neighbors(args.output, query_names, neighbors, fnames)
+
 	# if querying a test abstract
 	elif args.test:
-		test_vector = np.genfromtxt("hidden_states_test")
 		assert args.test_abstract is not None, "Please enter file name of test abstract"
-		with open(args.test_dir + args.test_abstract, "r") as f:
+		with open(os.path.join(args.test_dir, args.test_abstract), "r") as f:
 			abstract = f.read()
-		neighbors = nearest_neighbors(states, test_vector, exclude_query=False, K=args.num_neighbors)
+		if args.encode:
+			# imported here so that the other modes do not need TensorFlow
+			from encoder import Encoder
+			encoder = Encoder(args.embeddings, args.max_embed, args.max_length)
+			test_vector = encoder.encode([abstract])[0]
+			encoder.close()
+		else:
+			test_vectors, test_names = load_states(args.hidden_test, num_rows=None)
+			# legacy text files hold a single test abstract
+			test_vector = test_vectors[test_names.index(args.test_abstract) if test_names is not None else 0]
+		neighbors = nearest_neighbors(states, test_vector, exclude_query=False, K=args.num_neighbors, index=index)
 		get_titles(args.db_name, fnames, abstract, neighbors, exclude_query=False)
 	
 	else:
 		raise ValueError("Please enter either a query index or query code.")
+	metrics.flush()
@@ -0,0 +1,193 @@
+# Approximate nearest neighbor index over the hidden state vectors produced by
+# rnn.py. Built once with knn.py --build-index and loaded by every later query.
+
+import numpy as np
+import time
+
+class IVFIndex(object):
+	"""
+	Inverted file (IVF) index for euclidean nearest neighbor search. The state vectors
+	are clustered around @nlist k-means centroids and stored contiguously per cluster,
+	and a query only scans the @nprobe clusters whose centroids are closest to it.
+	Raising @nprobe trades speed for recall; setting it to @nlist scans every vector.
+	"""
+	def __init__(self, centroids, offsets, ids, vectors, nprobe=8):
+		"""
+		@offsets[c]:@offsets[c+1] is the slice of @ids and @vectors that belongs to
+		cluster c, and @ids holds the row of each vector in the original state matrix.
+		"""
+		self.centroids = centroids
+		self.offsets = offsets
+		self.ids = ids
+		self.vectors = vectors
+		self.nprobe = nprobe
+		self.centroid_norms = np.sum(centroids**2, axis=1)
+		self.vector_norms = np.sum(vectors**2, axis=1)
+
+	@property
+	def nlist(self):
+		return self.centroids.shape[0]
+
+	def __len__(self):
+		return self.ids.shape[0]
+
+	@classmethod
+	def build(cls, state_vectors, nlist=None, num_iter=20, nprobe=8, seed=0):
+		"""
+		Clusters @state_vectors with k-means and returns the resulting index. By default
+		uses about sqrt(n) clusters, and fits the centroids on a sample of at most 256
+		vectors per cluster.
+		"""
+		start = time.time()
+		print("Building nearest neighbor index...")
+		state_vectors = np.asarray(state_vectors)
+		num_vectors = state_vectors.shape[0]
+		if nlist is None: nlist = max(1, int(np.sqrt(num_vectors)))
+		nlist = min(nlist, num_vectors)
+		rng = np.random.RandomState(seed)
+		# fit centroids on a random sample of the state vectors
+		sample_size = min(num_vectors, 256*nlist)
+		sample = state_vectors[np.sort(rng.choice(num_vectors, sample_size, replace=False))]
+		centroids = sample[rng.choice(sample_size, nlist, replace=False)].copy()
+		for _ in range(num_iter):
+			assignment = assign_clusters(sample, centroids)
+			counts = np.bincount(assignment, minlength=nlist)
+			sums = np.zeros_like(centroids)
+			np.add.at(sums, assignment, sample)
+			nonempty = counts > 0
+			centroids[nonempty] = sums[nonempty] / counts[nonempty, None]
+			# re-seed empty clusters with random sample points
+			num_empty = np.sum(~nonempty)
+			if num_empty > 0:
+				centroids[~nonempty] = sample[rng.choice(sample_size, num_empty, replace=False)]
+		# assign every vector to its closest centroid and group vectors by cluster
+		assignment = assign_clusters(state_vectors, centroids)
+		ids = np.argsort(assignment, kind="stable")
+		offsets = np.concatenate([[0], np.cumsum(np.bincount(assignment, minlength=nlist))])
+		index = cls(centroids, offsets, ids, state_vectors[ids], nprobe)
+		print("Finished building index with %i lists. Time taken: %.2f seconds." % (nlist, time.time()-start))
+		return index
+
+	def search(self, queries, K, nprobe=None):
+		"""
+		Returns the squared euclidean distances and the state matrix rows of the (at most)
+		@K nearest neighbors of each row of @queries, sorted from closest to furthest.
+		"""
+		queries = np.atleast_2d(queries)
+		nprobe = min(nprobe or self.nprobe, self.nlist)
+		# find the @nprobe closest lists for every query at once
+		coarse = self.centroid_norms[None, :] - 2*np.dot(queries, self.centroids.T)
+		probes = np.argpartition(coarse, nprobe-1, axis=1)[:, :nprobe]
+		distances = np.full((queries.shape[0], K), np.inf)
+		neighbors = np.full((queries.shape[0], K), -1, dtype=np.int64)
+		for q, query in enumerate(queries):
+			# gather the candidate slices of the probed lists
+			candidates = np.concatenate([np.arange(self.offsets[c], self.offsets[c+1]) for c in probes[q]])
+			if candidates.size == 0: continue
+			dist = self.vector_norms[candidates] - 2*np.dot(self.vectors[candidates], query) + np.dot(query, query)
+			k = min(K, candidates.size)
+			top = np.argpartition(dist, k-1)[:k]
+			top = top[np.argsort(dist[top])]
+			distances[q, :k] = dist[top]
+			neighbors[q, :k] = self.ids[candidates[top]]
+		return(distances, neighbors)
+
+	def add(self, vectors, rows):
+		"""
+		Adds @vectors to the index under the state matrix @rows, replacing any entries
+		already stored for those rows. The centroids are kept fixed, so this costs one
+		pass over the stored vectors instead of re-clustering.
+		"""
+		vectors = np.atleast_2d(vectors)
+		rows = np.asarray(rows, dtype=np.int64)
+		# list number of every stored entry, without the entries being replaced
+		lists = np.repeat(np.arange(self.nlist), np.diff(self.offsets))
+		keep = ~np.isin(self.ids, rows)
+		lists = np.concatenate([lists[keep], assign_clusters(vectors, self.centroids)])
+		ids = np.concatenate([self.ids[keep], rows])
+		all_vectors = np.concatenate([self.vectors[keep], vectors.astype(self.vectors.dtype)])
+		order = np.argsort(lists, kind="stable")
+		self.offsets = np.concatenate([[0], np.cumsum(np.bincount(lists, minlength=self.nlist))])
+		self.ids = ids[order]
+		self.vectors = all_vectors[order]
+		self.vector_norms = np.sum(self.vectors**2, axis=1)
+
+	def save(self, fpath):
+		"""
+		Writes the index to an uncompressed .npz file.
+		"""
+		np.savez(fpath, centroids=self.centroids, offsets=self.offsets, ids=self.ids,
+				 vectors=self.vectors, nprobe=self.nprobe)
+
+	@classmethod
+	def load(cls, fpath, nprobe=None):
+		"""
+		Loads an index written by save(). @nprobe overrides the stored default.
+		"""
+		start = time.time()
+		data = np.load(fpath)
+		index = cls(data["centroids"], data["offsets"], data["ids"], data["vectors"],
+					nprobe or int(data["nprobe"]))
+		print("Loaded nearest neighbor index. Time taken: %.2f seconds." % (time.time()-start))
+		return index
+
+def assign_clusters(vectors, centroids, block_size=4096):
+	"""
+	Returns the index of the closest centroid for each row of @vectors, processing
+	@block_size rows at a time to bound memory.
+	"""
+	centroid_norms = np.sum(centroids**2, axis=1)
+	assignment = np.empty(vectors.shape[0], dtype=np.int64)
+	for start in range(0, vectors.shape[0], block_size):
+		block = vectors[start:(start+block_size)]
+		assignment[start:(start+block_size)] = np.argmin(centroid_norms[None, :] - 2*np.dot(block, centroids.T), axis=1)
+	return assignment
+
+class ExactIndex(object):
+	"""
+	Exact euclidean nearest neighbor search with the same interface as IVFIndex. Row
+	norms are computed once at construction and reused for every query.
+	"""
+	def __init__(self, state_vectors):
+		self.state_vectors = state_vectors
+		self.vector_norms = np.sum(np.square(state_vectors), axis=1)
+
+	def __len__(self):
+		return self.state_vectors.shape[0]
+
+	def search(self, queries, K, nprobe=None, exclude=None):
+		"""
+		Returns the squared euclidean distances and the state matrix rows of the @K
+		nearest neighbors of each row of @queries. @nprobe is ignored.
+		"""
+		return exact_search(self.state_vectors, queries, K, exclude=exclude, vector_norms=self.vector_norms)
+
+def exact_search(state_vectors, queries, K, exclude=None, vector_norms=None, max_block_bytes=2**28):
+	"""
+	Finds the @K nearest neighbors of every row of @queries among @state_vectors at once.
+	Distances are computed for a block of queries with one matrix product, and the top
+	@K per row are selected with argpartition. Blocks are sized so that the distance
+	matrix stays below @max_block_bytes. If given, @exclude holds one state matrix row per
+	query that is left out of its results (the query abstract itself).
+	Returns the squared distances and neighbor rows, sorted from closest to furthest.
+	"""
+	queries = np.atleast_2d(queries)
+	num_vectors = state_vectors.shape[0]
+	if vector_norms is None: vector_norms = np.sum(np.square(state_vectors), axis=1)
+	K = min(K, num_vectors - (exclude is not None))
+	block_size = max(1, max_block_bytes // (8*num_vectors))
+	distances = np.empty((queries.shape[0], K))
+	neighbors = np.empty((queries.shape[0], K), dtype=np.int64)
+	for start in range(0, queries.shape[0], block_size):
+		block = queries[start:(start+block_size)]
+		rows = np.arange(block.shape[0])
+		dist = vector_norms[None, :] - 2*np.dot(block, state_vectors.T) + np.sum(np.square(block), axis=1)[:, None]
+		if exclude is not None:
+			dist[rows, exclude[start:(start+block_size)]] = np.inf
+		# select the top @K of each row, then sort only those
+		top = np.argpartition(dist, K-1, axis=1)[:, :K]
+		top_dist = dist[rows[:, None], top]
+		order = np.argsort(top_dist, axis=1)
+		distances[start:(start+block_size)] = np.maximum(top_dist[rows[:, None], order], 0)
+		neighbors[start:(start+block_size)] = top[rows[:, None], order]
+	return(distances, neighbors)
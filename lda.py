@@ -1,30 +1,32 @@
 # Perform LDA on the abstracts of the downloaded papers to obtain weak
 # supervision signal for the RNN.
 
-import pickle
-import string
 from pprint import pprint
-from nltk.corpus import stopwords
 from gensim import corpora
-from gensim.models.ldamodel import LdaModel
+from gensim.utils import grouper
+from gensim.models.ldamulticore import LdaMulticore
 from data_utils import *
+from tokenizer import tokenize_dir
+from metadata import MetadataStore, DB_PATH
+from corpus import PackedCorpus, build_corpus, corpus_exists, read_stale_ids
+from corpus_stats import get_stop_list
 
 def tokenize_abstracts(db, abs_dir, abs_dir_tok):
 	"""
-	Takes in the database pickle and returns a list of tokenized abstracts, along with
+	Takes in the metadata store and returns a list of tokenized abstracts, along with
 	the list of corresponding file (academic paper) names.
 	"""
 	# first, save each abstract as a text file in the specified directory
 	if not os.path.exists(abs_dir):
 		os.makedirs(abs_dir)
-		for key, value in db.items():
+		for key, summary in db.summaries():
 			with open(abs_dir + key, "w+") as f:
-				f.write(value["summary"])
-	# next, run an external shell script to tokenize all abstracts, if not already done
+				f.write(summary)
+	# next, tokenize all abstracts across a pool of worker processes, if not already done
 	if not os.path.exists(abs_dir_tok):
 		start = time.time()
-		print("Running abstracts.sh ... (this will take a while)")
-		os.system("./abstracts.sh")
+		print("Tokenizing abstracts...")
+		tokenize_dir(abs_dir, abs_dir_tok)
 		print("Created tokenized abstracts in %s. Time taken: %.2f seconds."%(abs_dir_tok, time.time()-start))
 
 def create_corpus(tokenized_abstracts):
@@ -34,8 +36,7 @@ def create_corpus(tokenized_abstracts):
 	start = time.time()
 	print("Creating corpus...")
 	# remove stop words and digits from abstracts
-	custom_stopWords = ["-rrb-", "-lrb-", "-rcb-", "-lcb-", ""]
-	stopList = stopwords.words("english") + list(string.punctuation) + custom_stopWords
+	stopList = set(get_stop_list())
 	abstracts = [[token for token in abstract.split(" ") if token not in stopList and not token.isdigit()] 
 				  for abstract in tokenized_abstracts]
 	# convert to bag of words representation
@@ -45,46 +46,137 @@ def create_corpus(tokenized_abstracts):
 	print("Finished creating corpus. Time taken: %.2f"%(time.time()-start))
 	return(corpus, dictionary)
 
-def LDA(corpus, dictionary, numTopics):
+def filtered_abstracts(packed):
 	"""
-	Performs LDA on a list of abstracts represented as a gensim corpus. 
-	Returns both the fitted topics and the assigned topic for each abstract
+	Iterates over the abstracts of a PackedCorpus as lists of tokens, without stop words
+	and digits. These are filtered once per vocabulary entry, and then removed from each
+	abstract with a boolean mask over its token IDs.
 	"""
+	stopList = set(get_stop_list())
+	keep = np.array([token not in stopList and not token.isdigit() for token in packed.vocab], dtype=bool)
+	vocab = np.array(packed.vocab, dtype=object)
+	for document in packed:
+		yield vocab[document[keep[document]]].tolist()
+
+def create_corpus_packed(packed, corpus_file, dictionary_file):
+	"""
+	Creates a gensim corpus from a PackedCorpus of tokenized abstracts, streaming the
+	bag of words of each abstract into a Matrix Market file at @corpus_file instead of
+	holding them in memory. Returns the corpus, which streams from disk, and the
+	dictionary, which is also saved to @dictionary_file.
+	"""
+	start = time.time()
+	print("Creating corpus...")
+	# one pass to build the dictionary, and one to write the bag of words representation
+	dictionary = corpora.Dictionary(filtered_abstracts(packed))
+	dictionary.save(dictionary_file)
+	corpora.MmCorpus.serialize(corpus_file, (dictionary.doc2bow(abstract) for abstract in filtered_abstracts(packed)))
+	print("Finished creating corpus. Time taken: %.2f"%(time.time()-start))
+	return(corpora.MmCorpus(corpus_file), dictionary)
+
+def load_corpus(corpus_file, dictionary_file):
+	"""
+	Opens a corpus and dictionary written by create_corpus_packed().
+	"""
+	return(corpora.MmCorpus(corpus_file), corpora.Dictionary.load(dictionary_file))
+
+def LDA(corpus, dictionary, numTopics, workers=None, passes=1, chunksize=2000, model_file=None):
+	"""
+	Performs LDA on a list of abstracts represented as a gensim corpus, which may stream
+	from disk, with @workers worker processes. Saves the fitted model to @model_file if
+	given. Returns both the fitted topics and the assigned topic for each abstract
+	"""
+	start = time.time()
 	print("Fitting LDA model...")
-	lda = LdaModel(corpus, num_topics=numTopics, id2word=dictionary)
+	lda = LdaMulticore(corpus, num_topics=numTopics, id2word=dictionary, workers=workers, passes=passes, chunksize=chunksize)
+	self_rss, workers_rss = peak_rss()
+	print("Fitted LDA model. Time taken: %.2f seconds. Peak memory: %.0f MB (largest worker: %.0f MB)."
+		  % (time.time()-start, self_rss, workers_rss))
+	if model_file is not None:
+		lda.save(model_file)
 	# retrieve assigned topics for abstracts in corpus
-	lda_corpus = lda[corpus]
-	# iterate over each assignment and choose dominant topic 
-	assigned_topics = []
-	for assignment in lda_corpus:
-		# if assigned only one topic, retrieve that topic
-		if len(assignment) == 1:
-			assigned_topics.append(assignment.pop()[0])
-		# if assigned multiple topics, retrieve topic with highest probability
-		else:
-			main_topic = max(assignment, key=lambda item:item[1])
-			assigned_topics.append(main_topic[0])
+	assigned_topics = assign_topics(lda, corpus, chunksize)
 	return(lda.show_topics(num_topics=-1), assigned_topics)
 
+def assign_topics(lda, corpus, chunksize=2000):
+	"""
+	Returns the dominant topic of each abstract in @corpus as an array. Each chunk of
+	abstracts is inferred at once into a dense (abstracts, topics) matrix, and the
+	dominant topics are its row-wise argmax.
+	"""
+	assigned_topics = np.empty(len(corpus), dtype=np.int64)
+	start = 0
+	for chunk in grouper(corpus, chunksize):
+		# gamma is proportional to the topic distribution of each abstract
+		gamma, _ = lda.inference(chunk)
+		assigned_topics[start:(start+len(chunk))] = gamma.argmax(axis=1)
+		start += len(chunk)
+	return assigned_topics
+
+def label_abstracts(model_file, dictionary_file, abstracts, update=False, chunksize=2000):
+	"""
+	Assigns dominant topics to new tokenized @abstracts with the saved LDA model, without
+	refitting it, so that the topic numbering of existing labels stays valid. Words that
+	are not in the saved dictionary are ignored. If @update is set to True, the model is
+	first updated online with the new abstracts and saved again.
+	"""
+	lda = LdaMulticore.load(model_file)
+	dictionary = corpora.Dictionary.load(dictionary_file)
+	stopList = set(get_stop_list())
+	corpus = [dictionary.doc2bow([token for token in abstract.split(" ") if token not in stopList and not token.isdigit()])
+			  for abstract in abstracts]
+	if update:
+		lda.update(corpus, chunksize=chunksize)
+		lda.save(model_file)
+	return assign_topics(lda, corpus, chunksize)
+
 if __name__ == "__main__":
 	
 	# get command line arguments
 	parser = argparse.ArgumentParser()
-	parser.add_argument("--db-name", type=str, default="db.p", help="Path to and name of database pickle.")
+	parser.add_argument("--db-name", type=str, default=DB_PATH, help="Path to the paper metadata store.")
 	parser.add_argument("--abs-dir", type=str, default="data/abstracts/", help="Directory to store extracted abstracts in.")
 	parser.add_argument("--abs-dir-tok", type=str, default="data/abstracts_tokenized", help="Directory that stores tokenized abstracts.")
+	parser.add_argument("--corpus", type=str, default="data/corpus", help="Path prefix of the packed corpus files.")
 	parser.add_argument("--num-topics", type=int, default=20, help="Number of LDA topics.")
+	parser.add_argument("--workers", type=int, default=max(os.cpu_count()-1, 1), help="Number of LDA worker processes.")
+	parser.add_argument("--passes", type=int, default=1, help="Number of passes over the corpus.")
+	parser.add_argument("--chunksize", type=int, default=2000, help="Number of abstracts per LDA training chunk.")
+	parser.add_argument("--bow-corpus", type=str, default="data/corpus.mm", help="Serialized bag of words corpus.")
+	parser.add_argument("--dictionary", type=str, default="data/corpus.dict", help="Serialized gensim dictionary.")
+	parser.add_argument("--lda-model", type=str, default="data/lda.model", help="File to save the fitted LDA model to.")
+	parser.add_argument("--label-dir", type=str, default=None, help="Label the tokenized abstracts in this directory with the saved model.")
+	parser.add_argument("--label-output", type=str, default="lda_assignments_new", help="File to write the labels of --label-dir to.")
+	parser.add_argument("--update", action="store_true", default=False, help="Update the saved model with the abstracts in --label-dir.")
 	args = parser.parse_args()
+
+	# label new abstracts with the saved model instead of fitting a new one
+	if args.label_dir is not None:
+		fnames, abstracts = load_abstracts(args.label_dir)
+		assignments = label_abstracts(args.lda_model, args.dictionary, abstracts, args.update, args.chunksize)
+		with open(args.label_output, "w+") as f:
+			for fname, assignment in zip(fnames, assignments):
+				f.write("%s %i\n" % (fname, assignment))
+		print("Finished writing labels of %i abstracts to %s." % (len(fnames), args.label_output))
+		sys.exit()
 	
-	# load existing database into memory and tokenize abstracts
-	db = pickle.load(open(args.db_name, "rb"))
+	# open the metadata store and tokenize abstracts
+	db = MetadataStore(args.db_name)
 	tokenize_abstracts(db, args.abs_dir, args.abs_dir_tok)
-	# obtain list of tokenized abstracts along with filenames
-	fnames, abstracts = load_abstracts(args.abs_dir_tok)
-	# create gensim corpus for LDA modelling
-	corpus, bow = create_corpus(abstracts)
+	# pack the tokenized abstracts once, then read them from the packed corpus
+	if not corpus_exists(args.corpus):
+		build_corpus(args.abs_dir_tok, args.corpus)
+	stale = read_stale_ids(args.corpus)
+	if len(stale) > 0:
+		print("Warning: %i abstracts in %s are out of date. Rebuild the corpus with corpus.py first." % (len(stale), args.corpus))
+	# create gensim corpus for LDA modelling, unless it is up to date with the packed corpus
+	if os.path.exists(args.bow_corpus) and os.path.exists(args.dictionary) and \
+			os.path.getmtime(args.bow_corpus) >= os.path.getmtime(args.corpus + ".offsets"):
+		corpus, bow = load_corpus(args.bow_corpus, args.dictionary)
+	else:
+		corpus, bow = create_corpus_packed(PackedCorpus(args.corpus), args.bow_corpus, args.dictionary)
 	# obtain fitted topics and assigned topic for each abstract
-	topics, assignments = LDA(corpus, bow, args.num_topics)
+	topics, assignments = LDA(corpus, bow, args.num_topics, args.workers, args.passes, args.chunksize, args.lda_model)
 	pprint(topics)
 	# write to text files
 	with open("lda_topics", "w+") as f:
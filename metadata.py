@@ -0,0 +1,122 @@
+# Indexed on-disk store for the paper metadata returned by the arXiv API, keyed by arXiv ID.
+# Replaces the db.p pickle, which had to be loaded and rewritten in full by every script.
+
+import argparse
+import json
+import pickle
+import sqlite3
+import time
+
+# default location of the metadata store
+DB_PATH = "db.sqlite"
+# SQLite limits the number of parameters in one statement
+MAX_PARAMS = 900
+
+class MetadataStore(object):
+	"""
+	SQLite-backed dictionary from arXiv ID to the metadata entry of a paper. Supports
+	random-access reads, batch upserts and streaming iteration. The version, title and
+	summary of each paper are also stored in their own columns, so they can be read
+	without decoding the full entry.
+	"""
+	def __init__(self, fpath=DB_PATH):
+		self.fpath = fpath
+		self.conn = sqlite3.connect(fpath, check_same_thread=False)
+		self.conn.execute("PRAGMA journal_mode=WAL")
+		self.conn.execute("""CREATE TABLE IF NOT EXISTS papers (rawid TEXT PRIMARY KEY, version INTEGER,
+							 title TEXT, summary TEXT, entry TEXT)""")
+		self.conn.commit()
+
+	def __len__(self):
+		return self.conn.execute("SELECT COUNT(*) FROM papers").fetchone()[0]
+
+	def __contains__(self, rawid):
+		return self.conn.execute("SELECT 1 FROM papers WHERE rawid = ?", (rawid,)).fetchone() is not None
+
+	def __getitem__(self, rawid):
+		entry = self.get(rawid)
+		if entry is None: raise KeyError(rawid)
+		return entry
+
+	def get(self, rawid, default=None):
+		"""
+		Returns the metadata entry of one paper, or @default if it is not stored.
+		"""
+		row = self.conn.execute("SELECT entry FROM papers WHERE rawid = ?", (rawid,)).fetchone()
+		return default if row is None else json.loads(row[0])
+
+	def get_many(self, rawids):
+		"""
+		Returns a dictionary with the metadata entries of the stored papers among @rawids.
+		"""
+		return {rawid: json.loads(entry) for rawid, entry in self._select("entry", rawids)}
+
+	def titles(self, rawids):
+		"""
+		Returns a dictionary with the titles of the stored papers among @rawids.
+		"""
+		return dict(self._select("title", rawids))
+
+	def summaries(self, rawids=None):
+		"""
+		Iterates over (arXiv ID, abstract) pairs, of all papers if @rawids is None.
+		"""
+		if rawids is None:
+			return self.conn.execute("SELECT rawid, summary FROM papers ORDER BY rawid")
+		return iter(self._select("summary", rawids))
+
+	def versions(self):
+		"""
+		Returns a dictionary from arXiv ID to the stored version of every paper.
+		"""
+		return dict(self.conn.execute("SELECT rawid, version FROM papers"))
+
+	def keys(self):
+		return [row[0] for row in self.conn.execute("SELECT rawid FROM papers ORDER BY rawid")]
+
+	def items(self):
+		"""
+		Streams (arXiv ID, entry) pairs for all papers without loading them all at once.
+		"""
+		for rawid, entry in self.conn.execute("SELECT rawid, entry FROM papers ORDER BY rawid"):
+			yield rawid, json.loads(entry)
+
+	def upsert_many(self, entries):
+		"""
+		Inserts or replaces the given metadata entries in a single transaction. Each entry
+		needs the '_rawid' and '_version' keys added by fetch_papers.py.
+		"""
+		with self.conn:
+			self.conn.executemany("INSERT OR REPLACE INTO papers VALUES (?, ?, ?, ?, ?)",
+								  ((e["_rawid"], e["_version"], e.get("title"), e.get("summary"), json.dumps(e)) for e in entries))
+
+	def close(self):
+		self.conn.close()
+
+	def _select(self, column, rawids):
+		"""
+		Returns (arXiv ID, @column) rows for @rawids, querying in chunks of MAX_PARAMS.
+		"""
+		rawids = list(rawids)
+		rows = []
+		for start in range(0, len(rawids), MAX_PARAMS):
+			chunk = rawids[start:(start+MAX_PARAMS)]
+			rows.extend(self.conn.execute("SELECT rawid, %s FROM papers WHERE rawid IN (%s)" % (column, ",".join("?"*len(chunk))), chunk))
+		return rows
+
+def import_pickle(pickle_file, store):
+	"""
+	Copies every entry of a db.p database pickle into @store.
+	"""
+	start = time.time()
+	db = pickle.load(open(pickle_file, "rb"))
+	store.upsert_many(db.values())
+	print("Imported %i papers from %s into %s. Time taken: %.2f seconds." % (len(db), pickle_file, store.fpath, time.time()-start))
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser()
+	parser.add_argument("--db-name", type=str, default=DB_PATH, help="Path to the paper metadata store.")
+	parser.add_argument("--import-pickle", type=str, default="db.p", help="Database pickle to import into the store.")
+	args = parser.parse_args()
+
+	import_pickle(args.import_pickle, MetadataStore(args.db_name))
@@ -0,0 +1,172 @@
+# Lightweight metrics for the hot paths of the pipeline: counters, gauges, and timers that
+# keep the count, sum and maximum of their observations, plus the resident set size of the
+# process. Metrics are exported as JSON lines (one snapshot per line) or as a Prometheus
+# text file. Until configure() is called every function returns immediately, so that
+# instrumented code pays almost nothing when metrics are disabled.
+
+import contextlib
+import json
+import os
+import resource
+import threading
+import time
+
+# prefix of the metric names in the Prometheus text format
+PROMETHEUS_PREFIX = "arxiv_"
+
+_registry = None
+
+class Registry(object):
+	"""
+	Holds the current value of every metric, and writes them to @fpath in format @fmt
+	('jsonl' or 'prometheus') at most every @flush_secs seconds when maybe_flush() is called.
+	"""
+	def __init__(self, fpath, fmt="jsonl", flush_secs=10):
+		assert fmt in ("jsonl", "prometheus"), "Unknown metrics format %s" % fmt
+		self.fpath = fpath
+		self.fmt = fmt
+		self.flush_secs = flush_secs
+		self.counters = {}
+		self.gauges = {}
+		# name -> [count, sum, max] of the observations
+		self.summaries = {}
+		self.lock = threading.Lock()
+		self.last_flush = time.time()
+
+	def snapshot(self):
+		"""
+		Returns a copy of all metrics as a dictionary.
+		"""
+		with self.lock:
+			return {"time": time.time(), "counters": dict(self.counters), "gauges": dict(self.gauges),
+					"summaries": {name: {"count": c, "sum": s, "max": m} for name, (c, s, m) in self.summaries.items()}}
+
+	def write(self):
+		"""
+		Appends a snapshot to the JSON lines file, or rewrites the Prometheus text file.
+		"""
+		snapshot = self.snapshot()
+		if self.fmt == "jsonl":
+			with open(self.fpath, "a") as f:
+				f.write(json.dumps(snapshot) + "\n")
+			return
+		lines = []
+		for name, value in sorted(snapshot["counters"].items()):
+			lines += ["# TYPE %s%s counter" % (PROMETHEUS_PREFIX, name), "%s%s %r" % (PROMETHEUS_PREFIX, name, float(value))]
+		for name, value in sorted(snapshot["gauges"].items()):
+			lines += ["# TYPE %s%s gauge" % (PROMETHEUS_PREFIX, name), "%s%s %r" % (PROMETHEUS_PREFIX, name, float(value))]
+		for name, summary in sorted(snapshot["summaries"].items()):
+			lines += ["# TYPE %s%s summary" % (PROMETHEUS_PREFIX, name),
+					  "%s%s_count %r" % (PROMETHEUS_PREFIX, name, float(summary["count"])),
+					  "%s%s_sum %r" % (PROMETHEUS_PREFIX, name, float(summary["sum"])),
+					  "# TYPE %s%s_max gauge" % (PROMETHEUS_PREFIX, name),
+					  "%s%s_max %r" % (PROMETHEUS_PREFIX, name, float(summary["max"]))]
+		# the file is scraped while it is being rewritten, so swap it in atomically
+		with open(self.fpath + ".tmp", "w") as f:
+			f.write("\n".join(lines) + "\n")
+		os.replace(self.fpath + ".tmp", self.fpath)
+
+def configure(fpath, fmt="jsonl", flush_secs=10):
+	"""
+	Enables metrics, exported to @fpath in format @fmt ('jsonl' or 'prometheus').
+	Does nothing if @fpath is None, so it can be called with an optional argument.
+	"""
+	global _registry
+	if fpath is not None:
+		_registry = Registry(fpath, fmt, flush_secs)
+
+def enabled():
+	return _registry is not None
+
+def count(name, value=1):
+	"""
+	Adds @value to counter @name.
+	"""
+	if _registry is None: return
+	with _registry.lock:
+		_registry.counters[name] = _registry.counters.get(name, 0) + value
+
+def gauge(name, value):
+	"""
+	Sets gauge @name to @value.
+	"""
+	if _registry is None: return
+	with _registry.lock:
+		_registry.gauges[name] = value
+
+def observe(name, value):
+	"""
+	Adds one observation @value (e.g. a latency in seconds) to summary @name.
+	"""
+	if _registry is None: return
+	with _registry.lock:
+		summary = _registry.summaries.get(name)
+		if summary is None:
+			_registry.summaries[name] = [1, value, value]
+		else:
+			summary[0] += 1
+			summary[1] += value
+			summary[2] = max(summary[2], value)
+
+def throughput(name, items, seconds):
+	"""
+	Records that @items items (e.g. abstracts or tokens) took @seconds: adds them to the
+	counter '<name>_total', observes the seconds into '<name>_seconds', and sets the gauge
+	'<name>_per_second'.
+	"""
+	if _registry is None: return
+	count(name + "_total", items)
+	observe(name + "_seconds", seconds)
+	gauge(name + "_per_second", items / max(seconds, 1e-9))
+
+class Timer(object):
+	"""
+	Context manager that observes the seconds spent in its body into summary @name.
+	"""
+	def __init__(self, name):
+		self.name = name
+
+	def __enter__(self):
+		self.start = time.time()
+		return self
+
+	def __exit__(self, *exc):
+		self.seconds = time.time() - self.start
+		observe(self.name, self.seconds)
+		return False
+
+_NULL_TIMER = contextlib.nullcontext()
+
+def timer(name):
+	"""
+	Returns a Timer for summary @name, or a shared no-op context when metrics are disabled.
+	"""
+	return _NULL_TIMER if _registry is None else Timer(name)
+
+def record_rss():
+	"""
+	Sets the current and peak resident set size gauges, in bytes.
+	"""
+	if _registry is None: return
+	# the current RSS is only available on Linux
+	if os.path.exists("/proc/self/statm"):
+		with open("/proc/self/statm") as f:
+			gauge("rss_bytes", int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE"))
+	# ru_maxrss is in kilobytes on Linux
+	gauge("rss_peak_bytes", resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024)
+
+def flush():
+	"""
+	Records the memory usage and exports all metrics.
+	"""
+	if _registry is None: return
+	record_rss()
+	_registry.write()
+	_registry.last_flush = time.time()
+
+def maybe_flush():
+	"""
+	Exports all metrics if the last export is older than the flush interval.
+	"""
+	if _registry is not None and time.time() - _registry.last_flush >= _registry.flush_secs:
+		flush()
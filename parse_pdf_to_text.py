@@ -5,46 +5,87 @@ Very simple script that simply iterates over all files data/pdf/f.pdf
 and create a file data/txt/f.pdf.txt that contains the raw text, extracted
 using the "pdftotext" command. If a pdf cannot be converted, this
 script will not produce the output file.
+
+Conversions run on a pool of workers, each pdftotext call is killed after a
+timeout, and failures are appended to a log file.
 """
 
 import os
 import sys
 import time
 import shutil
-import pickle
+import argparse
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from utils import Config
 
-# make sure pdftotext is installed
-if not shutil.which('pdftotext'): # needs Python 3.3+
-  print('ERROR: you don\'t have pdftotext installed. Install it first before calling this script')
-  sys.exit()
-
-if not os.path.exists(Config.txt_dir):
-  print('creating ', Config.txt_dir)
-  os.makedirs(Config.txt_dir)
+def convert(pdf_path, txt_path, timeout):
+  """
+  runs pdftotext on one pdf, writing to a temporary file that is renamed into place.
+  returns None on success and the reason of the failure otherwise.
+  """
+  tmp_path = txt_path + '.tmp'
+  try:
+    result = subprocess.run(['pdftotext', pdf_path, tmp_path], stdout=subprocess.DEVNULL,
+                            stderr=subprocess.PIPE, timeout=timeout)
+    if result.returncode == 0 and os.path.isfile(tmp_path):
+      os.replace(tmp_path, txt_path)
+      return None
+    reason = 'exit code %d: %s' % (result.returncode, result.stderr.decode('utf-8', 'replace').strip().replace('\n', ' '))
+  except subprocess.TimeoutExpired:
+    reason = 'timed out after %d seconds' % (timeout, )
+  if os.path.isfile(tmp_path): os.remove(tmp_path)
+  # create empty file, but it's a record of having tried to convert
+  open(txt_path, 'w').close()
+  return reason
 
-have = set(os.listdir(Config.txt_dir))
-files = os.listdir(Config.pdf_dir)
-for i,f in enumerate(files): # there was a ,start=1 here that I removed, can't remember why it would be there. shouldn't be, i think.
+if __name__ == "__main__":
 
-  txt_basename = f + '.txt'
-  if txt_basename in have:
-    print('%d/%d skipping %s, already exists.' % (i, len(files), txt_basename, ))
-    continue
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--num-workers', type=int, default=os.cpu_count(), help='number of concurrent pdftotext processes')
+  parser.add_argument('--timeout', type=float, default=60, help='seconds after which a pdftotext process is killed')
+  parser.add_argument('--failure-log', type=str, default='pdftotext_failures.log', help='file that failed conversions are appended to')
+  parser.add_argument('--report-every', type=float, default=10, help='seconds between progress reports')
+  args = parser.parse_args()
 
-  pdf_path = os.path.join(Config.pdf_dir, f)
-  txt_path = os.path.join(Config.txt_dir, txt_basename)
-  cmd = "pdftotext %s %s" % (pdf_path, txt_path)
-  os.system(cmd)
+  # make sure pdftotext is installed
+  if not shutil.which('pdftotext'): # needs Python 3.3+
+    print('ERROR: you don\'t have pdftotext installed. Install it first before calling this script')
+    sys.exit()
 
-  print('%d/%d %s' % (i, len(files), cmd))
+  if not os.path.exists(Config.txt_dir):
+    print('creating ', Config.txt_dir)
+    os.makedirs(Config.txt_dir)
 
-  # check output was made
-  if not os.path.isfile(txt_path):
-    # there was an error with converting the pdf
-    print('there was a problem with parsing %s to text, creating an empty text file.' % (pdf_path, ))
-    os.system('touch ' + txt_path) # create empty file, but it's a record of having tried to convert
+  have = set(os.listdir(Config.txt_dir))
+  files = os.listdir(Config.pdf_dir)
+  todo = [f for f in files if f + '.txt' not in have]
+  print('%d/%d pdfs already converted, converting %d with %d workers' % (len(files) - len(todo), len(files), len(todo), args.num_workers))
 
-  time.sleep(0.01) # silly way for allowing for ctrl+c termination
+  start = time.time()
+  last_report = start
+  numdone = 0
+  numfailed = 0
+  with open(args.failure_log, 'a') as log, ThreadPoolExecutor(max_workers=args.num_workers) as pool:
+    futures = {}
+    for f in todo:
+      pdf_path = os.path.join(Config.pdf_dir, f)
+      txt_path = os.path.join(Config.txt_dir, f + '.txt')
+      futures[pool.submit(convert, pdf_path, txt_path, args.timeout)] = pdf_path
+    for future in as_completed(futures):
+      numdone += 1
+      reason = future.result()
+      if reason is not None:
+        # there was an error with converting the pdf
+        numfailed += 1
+        log.write('%s\t%s\n' % (futures[future], reason))
+        log.flush()
+      now = time.time()
+      if now - last_report >= args.report_every or numdone == len(todo):
+        rate = numdone / max(now - start, 1e-6)
+        print('converted %d/%d, failed %d, %.1f pdfs/s, ETA %ds' % (numdone, len(todo), numfailed, rate,
+              (len(todo) - numdone) / max(rate, 1e-6)))
+        last_report = now
 
+  print('finished converting %d pdfs in %.1f seconds, %d failures logged to %s' % (numdone, time.time() - start, numfailed, args.failure_log))
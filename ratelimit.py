@@ -0,0 +1,31 @@
+# Thread-safe token bucket rate limiter shared by the arXiv fetcher and PDF downloader.
+
+import threading
+import time
+
+class TokenBucket(object):
+	"""
+	Allows on average @rate acquisitions per second, with bursts of up to @burst.
+	acquire() blocks the calling thread until a token is available.
+	"""
+	def __init__(self, rate, burst=1):
+		self.rate = float(rate)
+		self.capacity = float(burst)
+		self.tokens = float(burst)
+		self.last = time.monotonic()
+		self.lock = threading.Lock()
+
+	def acquire(self, tokens=1):
+		"""
+		Takes @tokens from the bucket, sleeping until enough have been refilled.
+		"""
+		while True:
+			with self.lock:
+				now = time.monotonic()
+				self.tokens = min(self.capacity, self.tokens + (now - self.last)*self.rate)
+				self.last = now
+				if self.tokens >= tokens:
+					self.tokens -= tokens
+					return
+				wait = (tokens - self.tokens) / self.rate
+			time.sleep(wait)
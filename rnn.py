@@ -2,6 +2,8 @@
 # to predict the LDA topic assignments for abstracts
 
 from data_utils import *
+from corpus import PackedCorpus, corpus_exists, vectorize_packed, read_stale_ids
+from checkpoint import CheckpointManager, get_rng_state, set_rng_state
 import tensorflow as tf
 import matplotlib.pyplot as plt
 # suppress warnings about CPU
@@ -15,6 +17,7 @@ class Config:
 	"""
 	num_epochs = 40
 	batch_size = 120
+	prefetch_batches = 4
 	num_classes = 20
 	embed_size = 200
 	max_length = 300
@@ -22,32 +25,45 @@ class Config:
 	dropout_rate = 0.5
 	reg_strength = 0.0075
 	learning_rate = 0.001
+	dtype = "float32"
+	checkpoint_dir = "./weights/checkpoints"
+	checkpoint_secs = 600
+	checkpoint_steps = None
+	keep_checkpoints = 3
+	background_checkpoints = True
+	inference_batch_size = 1024
+	prune_embeddings = True
+	embeddings_store = "./weights/embeddings"
 
 class RNN():
 	"""
 	Class that abstracts from the TensorFlow computational graph for a RNN learning
 	task. Contains methods that build the computational graph and train the RNN.
 	"""
-	def __init__(self, config, pretrained_embeddings):
+	def __init__(self, config, pretrained_embeddings, training=True):
 		"""
-		Basic constructor that initializes class variables.
+		Basic constructor that initializes class variables. If @training is set to False,
+		only the forward graph is built, without the loss and the optimizer.
 		"""
 		self.config = config
-		self.pretrained_embeddings = pretrained_embeddings
+		self.dtype = tf.as_dtype(config.dtype)
+		self.pretrained_embeddings = pretrained_embeddings.astype(config.dtype, copy=False)
 		self.add_placeholders()
 		self.logits, self.states = self.add_prediction_op()
-		self.loss = self.add_loss_op(self.logits)
-		self.train_op = self.add_training_op(self.loss)
+		if training:
+			self.loss = self.add_loss_op(self.logits)
+			self.train_op = self.add_training_op(self.loss)
 
 	def add_placeholders(self):
 		"""
 		Creates placeholder tensors to store the input vectorized abstracts, their unpadded 
-		lengths, ground truth labels, and dropout rate.
+		lengths, ground truth labels, and dropout rate. The time dimension of the abstracts
+		is left open, so that each batch is only padded to its longest abstract.
 		"""
-		self.abstracts_placeholder = tf.placeholder(tf.int32, shape=(None, self.config.max_length))
+		self.abstracts_placeholder = tf.placeholder(tf.int32, shape=(None, None))
 		self.lengths_placeholder = tf.placeholder(tf.int32, shape=(None,))
 		self.labels_placeholder = tf.placeholder(tf.int32, shape=(None,))
-		self.dropout_placeholder = tf.placeholder(tf.float64)
+		self.dropout_placeholder = tf.placeholder(self.dtype)
 
 	def create_feed_dict(self, abstracts_batch, lengths_batch, labels_batch=None, dropout_rate=1):
 		"""
@@ -64,11 +80,34 @@ class RNN():
 	def add_embedding_op(self):
 		"""	
 		Adds the embedding layer that maps from the vectorized abstracts to word embeddings.
+		The frozen embeddings are fed into a local variable by initialize(), rather than
+		stored as a constant in the graph, so they are not written into checkpoints.
 		"""
-		embedding_tensor = tf.Variable(self.pretrained_embeddings, trainable=False)
+		embed_size = self.pretrained_embeddings.shape[1]
+		# the number of rows is left open, so that set_embeddings() can add new tokens later
+		self.embeddings_placeholder = tf.placeholder(self.dtype, shape=(None, embed_size))
+		embedding_tensor = tf.Variable(self.embeddings_placeholder, trainable=False, validate_shape=False,
+									   collections=[tf.GraphKeys.LOCAL_VARIABLES])
+		self.embeddings_init = embedding_tensor.initializer
 		lookup = tf.nn.embedding_lookup(embedding_tensor, self.abstracts_placeholder)
+		lookup.set_shape((None, None, embed_size))
 		return lookup
 
+	def initialize(self, sess):
+		"""
+		Initializes all variables, and feeds the pretrained embeddings into the embedding layer.
+		"""
+		sess.run(tf.global_variables_initializer())
+		self.set_embeddings(sess, self.pretrained_embeddings)
+
+	def set_embeddings(self, sess, embeddings):
+		"""
+		Feeds @embeddings into the embedding layer without touching the other variables, e.g.
+		to extend the table with tokens that show up after the weights were restored.
+		"""
+		self.pretrained_embeddings = embeddings.astype(self.config.dtype, copy=False)
+		sess.run(self.embeddings_init, {self.embeddings_placeholder: self.pretrained_embeddings})
+
 	def add_prediction_op(self):
 		"""
 		Adds one layer of LSTM cells that computes a hidden state vector for each full pass of
@@ -78,12 +117,12 @@ class RNN():
 		x = self.add_embedding_op()
 		batch_size = tf.shape(x)[0]
 		cell = tf.nn.rnn_cell.BasicLSTMCell(self.config.hidden_size, reuse=tf.AUTO_REUSE)
-		init_state = tf.nn.rnn_cell.LSTMStateTuple(tf.zeros(shape=(batch_size, self.config.hidden_size), dtype=tf.float64),
-					  							   tf.zeros(shape=(batch_size, self.config.hidden_size), dtype=tf.float64))
+		init_state = tf.nn.rnn_cell.LSTMStateTuple(tf.zeros(shape=(batch_size, self.config.hidden_size), dtype=self.dtype),
+					  							   tf.zeros(shape=(batch_size, self.config.hidden_size), dtype=self.dtype))
 
-		U = tf.get_variable("U", shape=(self.config.hidden_size, self.config.num_classes), dtype=tf.float64, 
+		U = tf.get_variable("U", shape=(self.config.hidden_size, self.config.num_classes), dtype=self.dtype, 
 											initializer = tf.contrib.layers.xavier_initializer())
-		outputs, states = tf.nn.dynamic_rnn(cell, inputs=x, sequence_length=self.lengths_placeholder, initial_state=init_state, dtype=tf.float64)
+		outputs, states = tf.nn.dynamic_rnn(cell, inputs=x, sequence_length=self.lengths_placeholder, initial_state=init_state, dtype=self.dtype)
 		# use the hidden state (corresponding to states[1]) when calculating logits
 		states_drop = tf.nn.dropout(states[1], self.dropout_placeholder)
 		logits = tf.matmul(states_drop, U)
@@ -136,29 +175,94 @@ class RNN():
 		states = sess.run(self.states, feed_dict)
 		return np.array(states)
 
-def preprocess_data(topics_file, labels_file, abstracts_dir, embeddings_file, max_embed, max_length):
+def preprocess_data(topics_file, labels_file, abstracts_dir, embeddings_file, max_embed, max_length, corpus_prefix=None):
 	"""
 	Helper function to load and preprocess data for the RNN. Returns the padded, vectorized
-	abstracts, along with their unpadded lengths, the LDA labels, and word embeddings.
+	abstracts, along with their unpadded lengths, the LDA labels, word embeddings, and
+	file names (paper IDs) of the abstracts. Reads the packed corpus at @corpus_prefix if
+	it exists, and the tokenized files in @abstracts_dir otherwise.
 	"""
 	# load LDA topics and abstract labels into memory (as lists)
 	topics, labels = load_labels(topics_file, labels_file)
 	# call next function to obtain the other data
-	vectorized_abstracts, orig_lengths, new_embeddings = process_test_data(abstracts_dir, embeddings_file, max_embed, max_length)
-	return(vectorized_abstracts, orig_lengths, labels, new_embeddings)
+	if corpus_prefix is not None and corpus_exists(corpus_prefix):
+		vectorized_abstracts, orig_lengths, new_embeddings, fnames = process_corpus(corpus_prefix, embeddings_file, max_embed, max_length)
+	else:
+		vectorized_abstracts, orig_lengths, new_embeddings, fnames = process_test_data(abstracts_dir, embeddings_file, max_embed, max_length,
+																						prune=Config.prune_embeddings)
+	return(vectorized_abstracts, orig_lengths, labels, new_embeddings, fnames)
+
+def build_embeddings(tokens, embeddings_file, max_embed):
+	"""
+	Builds the embedding table of the model: the pretrained embeddings of the tokens in
+	@tokens, plus the <NULL> token that every other token maps to. Saves it next to the
+	weights, so that later runs encode abstracts with the same table.
+	"""
+	vocab, embeddings = prune_embeddings(tokens, embeddings_file, max_embed, Config.dtype)
+	new_vocab, new_embeddings = add_null_token(vocab, embeddings)
+	save_embeddings_store(Config.embeddings_store, new_vocab, new_embeddings)
+	return(new_vocab, new_embeddings)
+
+def load_model_embeddings(embeddings_file, max_embed, tokens=None):
+	"""
+	Returns the vocabulary and embedding table that the model was trained with: the table
+	saved by build_embeddings() if there is one, and otherwise the first @max_embed
+	pretrained embeddings plus the <NULL> token. The saved table only holds the tokens of
+	the training corpus, so it is extended with the pretrained rows of any of @tokens that
+	it lacks, rather than mapping new terms to <NULL>.
+	"""
+	if has_embeddings_store(Config.embeddings_store):
+		vocab, embeddings = load_embeddings_store(Config.embeddings_store)
+		embeddings = np.asarray(embeddings, dtype=Config.dtype)
+		if tokens is not None:
+			full_vocab, full_embeddings = load_embeddings_array(embeddings_file, max_embed)
+			vocab, embeddings = extend_embeddings(vocab, embeddings, tokens, full_vocab, full_embeddings,
+												  build_vocab_index(full_vocab))
+		return(vocab, embeddings)
+	vocab, embeddings = load_embeddings_array(embeddings_file, max_embed)
+	return add_null_token(vocab, embeddings, Config.dtype)
+
+def process_corpus(corpus_prefix, embeddings_file, max_embed, max_length):
+	"""
+	Helper function to pad and vectorize the abstracts of the packed corpus.
+	"""
+	packed = PackedCorpus(corpus_prefix)
+	stale = read_stale_ids(corpus_prefix)
+	if len(stale) > 0:
+		print("Warning: %i abstracts in %s are out of date. Rebuild the corpus with corpus.py and rerun lda.py." % (len(stale), corpus_prefix))
+	# keep only the embeddings of tokens that occur in the corpus, plus the <NULL> token
+	if Config.prune_embeddings:
+		new_vocab, new_embeddings = build_embeddings(packed.vocab, embeddings_file, max_embed)
+	else:
+		new_vocab, new_embeddings = load_model_embeddings(embeddings_file, max_embed)
+	# pad and vectorize abstracts straight from the token buffer
+	vectorized_abstracts, orig_lengths = vectorize_packed(packed, build_vocab_index(new_vocab), max_length)
+	print("Finished vectorizing %i abstracts from %s." % (len(packed), corpus_prefix))
+	return(vectorized_abstracts, orig_lengths, new_embeddings, packed.ids)
 
-def process_test_data(test_dir, embeddings_file, max_embed, max_length):
+def process_test_data(test_dir, embeddings_file, max_embed, max_length, prune=False):
 	"""
 	Helper function to load, pad, and vectorize the test abstract(s).
 	"""
 	# load tokenized abstracts and file names into memory (as lists)
 	fnames, abstracts = load_abstracts(test_dir)
-	# load pre-trained embeddings and vocabulary into memory (as arrays)
-	vocab, embeddings = load_embeddings_array(embeddings_file, max_embed)
-	# pad abstracts, and add <NULL> token to vocabulary and word embeddings
-	new_abstracts, orig_lengths, new_vocab, new_embeddings = pad_abstracts(abstracts, vocab, embeddings, max_length)
-	# vectorize abstracts_batch
-	vectorized_abstracts = vectorize_abstracts(new_abstracts, new_vocab)
+	vectorized_abstracts, orig_lengths, new_embeddings = process_abstracts(abstracts, embeddings_file, max_embed, max_length, prune)
+	return(vectorized_abstracts, orig_lengths, new_embeddings, fnames)
+
+def process_abstracts(abstracts, embeddings_file, max_embed, max_length, prune=False):
+	"""
+	Helper function to pad and vectorize a list of tokenized abstracts. If @prune is set to
+	True, builds a new embedding table from the tokens of @abstracts (for training), and
+	otherwise uses the table the model was trained with, extended with any new tokens.
+	"""
+	if prune:
+		new_vocab, new_embeddings = build_embeddings({token for abstract in abstracts for token in abstract.split(" ")},
+													 embeddings_file, max_embed)
+	else:
+		new_vocab, new_embeddings = load_model_embeddings(embeddings_file, max_embed,
+														  {token for abstract in abstracts for token in abstract.split(" ")})
+	# pad and vectorize abstracts in one pass
+	vectorized_abstracts, orig_lengths = pad_and_vectorize(abstracts, build_vocab_index(new_vocab), max_length)
 	return(vectorized_abstracts, orig_lengths, new_embeddings)
 
 def split_data(abstracts, lengths, labels, train_ratio):
@@ -177,36 +281,58 @@ def split_data(abstracts, lengths, labels, train_ratio):
 	return(train_set, val_set)
 
 def train(abstracts, lengths, labels, embeddings, 
-					val_abstracts=None, val_lengths=None, val_labels=None, predict=False):
+					val_abstracts=None, val_lengths=None, val_labels=None, predict=False, resume=False):
 	"""
 	Main loop that implements the training over all epochs. If @predict is set to True,
-	also computes the training and validation accuracies during training.
+	also computes the training and validation accuracies during training. Checkpoints are
+	saved according to the policy in Config; if @resume is set to True, training continues
+	from the latest checkpoint, at the same batch of the same epoch. The final weights are
+	saved to ./weights/train.
 	"""
 	config = Config()
 	rnn = RNN(config, embeddings)
 	print("Initialized RNN object.")
-	init = tf.global_variables_initializer()
 	saver = tf.train.Saver()
 	print("===============================================================")
 	with tf.Session() as session:
-		session.run(init)
-		for epoch in range(config.num_epochs):
+		rnn.initialize(session)
+		checkpoints = CheckpointManager(session, config.checkpoint_dir, config.checkpoint_secs, config.checkpoint_steps,
+										config.keep_checkpoints, config.background_checkpoints)
+		progress = checkpoints.restore() if resume else None
+		start_epoch, skip_batches, step = 0, 0, 0
+		if progress is not None:
+			start_epoch, skip_batches, step = progress["epoch"], progress["batch"], progress["step"]
+			# replay the RNG from the start of the interrupted epoch to get the same batches
+			set_rng_state(progress["rng"])
+		for epoch in range(start_epoch, config.num_epochs):
 			print("\nTraining epoch number %i of %i:" % (epoch+1, config.num_epochs))
-			prog = Progbar(target=1 + len(labels)/config.batch_size)
+			prog = Progbar(target=1 + len(labels)/config.batch_size, metric="train")
 			losses = []
 			if predict:
 				train_accuracies = []
 				val_accuracies = []
-			for i, batch in enumerate(get_minibatches(abstracts, lengths, labels, config.batch_size)):
+			epoch_rng = get_rng_state()
+			for i, batch in enumerate(prefetch(get_bucketed_minibatches(abstracts, lengths, labels, config.batch_size),
+																config.prefetch_batches)):
+				if i < skip_batches: continue
+				batch_start = time.time()
 				loss = rnn.train_on_batch(session, *batch)
+				metrics.throughput("train_abstracts", len(batch[2]), time.time()-batch_start)
 				losses.append(loss)
+				step += 1
 				prog.update(i+1, [("Loss", loss)])
-				save_path = saver.save(session, "./weights/train")
+				progress = {"epoch": epoch, "batch": i+1, "step": step, "rng": epoch_rng}
 				if predict and (((i+1)%15) == 0):
 					train_accuracies.append(predict_during_training(rnn, session, *batch))
 					val_accuracies.append(predict_during_training(rnn, session, val_abstracts, val_lengths, val_labels))
+					checkpoints.report(progress, val_accuracies[-1])
+				checkpoints.maybe_save(progress)
+			skip_batches = 0
 			save_loss(losses)
 			save_accuracies(train_accuracies, val_accuracies)
+			metrics.flush()
+		checkpoints.wait()
+		saver.save(session, "./weights/train")
 	print("\n\n===============================================================\n")		
 
 def save_loss(losses):
@@ -238,9 +364,10 @@ def predict_during_training(model, session, abstracts, lengths, labels):
 	Helper function to make a prediction on the training or validation set
 	during training.
 	"""
-	out = []
-	for i, batch in enumerate(get_minibatches(abstracts, lengths, labels, model.config.batch_size, shuffle=False)):
-		out.extend(model.predict_on_batch(session, batch[0], batch[1]))
+	out = np.empty(len(labels), dtype=np.int64)
+	batches = get_bucketed_minibatches(abstracts, lengths, labels, model.config.batch_size, shuffle=False, return_indices=True)
+	for abstracts_batch, lengths_batch, _, indices in prefetch(batches, model.config.prefetch_batches):
+		out[indices] = model.predict_on_batch(session, abstracts_batch, lengths_batch)
 	accuracy = np.mean(out == labels)
 	return accuracy
 
@@ -253,20 +380,21 @@ def predict(abstracts, lengths, labels, embeddings, get_states=False):
 	tf.reset_default_graph()
 	print("Making predictions on validation set...")
 	config = Config()
-	rnn = RNN(config, embeddings)
+	rnn = RNN(config, embeddings, training=False)
 	
 	if get_states: 
 		requested_op = rnn.get_states_on_batch
 	else:
 		requested_op = rnn.predict_on_batch
-	saver = tf.train.Saver()
-	out = []
+	out = [None]*len(labels)
 
 	with tf.Session() as session:
-		saver.restore(session, "./weights/train")
+		restore_inference_weights(session, rnn)
 		prog = Progbar(target=1 + len(labels)/config.batch_size)
-		for i, batch in enumerate(get_minibatches(abstracts, lengths, labels, config.batch_size, shuffle=False)):
-			out.extend(requested_op(session, batch[0], batch[1]))
+		batches = get_bucketed_minibatches(abstracts, lengths, labels, config.batch_size, shuffle=False, return_indices=True)
+		for i, (abstracts_batch, lengths_batch, _, indices) in enumerate(prefetch(batches, config.prefetch_batches)):
+			for index, output in zip(indices, requested_op(session, abstracts_batch, lengths_batch)):
+				out[index] = output
 			prog.update(i+1)
 	print("\n")
 
@@ -284,44 +412,65 @@ def get_states(abstracts, lengths, embeddings):
 	tf.reset_default_graph()
 	print("Getting hidden state for test abstract(s)...")
 	config = Config()
-	rnn = RNN(config, embeddings)
-	saver = tf.train.Saver()
+	rnn = RNN(config, embeddings, training=False)
 	
 	with tf.Session() as session:
-		saver.restore(session, "./weights/train")
+		restore_inference_weights(session, rnn)
 		states = rnn.get_states_on_batch(session, abstracts, lengths)
 
 	return(states)
 
-def get_all_states(abstracts, lengths, labels, embeddings):
+def restore_inference_weights(session, rnn):
+	"""
+	Initializes the forward graph of @rnn and restores its trained weights. The frozen word
+	embeddings are fed in from the pretrained embeddings, so they are not read from the
+	checkpoint.
+	"""
+	rnn.initialize(session)
+	tf.train.Saver(tf.trainable_variables()).restore(session, "./weights/train")
+
+def get_all_states(abstracts, lengths, embeddings, fpath=None, ids=None, batch_size=None):
 	"""
 	Uses the trained model weights to obtain the final hidden state vector
-	of the RNN for all training abstracts. Differs from the predict() function in the
-	use of a generator here to prevent out-of-memory issues.
+	of the RNN for all abstracts. Only the forward graph is built, and abstracts are run
+	in batches of Config.inference_batch_size (or @batch_size). Every batch is written to
+	its rows of a preallocated matrix, so memory does not grow beyond the output. If
+	@fpath is given, the output is a binary state file keyed by the paper IDs @ids, which
+	is filled in place, replaces any previous file once complete, and is returned
+	memory-mapped.
 	"""
 	tf.reset_default_graph()
 	print("Getting hidden state for all abstracts...")
 	config = Config()
-	rnn = RNN(config, embeddings)
-	saver = tf.train.Saver()
-	states = np.empty(shape=(0, config.hidden_size), dtype=float)
+	batch_size = batch_size or config.inference_batch_size
+	rnn = RNN(config, embeddings, training=False)
+	if fpath is None:
+		states = np.empty(shape=(len(abstracts), config.hidden_size), dtype=config.dtype)
+	else:
+		states = create_states(fpath, ids, config.hidden_size, config.dtype)
 
 	with tf.Session() as session:
-		saver.restore(session, "./weights/train")
-		prog = Progbar(target=1 + len(labels)/config.batch_size)
-		for i, batch in enumerate(get_minibatches(abstracts, lengths, labels, config.batch_size, shuffle=False)):
-			batch_states = rnn.get_states_on_batch(session, batch[0], batch[1])
-			states = np.append(states, batch_states, axis=0)
+		restore_inference_weights(session, rnn)
+		prog = Progbar(target=1 + len(abstracts)/batch_size, metric="states")
+		# batches are bucketed by length, so write each one back to the rows of its abstracts
+		batches = get_bucketed_minibatches(abstracts, lengths, np.zeros(len(abstracts), dtype=np.int32), batch_size,
+										   shuffle=False, return_indices=True)
+		for i, (abstracts_batch, lengths_batch, _, indices) in enumerate(prefetch(batches, config.prefetch_batches)):
+			batch_start = time.time()
+			states[indices] = rnn.get_states_on_batch(session, abstracts_batch, lengths_batch)
+			metrics.throughput("states_abstracts", len(indices), time.time()-batch_start)
 			prog.update(i+1)
+	if fpath is not None: commit_states(fpath, states)
+	metrics.flush()
 	print("\n")
 	return states
 
-def save_states(states):
+def save_states(states, fnames, fpath="hidden_states"):
 	"""
-	Writes the final hidden state vector of the RNN for all input abstracts
-	into a text file.
+	Writes the final hidden state vector of the RNN for all input abstracts,
+	along with their file names, into a binary state file.
 	"""
-	np.savetxt("hidden_states", states, delimiter=" ")
+	write_states(fpath, states, fnames)
 
 if __name__ == "__main__":
 	start = time.time()
@@ -330,6 +479,7 @@ if __name__ == "__main__":
 	parser.add_argument("--lda-topics", type=str, default="lda_topics", help="lda_topics file")
 	parser.add_argument("--lda-assignments", type=str, default="lda_assignments", help="lda_assignments file")
 	parser.add_argument("--abs-dir-tok", type=str, default="data/abstracts_tokenized", help="Directory that stores tokenized abstracts.")
+	parser.add_argument("--corpus", type=str, default="data/corpus", help="Path prefix of the packed corpus files.")
 	parser.add_argument("--embeddings", type=str, default="glove/embeddings.txt", help="Path to pre-trained word embeddings.")
 	parser.add_argument("--max-embed", type=int, default=209126, help="Maximum number of embeddings to load.")
 	parser.add_argument("--max-length", type=int, default=300, help="Maximum abstract length.")
@@ -337,28 +487,49 @@ if __name__ == "__main__":
 	parser.add_argument("--train-all", action="store_true", default=False, help="Train on all available abstracts and LSTM hidden states.")
 	parser.add_argument("--test", action="store_true", default=False, help="Get hidden states for test abstracts.")
 	parser.add_argument("--test-dir", type=str, default="data/test/", help="Directory containing the test abstracts.")
+	parser.add_argument("--hidden-test", type=str, default="hidden_states_test", help="File to write the hidden states of the test abstracts to.")
+	parser.add_argument("--seed", type=int, default=0, help="Seed of the train/validation split, which a resumed run must reuse.")
+	parser.add_argument("--inference-batch-size", type=int, default=Config.inference_batch_size, help="Batch size when getting hidden states.")
+	parser.add_argument("--metrics-file", type=str, default=None, help="File to export metrics to (disabled if not given).")
+	parser.add_argument("--metrics-format", type=str, default="jsonl", choices=["jsonl", "prometheus"], help="Format of the metrics file.")
+	parser.add_argument("--resume", action="store_true", default=False, help="Resume training from the latest checkpoint.")
+	parser.add_argument("--checkpoint-secs", type=float, default=Config.checkpoint_secs, help="Seconds between checkpoints.")
+	parser.add_argument("--checkpoint-steps", type=int, default=Config.checkpoint_steps, help="Training steps between checkpoints.")
+	parser.add_argument("--keep-checkpoints", type=int, default=Config.keep_checkpoints, help="Number of recent checkpoints to keep.")
 	args = parser.parse_args()	
 
 	if not (args.train or args.train_all or args.test):
 		raise ValueError("Please include either '--train' or '--train-all' as a command line argument.")
+	metrics.configure(args.metrics_file, args.metrics_format)
+	Config.checkpoint_secs = args.checkpoint_secs
+	Config.checkpoint_steps = args.checkpoint_steps
+	Config.keep_checkpoints = args.keep_checkpoints
 
 	if args.train:
-		abstracts, lengths, labels, embeddings = preprocess_data(args.lda_topics, args.lda_assignments, args.abs_dir_tok, 
-														args.embeddings, args.max_embed, args.max_length)
+		abstracts, lengths, labels, embeddings, _ = preprocess_data(args.lda_topics, args.lda_assignments, args.abs_dir_tok, 
+														args.embeddings, args.max_embed, args.max_length, args.corpus)
+		np.random.seed(args.seed)
 		train_set, validation_set = split_data(abstracts, lengths, labels, train_ratio=0.9)
-		train(*train_set, embeddings, *validation_set, predict=True)
+		train(*train_set, embeddings, *validation_set, predict=True, resume=args.resume)
 		# accuracy = predict(*validation_set, embeddings)
 		# print("Accuracy on validation set is: %.2f" % accuracy)
 	elif args.train_all:
-		abstracts, lengths, labels, embeddings = preprocess_data(args.lda_topics, args.lda_assignments, args.abs_dir_tok, 
-														args.embeddings, args.max_embed, args.max_length)
+		abstracts, lengths, labels, embeddings, fnames = preprocess_data(args.lda_topics, args.lda_assignments, args.abs_dir_tok, 
+														args.embeddings, args.max_embed, args.max_length, args.corpus)
 		# train(abstracts, lengths, labels, embeddings)
-		states = get_all_states(abstracts, lengths, labels, embeddings)
-		save_states(states)
+		get_all_states(abstracts, lengths, embeddings, "hidden_states", fnames, args.inference_batch_size)
 	elif args.test:
-		os.system("bash ./test.sh")
-		abstracts, lengths, embeddings = process_test_data(args.test_dir + "/tokenized", args.embeddings, args.max_embed, args.max_length)
-		states = get_states(abstracts, lengths, embeddings)
-		np.savetxt("hidden_states_test", states, delimiter=" ")
-
+		# imported here since the encoder module builds on this one
+		from encoder import Encoder
+		fnames = sorted(f for f in os.listdir(args.test_dir) if os.path.isfile(os.path.join(args.test_dir, f)))
+		texts = []
+		for fname in fnames:
+			with open(os.path.join(args.test_dir, fname), "r") as f:
+				texts.append(f.read())
+		encoder = Encoder(args.embeddings, args.max_embed, args.max_length)
+		states = encoder.encode(texts)
+		encoder.close()
+		save_states(states, fnames, args.hidden_test)
+
+	metrics.flush()
 	print("Total time taken: %.2f" % (time.time()-start))
\ No newline at end of file
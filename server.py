@@ -0,0 +1,222 @@
+# Local recommendation service. Loads the hidden states, paper IDs, nearest neighbor
+# index and paper titles once, then answers queries over HTTP on localhost.
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from knn import load_states, build_code_map, get_index
+from knn_index import IVFIndex, ExactIndex
+from corpus import load_paper_ids
+from metadata import MetadataStore, DB_PATH
+import metrics
+import argparse
+import json
+import os
+import time
+
+class Recommender(object):
+	"""
+	Keeps everything needed to answer nearest neighbor queries resident in memory.
+	"""
+	def __init__(self, states_file, db_file, index_file=None, nprobe=None, corpus_prefix=None, abs_dir_tok=None):
+		"""
+		Loads the hidden states and their paper IDs, the approximate index (or an exact
+		fallback when @index_file is None or missing), and the title of every paper.
+		"""
+		start = time.time()
+		self.states, self.codes = load_states(states_file, num_rows=None)
+		# legacy text state files do not record paper IDs
+		if self.codes is None:
+			self.codes = load_paper_ids(corpus_prefix, abs_dir_tok)
+		self.code_map = build_code_map(self.codes)
+		if index_file is not None and os.path.exists(index_file):
+			self.index = IVFIndex.load(index_file, nprobe=nprobe)
+		else:
+			self.index = ExactIndex(self.states)
+		# read only the titles from the metadata store
+		self.titles = {code: " ".join(title.split()) for code, title in MetadataStore(db_file).titles(self.codes).items()}
+		print("Recommender ready with %i papers. Time taken: %.2f seconds." % (len(self.codes), time.time()-start))
+
+	def describe(self, index):
+		"""
+		Returns the arXiv code and title of the paper in row @index.
+		"""
+		code = self.codes[index]
+		return {"index": int(index), "code": code, "title": self.titles.get(code)}
+
+	def neighbors_by_index(self, query_indices, K=10):
+		"""
+		Returns the @K nearest neighbors of each paper in @query_indices, excluding the
+		query paper itself.
+		"""
+		if len(query_indices) == 0: return []
+		distances, neighbors = self.index.search(self.states[query_indices], K+1)
+		results = []
+		for query, dist, row in zip(query_indices, distances, neighbors):
+			keep = (row >= 0) & (row != query)
+			results.append({"query": self.describe(query),
+							"neighbors": [dict(self.describe(n), distance=float(d)) for n, d in zip(row[keep][:K], dist[keep][:K])]})
+		return results
+
+	def neighbors_by_text(self, texts, encoder, K=10):
+		"""
+		Encodes the raw abstracts in @texts and returns the @K nearest neighbors of each.
+		"""
+		if len(texts) == 0: return []
+		distances, neighbors = self.index.search(encoder.encode(texts), K)
+		results = []
+		for text, dist, row in zip(texts, distances, neighbors):
+			keep = row >= 0
+			results.append({"query": {"text": text},
+							"neighbors": [dict(self.describe(n), distance=float(d)) for n, d in zip(row[keep], dist[keep])]})
+		return results
+
+	def neighbors_by_code(self, query_codes, K=10):
+		"""
+		Returns the @K nearest neighbors of each paper in @query_codes.
+		"""
+		return self.neighbors_by_index([get_index(code, self.code_map) for code in query_codes], K)
+
+class RecommenderHandler(BaseHTTPRequestHandler):
+	"""
+	Answers GET /neighbors?code=<arXiv code>&k=<K>, GET /neighbors?index=<row>&k=<K>,
+	and POST /batch with a JSON body {"codes": [...], "indices": [...], "k": K}. If an
+	encoder is loaded, also answers POST /similar with a JSON body {"texts": [...], "k": K}
+	with the neighbors of new, raw abstracts.
+	"""
+	recommender = None
+	encoder = None
+	num_neighbors = 10
+
+	def do_GET(self):
+		url = urlparse(self.path)
+		if url.path != "/neighbors":
+			return self.send_json(404, {"error": "unknown path %s" % url.path})
+		params = parse_qs(url.query)
+		try:
+			query = self.parse_query(params.get("code", []), params.get("index", []), params.get("k", [self.num_neighbors])[0])
+		except (ValueError, TypeError, OverflowError) as e:
+			return self.send_json(400, {"error": "invalid query: %s" % e})
+		self.answer(*query)
+
+	def do_POST(self):
+		url = urlparse(self.path)
+		if url.path not in ("/batch", "/similar") or (url.path == "/similar" and self.encoder is None):
+			return self.send_json(404, {"error": "unknown path %s" % url.path})
+		try:
+			body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+		except ValueError as e:
+			return self.send_json(400, {"error": "invalid JSON body: %s" % e})
+		if not isinstance(body, dict):
+			return self.send_json(400, {"error": "invalid JSON body: expected an object"})
+		try:
+			if url.path == "/similar":
+				texts, _, K = self.parse_query(body.get("texts", []), [], body.get("k", self.num_neighbors))
+			else:
+				query = self.parse_query(body.get("codes", []), body.get("indices", []), body.get("k", self.num_neighbors))
+		except (ValueError, TypeError, AttributeError, OverflowError) as e:
+			return self.send_json(400, {"error": "invalid query: %s" % e})
+		if url.path == "/similar":
+			start = time.time()
+			results = self.recommender.neighbors_by_text(texts, self.encoder, K)
+			self.record(start)
+			return self.send_json(200, {"results": results, "latency_ms": 1000*(time.time()-start)})
+		self.answer(*query)
+
+	def parse_query(self, strings, indices, K):
+		"""
+		Checks the arguments of a query and returns them as (strings, indices, K). Raises
+		ValueError or TypeError unless @strings (codes or texts) is a list of strings,
+		@indices is a list of rows of the hidden states, and @K is a positive integer.
+		"""
+		if not isinstance(strings, list) or not all(isinstance(s, str) for s in strings):
+			raise TypeError("expected a list of strings, got %r" % (strings,))
+		if not isinstance(indices, list):
+			raise TypeError("expected a list of indices, got %r" % (indices,))
+		# reject floats such as 1.5 instead of truncating them
+		if any(isinstance(i, float) for i in indices + [K]):
+			raise TypeError("indices and k must be integers")
+		indices = [int(i) for i in indices]
+		K = int(K)
+		if K <= 0:
+			raise ValueError("k must be positive, got %i" % K)
+		num_rows = len(self.recommender.codes)
+		for i in indices:
+			# negative indices would wrap around and defeat the exclusion of the query paper
+			if not 0 <= i < num_rows:
+				raise ValueError("index %i is outside [0, %i)" % (i, num_rows))
+		return(strings, indices, K)
+
+	def answer(self, codes, indices, K):
+		"""
+		Runs the queries and sends the results along with the server-side latency.
+		"""
+		start = time.time()
+		try:
+			results = self.recommender.neighbors_by_code(codes, K) + self.recommender.neighbors_by_index(indices, K)
+		except (KeyError, IndexError) as e:
+			return self.send_json(400, {"error": "unknown query: %s" % e})
+		self.record(start)
+		self.send_json(200, {"results": results, "latency_ms": 1000*(time.time()-start)})
+
+	def record(self, start):
+		"""
+		Records the latency of a request that started at @start in the metrics.
+		"""
+		metrics.observe("server_request_seconds", time.time()-start)
+		metrics.maybe_flush()
+
+	def send_json(self, status, payload):
+		body = json.dumps(payload).encode("utf-8")
+		self.send_response(status)
+		self.send_header("Content-Type", "application/json")
+		self.send_header("Content-Length", str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def log_message(self, format, *args):
+		pass
+
+def serve(recommender, host="127.0.0.1", port=8000, num_neighbors=10, encoder=None):
+	"""
+	Serves @recommender, and @encoder if given, over HTTP until interrupted.
+	"""
+	RecommenderHandler.recommender = recommender
+	RecommenderHandler.encoder = encoder
+	RecommenderHandler.num_neighbors = num_neighbors
+	httpd = ThreadingHTTPServer((host, port), RecommenderHandler)
+	print("Serving recommendations on http://%s:%i" % (host, port))
+	try:
+		httpd.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	httpd.server_close()
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser()
+	parser.add_argument("--db-name", type=str, default=DB_PATH, help="Path to the paper metadata store.")
+	parser.add_argument("--abs-dir-tok", type=str, default="data/abstracts_tokenized", help="Directory that stores tokenized abstracts.")
+	parser.add_argument("--corpus", type=str, default="data/corpus", help="Path prefix of the packed corpus files.")
+	parser.add_argument("--hidden-states", type=str, default="hidden_states", help="File that stores the hidden states output by rnn.py.")
+	parser.add_argument("--index-file", type=str, default="knn_index.npz", help="Approximate nearest neighbor index built by knn.py --build-index.")
+	parser.add_argument("--nprobe", type=int, default=None, help="Number of index lists scanned per query. Higher is slower but more accurate.")
+	parser.add_argument("--exact", action="store_true", default=False, help="Use exact search even if an index exists.")
+	parser.add_argument("--num-neighbors", type=int, default=10, help="Default number of nearest neighbors to return.")
+	parser.add_argument("--host", type=str, default="127.0.0.1", help="Address to listen on.")
+	parser.add_argument("--port", type=int, default=8000, help="Port to listen on.")
+	parser.add_argument("--metrics-file", type=str, default=None, help="File to export metrics to (disabled if not given).")
+	parser.add_argument("--metrics-format", type=str, default="jsonl", choices=["jsonl", "prometheus"], help="Format of the metrics file.")
+	parser.add_argument("--encode", action="store_true", default=False, help="Load the RNN to answer POST /similar for raw abstracts.")
+	parser.add_argument("--embeddings", type=str, default="glove/embeddings.txt", help="Path to pre-trained word embeddings.")
+	parser.add_argument("--max-embed", type=int, default=209126, help="Maximum number of embeddings to load.")
+	parser.add_argument("--max-length", type=int, default=300, help="Maximum abstract length.")
+	args = parser.parse_args()
+	metrics.configure(args.metrics_file, args.metrics_format)
+
+	recommender = Recommender(args.hidden_states, args.db_name, None if args.exact else args.index_file,
+							  args.nprobe, args.corpus, args.abs_dir_tok)
+	encoder = None
+	if args.encode:
+		# imported here so that serving precomputed states does not need TensorFlow
+		from encoder import Encoder
+		encoder = Encoder(args.embeddings, args.max_embed, args.max_length)
+	serve(recommender, args.host, args.port, args.num_neighbors, encoder)
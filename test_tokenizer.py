@@ -0,0 +1,26 @@
+# Regression tests for tokenizer.py. Each abstract fragment is paired with the output of
+# the Stanford PTBTokenizer run with -lowerCase (as in abstracts.sh), joined with spaces.
+
+from tokenizer import tokenize, format_tokens
+
+PTB_OUTPUT = [
+	("We use 10-fold cross-validation on 3-5 runs.",
+	 "we use 10-fold cross-validation on 3-5 runs ."),
+	("Results for 2D and 3D models are shown in Fig. 4.",
+	 "results for 2d and 3d models are shown in fig. 4 ."),
+	("3D-printed scaffolds improve the accuracy by 50%.",
+	 "3d-printed scaffolds improve the accuracy by 50 % ."),
+	("A 50%-accurate baseline costs 1,000 GPU hours, i.e. 3.5 times more.",
+	 "a 50%-accurate baseline costs 1,000 gpu hours , i.e. 3.5 times more ."),
+	("The model doesn't converge (see e.g. Smith et al.) in 2010.",
+	 "the model does n't converge -lrb- see e.g. smith et al. -rrb- in 2010 ."),
+	("Our method's state-of-the-art F1 score is 0.87 [12].",
+	 "our method 's state-of-the-art f1 score is 0.87 -lsb- 12 -rsb- ."),
+]
+
+def test_matches_ptb_output():
+	for text, expected in PTB_OUTPUT:
+		assert " ".join(tokenize(text)) == expected, text
+
+def test_format_tokens():
+	assert format_tokens(["an", "<unk>", "token"]) == "an <raw_unk> token "
@@ -0,0 +1,114 @@
+# Pure Python tokenizer that reproduces the output of abstracts.sh and test.sh, i.e. the
+# Stanford PTBTokenizer run with -lowerCase, followed by joining the tokens with white
+# space and replacing <unk> with <raw_unk>. Tokenizes a directory across a process pool
+# instead of launching one JVM per abstract. The shell scripts are kept as the reference.
+
+import argparse
+import multiprocessing
+import os
+import re
+import time
+
+# PTB names for brackets
+BRACKETS = {"(": "-lrb-", ")": "-rrb-", "[": "-lsb-", "]": "-rsb-", "{": "-lcb-", "}": "-rcb-"}
+# unicode punctuation that the PTBTokenizer rewrites into its ASCII PTB3 form
+NORMALIZED = {"“": "``", "”": "''", "‘": "`", "’": "'", "—": "--", "–": "--", "…": "..."}
+# abbreviations that keep their trailing period
+ABBREVIATIONS = ["e.g", "i.e", "al", "etc", "vs", "cf", "fig", "figs", "eq", "eqs", "ref", "refs", "resp", "approx", "sec"]
+
+# split contractions and possessives off the word they belong to, e.g. "don't" -> "do n't"
+CONTRACTIONS = re.compile(r"(\w)(n't|'(?:s|re|ve|ll|m|d))\b", re.IGNORECASE)
+TOKEN = re.compile(r"""
+	(?:(?:https?|ftp)://|www\.)[^\s<>"]*[^\s<>".,;:!?)\]}']        # urls
+	| [\w.+-]+@\w[\w-]*(?:\.\w[\w-]*)+                               # email addresses
+	| <[a-z_]+>                                                      # sgml-like tags such as <unk>
+	| \b(?:%s)\.(?!\w)                                               # abbreviations
+	| \b(?:[a-z]\.){2,}(?!\w)                                        # acronyms such as u.s.
+	| n't\b | '(?:s|re|ve|ll|m|d)\b                                  # contractions
+	| [a-z]\w*(?:\.[a-z]\w*)+(?!\w)                                  # domains and file names
+	| (?:\d+(?:[.,/]\d+)*\w*|\w+)                                    # words and numbers (1,000, 3.5, 2d),
+	  (?:(?:%%?-|['&])(?:\d+(?:[.,/]\d+)*\w*|\w+))*                  # joined into one token as in 3-5, 10-fold or 3d-printed
+	| \.\.\.+ | --+ | `` | ''                                        # multi-character punctuation
+	| [^\w\s]                                                        # any other symbol
+	""" % "|".join(re.escape(abbreviation) for abbreviation in ABBREVIATIONS), re.VERBOSE | re.IGNORECASE)
+
+def tokenize(text):
+	"""
+	Splits @text into lowercased PTB tokens and returns them as a list.
+	"""
+	for char, replacement in NORMALIZED.items():
+		text = text.replace(char, " %s " % replacement)
+	text = CONTRACTIONS.sub(r"\1 \2", text.lower())
+	tokens = []
+	for match in TOKEN.finditer(text):
+		token = match.group()
+		if token in BRACKETS:
+			token = BRACKETS[token]
+		elif token == '"' or token == "'":
+			# a quote is an opening quote if it starts a word, and a closing quote otherwise
+			start = match.start()
+			opening = start == 0 or text[start-1].isspace() or text[start-1] in "([{"
+			if token == '"': token = "``" if opening else "''"
+			elif opening: token = "`"
+		elif token.startswith("..."):
+			token = "..."
+		elif token.startswith("--"):
+			token = "--"
+		tokens.append(token)
+	return tokens
+
+def format_tokens(tokens):
+	"""
+	Joins tokens the way the shell scripts do: each token is followed by a single space,
+	and every <unk> is replaced by <raw_unk>.
+	"""
+	return "".join(token + " " for token in tokens).replace("<unk>", "<raw_unk>")
+
+def tokenize_file(src, dst):
+	"""
+	Tokenizes the text file @src and writes the result to @dst.
+	"""
+	with open(src, "r") as f:
+		text = f.read()
+	with open(dst, "w") as f:
+		f.write(format_tokens(tokenize(text)))
+
+def _tokenize_file(paths):
+	tokenize_file(*paths)
+
+def tokenize_files(pairs, processes=None, chunksize=64):
+	"""
+	Tokenizes each (source, destination) pair in @pairs across a pool of @processes
+	workers (one per core by default).
+	"""
+	pairs = list(pairs)
+	if len(pairs) == 0: return 0
+	if processes == 1:
+		for pair in pairs: _tokenize_file(pair)
+	else:
+		with multiprocessing.Pool(processes) as pool:
+			for _ in pool.imap_unordered(_tokenize_file, pairs, chunksize=chunksize): pass
+	return len(pairs)
+
+def tokenize_dir(abs_dir, abs_dir_tok, processes=None):
+	"""
+	Tokenizes every file in @abs_dir into a file of the same name in @abs_dir_tok.
+	Sub-directories (e.g. the "tokenized" folder inside data/test) are skipped.
+	"""
+	start = time.time()
+	if not os.path.exists(abs_dir_tok):
+		os.makedirs(abs_dir_tok)
+	pairs = [(os.path.join(abs_dir, fname), os.path.join(abs_dir_tok, fname)) for fname in sorted(os.listdir(abs_dir))
+			 if os.path.isfile(os.path.join(abs_dir, fname))]
+	num_files = tokenize_files(pairs, processes)
+	print("Tokenized %i abstracts into %s. Time taken: %.2f seconds." % (num_files, abs_dir_tok, time.time()-start))
+	return num_files
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser()
+	parser.add_argument("--abs-dir", type=str, default="data/abstracts", help="Directory that stores raw abstracts.")
+	parser.add_argument("--abs-dir-tok", type=str, default="data/abstracts_tokenized", help="Directory to store tokenized abstracts in.")
+	parser.add_argument("--processes", type=int, default=None, help="Number of worker processes (defaults to the number of cores).")
+	args = parser.parse_args()
+
+	tokenize_dir(args.abs_dir, args.abs_dir_tok, args.processes)